@@ -7,22 +7,74 @@
 import streamlit as st
 import pandas as pd
 import os
-from datetime import datetime
+import time
+import uuid
+
+from data_parser import parse_data_file, get_invoice_data_from_file
+from pdf_generator import list_templates, load_template, template_from_source, select_backend, plan_incremental_batch, summarize_outputs, create_zip_archive, open_pdf, PDF_PROFILES, DEFAULT_PDF_PROFILE
+from database import init_database, add_generation_record, get_history, get_statistics, delete_record, clear_history, get_latest_content_hashes, set_batch_run_status
+from output_store import store_document, allocate_output_path, new_document_id, resolve_document
+from preview import PreviewRenderer
+from data_catalog import ingest_upload, list_catalog_files
+from validation import validate_data
+from compact import compact_dataset
+from search_index import InvoiceSearchIndex, merge_selection, SEARCH_PAGE_SIZE
+from render_scheduler import scheduled_render
+from batch_runner import start_batch, run_batch, cancel_batch, get_batch_outputs, get_resumable_batches
+from snapshots import save_snapshot, regenerate_records
+
+
+# Число разобранных файлов данных, хранящихся в памяти процесса
+DATASET_CACHE_SIZE = 2
+
+
+@st.cache_resource
+def initialize_storage() -> bool:
+    """
+    Создает базу данных и рабочие директории один раз на процесс, а не при каждом перезапуске скрипта.
+
+    Returns:
+        bool: True после инициализации.
+    """
+    init_database()
+    os.makedirs('data', exist_ok=True)
+    os.makedirs('templates', exist_ok=True)
+    os.makedirs('output', exist_ok=True)
+    return True
+
+
+@st.cache_resource(max_entries=DATASET_CACHE_SIZE)
+def load_dataset(filepath: str, version: tuple) -> tuple:
+    """
+    Разбирает файл данных, переводит его в компактное представление и строит поисковый индекс.
+
+    Результат кешируется на процесс по пути и версии файла, поэтому перезапуски скрипта
+    (каждое действие в интерфейсе) не разбирают файл и не перестраивают индекс заново.
+
+    Args:
+        filepath (str): Путь к файлу данных.
+        version (tuple): Версия файла (хеш содержимого и время изменения из каталога).
+
+    Returns:
+        tuple: Компактные данные и InvoiceSearchIndex.
+    """
+    data = compact_dataset(parse_data_file(filepath))
+    return data, InvoiceSearchIndex.from_data(data)
 
-from data_parser import list_data_files, parse_csv, parse_json, get_invoice_ids, get_invoice_data, validate_data_structure
-from pdf_generator import list_templates, load_template, render_html, generate_pdf, generate_batch_pdf, create_zip_archive, open_pdf
-from database import init_database, add_generation_record, get_history, get_statistics, delete_record, clear_history
 
 # Инициализация
-init_database()
-os.makedirs('data', exist_ok=True)
-os.makedirs('templates', exist_ok=True)
-os.makedirs('output', exist_ok=True)
+initialize_storage()
+
+# Очередь сессии в общем планировщике рендеринга
+if 'render_owner' not in st.session_state:
+    st.session_state['render_owner'] = uuid.uuid4().hex
+render_owner = st.session_state['render_owner']
 
 # Боковая панель настроек
 st.sidebar.title("⚙️ Настройки")
 page_format = st.sidebar.selectbox("Формат страницы", ["A4", "Letter"], index=0)
 orientation = st.sidebar.selectbox("Ориентация", ["Portrait", "Landscape"], index=0)
+pdf_profile = st.sidebar.selectbox("Профиль оптимизации PDF", list(PDF_PROFILES), index=list(PDF_PROFILES).index(DEFAULT_PDF_PROFILE))
 
 # Основные вкладки
 tab_files, tab_templates, tab_generation, tab_history = st.tabs(["📄 Выбор файлов", "📊 Выбор шаблона", "🔧 Генерация PDF", "📜 История генераций"])
@@ -31,22 +83,26 @@ tab_files, tab_templates, tab_generation, tab_history = st.tabs(["📄 Выбо
 with tab_files:
     st.header("📄 Выбор файла данных")
 
-    # Список существующих файлов
-    files = list_data_files()
-    if files:
-        selected_file = st.selectbox("Выберите файл данных", files, key="data_file_select")
+    # Список существующих файлов из каталога (схема и статистика вычисляются один раз на версию файла)
+    catalog = {entry['filename']: entry for entry in list_catalog_files()}
+    if catalog:
+        selected_file = st.selectbox(
+            "Выберите файл данных", list(catalog), key="data_file_select",
+            format_func=lambda name: f"{name} ({catalog[name]['row_count'] or 0} строк)" + ("" if catalog[name]['valid'] else " ⚠️")
+        )
         if selected_file:
+            entry = catalog[selected_file]
             filepath = os.path.join('data', selected_file)
             try:
-                if selected_file.endswith('.csv'):
-                    data = parse_csv(filepath)
-                else:
-                    data = parse_json(filepath)
-
-                valid, msg = validate_data_structure(data)
-                if not valid:
-                    st.error(f"❌ Ошибка в данных: {msg}")
+                if not entry['valid']:
+                    st.error(f"❌ Ошибка в данных: {entry['error']}")
+                    if st.button("📋 Полный отчет об ошибках", key="validation_report_btn"):
+                        errors = validate_data(parse_data_file(filepath))
+                        st.dataframe(pd.DataFrame(errors, columns=['row', 'field', 'message']), use_container_width=True)
                 else:
+                    data, search_index = load_dataset(filepath, (entry['content_hash'], entry['mtime']))
+                    st.caption(f"Формат: {entry['format']}, кодировка: {entry['encoding']}, "
+                               f"ID: {entry['id_min']} … {entry['id_max']}")
                     st.success("✅ Файл загружен успешно")
                     # Предпросмотр
                     if isinstance(data, pd.DataFrame):
@@ -58,22 +114,25 @@ with tab_files:
 
                     # Сохраняем в session state
                     st.session_state['data'] = data
+                    st.session_state['search_index'] = search_index
                     st.session_state['data_file'] = selected_file
             except Exception as e:
                 st.error(f"❌ Ошибка загрузки файла: {e}")
 
     # Загрузка нового файла
     st.subheader("Загрузить новый файл")
-    uploaded_file = st.file_uploader("Выберите CSV или JSON файл", type=['csv', 'json'], key="file_uploader")
+    uploaded_file = st.file_uploader("Выберите CSV, JSON, XLSX или Parquet файл", type=['csv', 'json', 'xlsx', 'parquet'], key="file_uploader")
     if uploaded_file:
         if uploaded_file.size > 50 * 1024 * 1024:  # 50MB
             st.error("❌ Файл слишком большой (макс. 50MB)")
         else:
-            filepath = os.path.join('data', uploaded_file.name)
-            with open(filepath, 'wb') as f:
-                f.write(uploaded_file.getvalue())
-            st.success("✅ Файл загружен успешно")
-            st.rerun()
+            uploaded_file.seek(0)
+            stored_name, duplicate = ingest_upload(uploaded_file, uploaded_file.name)
+            if duplicate:
+                st.info(f"ℹ️ Такой файл уже загружен: {stored_name}")
+            else:
+                st.success(f"✅ Файл загружен успешно: {stored_name}")
+                st.rerun()
 
 # Вкладка выбора шаблона
 with tab_templates:
@@ -105,6 +164,28 @@ with tab_templates:
             with open(template_path, 'r', encoding='utf-8') as f:
                 current_content = f.read()
             edited_content = st.text_area("HTML код шаблона", current_content, height=400, key="template_editor")
+            try:
+                if select_backend(template_from_source(st.session_state['template_name'], edited_content)).name == 'native':
+                    st.info("ℹ️ Шаблон использует встроенную раскладку движка native: HTML и CSS применяются, "
+                            "только если движок native недоступен")
+            except ValueError as e:
+                st.error(f"❌ {e}")
+            except Exception:
+                pass
+
+            # Живой предпросмотр первой страницы на примере счета
+            if 'preview_renderer' not in st.session_state:
+                st.session_state['preview_renderer'] = PreviewRenderer()
+            renderer = st.session_state['preview_renderer']
+            preview = renderer.wait(renderer.submit(edited_content), timeout=1.0)
+            if preview and preview['stale']:
+                st.caption("⏳ Предпросмотр обновляется — показана предыдущая версия шаблона")
+            if preview and preview['png']:
+                st.image(preview['png'], caption="Предпросмотр первой страницы")
+            elif preview and preview['error']:
+                st.warning(f"⚠️ Ошибка предпросмотра: {preview['error']}")
+            else:
+                st.info("⏳ Предпросмотр обновляется...")
             col1, col2 = st.columns(2)
             with col1:
                 if st.button("💾 Сохранить изменения", key="save_template_btn"):
@@ -121,6 +202,10 @@ with tab_templates:
                     st.session_state['edit_mode'] = False
                     st.rerun()
 
+    # Вне режима редактирования фоновый поток предпросмотра не нужен
+    if not st.session_state.get('edit_mode', False) and 'preview_renderer' in st.session_state:
+        st.session_state.pop('preview_renderer').close()
+
     # Загрузка нового шаблона
     st.subheader("Загрузить новый шаблон")
     uploaded_template = st.file_uploader("Выберите HTML файл", type=['html'], key="template_uploader")
@@ -147,32 +232,39 @@ with tab_generation:
 
         try:
             template = load_template(template_name)
-            invoice_ids = get_invoice_ids(data)
+            # Поисковый индекс строится один раз на версию файла (см. load_dataset)
+            search_index = st.session_state['search_index']
+            invoice_ids = search_index.ids
 
             if not invoice_ids:
                 st.error("❌ В данных не найдены ID счетов")
             else:
                 # Одиночная генерация
                 st.subheader("Одиночная генерация")
-                search_term = st.text_input("Поиск по ID счета", key="single_search")
-                filtered_ids = [id for id in invoice_ids if search_term.lower() in id.lower()] if search_term else invoice_ids
+                search_term = st.text_input("Поиск по ID счета, покупателю или компании", key="single_search")
+                _, found_total = search_index.search(search_term, limit=0)
+                pages = max(1, (found_total + SEARCH_PAGE_SIZE - 1) // SEARCH_PAGE_SIZE)
+                # Новый запрос или файл начинает просмотр результатов с первой страницы
+                if st.session_state.get('single_page_query') != (data_file, search_term):
+                    st.session_state['single_page_query'] = (data_file, search_term)
+                    st.session_state.pop('single_page', None)
+                page = st.number_input(f"Страница результатов (найдено: {found_total})", min_value=1, max_value=pages, value=1, key="single_page") if pages > 1 else 1
+                filtered_ids, _ = search_index.search(search_term, limit=SEARCH_PAGE_SIZE, offset=(page - 1) * SEARCH_PAGE_SIZE)
                 selected_id = st.selectbox("Выберите ID счета", filtered_ids, key="single_select")
 
                 if st.button("🚀 Сгенерировать PDF", key="generate_single_btn"):
                     with st.spinner("Генерация PDF..."):
-                        invoice_data = get_invoice_data(data, selected_id)
+                        invoice_data = get_invoice_data_from_file(os.path.join('data', data_file), selected_id, data)
                         if not invoice_data:
                             st.error("❌ Данные счета не найдены")
                         else:
-                            html = render_html(template, invoice_data)
-                            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                            output_filename = f"{selected_id}_{timestamp}.pdf"
-                            output_path = os.path.join('output', output_filename)
-
-                            success = generate_pdf(html, output_path)
-                            if success:
+                            document = store_document(selected_id, lambda path: scheduled_render(template, invoice_data, path, pdf_profile, render_owner))
+                            if document:
+                                document_id, output_path = document
+                                output_filename = os.path.basename(output_path)
                                 st.success("✅ PDF сгенерирован успешно!")
-                                add_generation_record(selected_id, invoice_data.get('customer_name', ''), data_file, template_name, output_path, 'success')
+                                content_hash, template_hash = save_snapshot(invoice_data, template)
+                                add_generation_record(selected_id, invoice_data.get('customer_name', ''), data_file, template_name, output_path, 'success', content_hash=content_hash, document_id=document_id, template_hash=template_hash, profile=pdf_profile)
 
                                 # Предпросмотр и скачивание
                                 with open(output_path, 'rb') as f:
@@ -186,43 +278,90 @@ with tab_generation:
 
                 # Пакетная генерация
                 st.subheader("Пакетная генерация")
-                selected_ids = st.multiselect("Выберите ID счетов для пакетной генерации", invoice_ids, key="batch_multiselect")
-                col1, col2 = st.columns(2)
+                if st.session_state.get('batch_ids_file') != data_file:
+                    st.session_state['batch_ids'] = []
+                    st.session_state['batch_ids_file'] = data_file
+                # В списке выбора только страница результатов поиска, а не все ID набора данных
+                batch_search = st.text_input("Поиск счетов для пакета", key="batch_search")
+                found_ids, found_total = search_index.search(batch_search) if batch_search else ([], 0)
+                picked_ids = st.multiselect(f"Найденные счета (показано {len(found_ids)} из {found_total})", found_ids, key="batch_multiselect")
+                expression = st.text_input("Шаблон или диапазон ID (например, INV-2025-1* или INV-001..INV-100)", key="batch_expression")
+                col1, col2, col3 = st.columns(3)
                 with col1:
-                    if st.button("✅ Выбрать все", key="select_all_btn"):
-                        st.session_state['batch_ids'] = invoice_ids
+                    if st.button("➕ Добавить в пакет", key="add_to_batch_btn"):
+                        added = list(picked_ids) + (search_index.select(expression) if expression else [])
+                        st.session_state['batch_ids'] = merge_selection(invoice_ids, st.session_state['batch_ids'], added)
                         st.rerun()
                 with col2:
+                    if st.button("✅ Выбрать все", key="select_all_btn"):
+                        st.session_state['batch_ids'] = list(invoice_ids)
+                        st.rerun()
+                with col3:
                     if st.button("❌ Очистить выбор", key="clear_selection_btn"):
                         st.session_state['batch_ids'] = []
                         st.rerun()
 
-                if 'batch_ids' in st.session_state:
-                    selected_ids = st.session_state['batch_ids']
+                selected_ids = st.session_state['batch_ids']
+                if selected_ids:
+                    preview_ids = ', '.join(selected_ids[:10]) + (' …' if len(selected_ids) > 10 else '')
+                    st.caption(f"Выбрано счетов: {len(selected_ids)} ({preview_ids})")
+
+                only_changed = st.checkbox("♻️ Генерировать только новые и изменённые счета", value=True, key="only_changed_checkbox")
+
+                # Прерванные и отмененные пакеты можно продолжить с контрольной точки
+                batch_to_run = None
+                for run in get_resumable_batches(data_file, template_name)[:1]:
+                    counts = run['counts']
+                    total = sum(counts.values())
+                    state = "отменен" if run['status'] == 'cancelled' else "прерван"
+                    st.warning(f"⏸️ Пакет от {run['created']} {state}: готово {counts.get('done', 0)} из {total}, "
+                               f"ошибок {counts.get('failed', 0)}, осталось {counts.get('pending', 0)}")
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        if st.button("⏯️ Продолжить пакет", key="resume_batch_btn"):
+                            batch_to_run = run['batch_id']
+                    with col2:
+                        if st.button("🗑️ Отказаться от пакета", key="discard_batch_btn"):
+                            set_batch_run_status(run['batch_id'], 'discarded')
+                            st.rerun()
 
                 if selected_ids and st.button("🚀 Сгенерировать все выбранные PDF", key="generate_batch_btn"):
+                    # Инкрементальный режим: PDF неизмененных счетов берутся из предыдущих генераций
+                    previous = get_latest_content_hashes(data_file, template_name) if only_changed else {}
+                    to_render, reused, _ = plan_incremental_batch(selected_ids, data, previous, template.source_hash, pdf_profile)
+                    if reused:
+                        st.info(f"♻️ Без изменений: {len(reused)}, к генерации: {len(to_render)}")
+                    batch_to_run = start_batch(data_file, template_name, list(selected_ids), pdf_profile, reused)
+
+                if batch_to_run:
+                    # Нажатие прерывает текущий прогон скрипта; готовые счета уже сохранены в контрольных точках
+                    st.button("⏹️ Остановить", key="stop_batch_btn", on_click=cancel_batch, args=(batch_to_run,))
                     progress_bar = st.progress(0)
                     status_text = st.empty()
-                    pdf_files = []
-
-                    for i, invoice_id in enumerate(selected_ids):
-                        status_text.text(f"Генерация {i+1}/{len(selected_ids)}: {invoice_id}")
-                        invoice_data = get_invoice_data(data, invoice_id)
-                        if invoice_data:
-                            html = render_html(template, invoice_data)
-                            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                            output_filename = f"{invoice_id}_{timestamp}.pdf"
-                            output_path = os.path.join('output', output_filename)
-                            success = generate_pdf(html, output_path)
-                            if success:
-                                pdf_files.append(output_path)
-                                add_generation_record(invoice_id, invoice_data.get('customer_name', ''), data_file, template_name, output_path, 'success')
-                        progress_bar.progress((i + 1) / len(selected_ids))
-
-                    status_text.text("Завершено!")
+                    started = time.perf_counter()
+
+                    def show_progress(done, total, invoice_id, eta):
+                        progress_bar.progress(done / total)
+                        eta_text = f", осталось ~{eta:.0f} с" if eta is not None else ""
+                        status_text.text(f"Генерация {done}/{total}: {invoice_id}{eta_text}")
+
+                    run = run_batch(batch_to_run, data, template, on_progress=show_progress, owner=render_owner)
+                    pdf_files = get_batch_outputs(batch_to_run)
+                    if run['status'] == 'running':
+                        status_text.text("Пакет выполняется в другой сессии")
+                    elif run['status'] == 'cancelled':
+                        status_text.text("Остановлено — пакет можно продолжить позже")
+                    else:
+                        progress_bar.progress(1.0)
+                        status_text.text("Завершено!")
+                    report = summarize_outputs(pdf_files, time.perf_counter() - started)
+                    st.caption(f"Профиль «{run['profile']}»: {report['total_bytes'] / 1024:.1f} КБ всего, "
+                               f"{report['avg_bytes'] / 1024:.1f} КБ в среднем, {report['seconds']:.1f} с")
+                    if run['counts'].get('failed'):
+                        st.warning(f"⚠️ Не удалось сгенерировать: {run['counts']['failed']}")
                     if pdf_files:
-                        zip_filename = f"batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
-                        zip_path = os.path.join('output', zip_filename)
+                        zip_path = allocate_output_path('batch', new_document_id(), '.zip')
+                        zip_filename = os.path.basename(zip_path)
                         create_zip_archive(pdf_files, zip_path)
                         with open(zip_path, 'rb') as f:
                             zip_bytes = f.read()
@@ -280,19 +419,26 @@ with tab_history:
 
         if selected_record_id:
             record = df_history[df_history['id'] == selected_record_id].iloc[0]
+            document_path = resolve_document(record.to_dict())
             col1, col2, col3, col4 = st.columns(4)
             with col1:
-                if os.path.exists(record['output_file']) and st.button("📥 Скачать повторно", key="download_again_btn"):
-                    with open(record['output_file'], 'rb') as f:
+                if document_path and st.button("📥 Скачать повторно", key="download_again_btn"):
+                    with open(document_path, 'rb') as f:
                         pdf_bytes = f.read()
-                    st.download_button("Скачать PDF", pdf_bytes, file_name=os.path.basename(record['output_file']), key="download_record")
+                    st.download_button("Скачать PDF", pdf_bytes, file_name=os.path.basename(document_path), key="download_record")
             with col2:
-                if os.path.exists(record['output_file']) and st.button("👀 Открыть PDF", key="open_record_btn"):
-                    open_pdf(record['output_file'])
+                if document_path and st.button("👀 Открыть PDF", key="open_record_btn"):
+                    open_pdf(document_path)
             with col3:
                 if st.button("🔄 Пересоздать PDF", key="regenerate_btn"):
-                    # Логика пересоздания - упрощенная версия
-                    st.info("Функция пересоздания будет реализована в следующей версии")
+                    with st.spinner("Пересоздание PDF..."):
+                        result = regenerate_records([selected_record_id], pdf_profile, render_owner)
+                    if result['failed']:
+                        st.error("❌ Ошибка пересоздания PDF")
+                    elif result['batches']:
+                        st.success("✅ PDF пересоздан из снимка")
+                    else:
+                        st.error("❌ Для записи нет снимка данных (создана до появления снимков)")
             with col4:
                 if st.button("🗑️ Удалить запись", key="delete_record_btn"):
                     if delete_record(selected_record_id):
@@ -301,6 +447,26 @@ with tab_history:
                     else:
                         st.error("❌ Ошибка удаления")
 
+        # Пакетное пересоздание из снимков: исходные файлы данных не нужны
+        st.subheader("Пакетное пересоздание")
+        regenerate_ids = st.multiselect("Выберите записи для пересоздания", df_history['id'].tolist(), key="regenerate_multiselect")
+        if regenerate_ids and st.button("🔄 Пересоздать выбранные PDF", key="regenerate_batch_btn"):
+            progress_bar = st.progress(0)
+            status_text = st.empty()
+
+            def show_regenerate_progress(done, total, invoice_id, eta):
+                progress_bar.progress(done / total)
+                status_text.text(f"Пересоздание {done}/{total}: {invoice_id}")
+
+            result = regenerate_records(regenerate_ids, pdf_profile, render_owner, on_progress=show_regenerate_progress)
+            progress_bar.progress(1.0)
+            if result['missing']:
+                st.warning(f"⚠️ Без снимка данных (пропущены): {', '.join(map(str, result['missing']))}")
+            if result['failed']:
+                st.error(f"❌ Не удалось пересоздать: {result['failed']}")
+            if result['done']:
+                st.success(f"✅ Пересоздано PDF: {result['done']} (пакетов: {len(result['batches'])})")
+
     # Очистка истории
     st.subheader("Управление историей")
     if st.button("🗑️ Очистить всю историю", key="clear_history_btn"):
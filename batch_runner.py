@@ -0,0 +1,217 @@
+"""
+Модуль пакетной генерации с контрольными точками.
+
+Состояние каждого счета пакета (pending/done/failed) сохраняется в базе сразу
+после его обработки, поэтому прерванный пакет (закрытая вкладка, перезапуск
+процесса) продолжается с места остановки без повторной генерации готовых PDF.
+Отмена кооперативная: флаг проверяется между счетами, текущий PDF дописывается.
+Выполняющий процесс обновляет отметку активности пакета перед каждым счетом и
+фоновым потоком, пока идет рендеринг (один документ может рендериться дольше
+срока устаревания, например в очереди планировщика);
+продолжить можно только пакет, отметка которого устарела, поэтому пакет,
+выполняющийся в другой вкладке, не генерируется дважды.
+"""
+
+from typing import Callable, Dict, List, Optional
+import threading
+import time
+import uuid
+from collections import deque
+
+from data_parser import iter_invoice_data
+from database import (add_generation_record, create_batch_run, get_batch_run, get_batch_items, get_unfinished_batch_runs,
+                      update_batch_item, set_batch_run_status, claim_batch_run, touch_batch_run)
+from output_store import store_document
+from pdf_generator import DEFAULT_PDF_PROFILE
+from render_scheduler import scheduled_render
+from snapshots import save_snapshot
+
+
+# Число последних документов, по которым измеряется скорость генерации для ETA
+ETA_WINDOW = 20
+
+# Время без отметки активности, после которого выполняющийся пакет считается прерванным, в секундах
+BATCH_STALE_SECONDS = 120
+
+# Интервал фонового обновления отметки активности выполняющегося пакета, в секундах
+BATCH_HEARTBEAT_SECONDS = BATCH_STALE_SECONDS / 4
+
+
+class ThroughputMeter:
+    """
+    Скользящая оценка скорости генерации по последним ETA_WINDOW документам.
+    """
+
+    def __init__(self, window: int = ETA_WINDOW):
+        self._durations = deque(maxlen=window)
+
+    def record(self, seconds: float) -> None:
+        """
+        Добавляет время генерации одного документа.
+
+        Args:
+            seconds (float): Длительность в секундах.
+        """
+        self._durations.append(seconds)
+
+    def eta(self, remaining: int) -> Optional[float]:
+        """
+        Оценивает оставшееся время.
+
+        Args:
+            remaining (int): Число оставшихся документов.
+
+        Returns:
+            Optional[float]: Секунды до завершения или None, пока нет измерений.
+        """
+        if not self._durations:
+            return None
+        return remaining * sum(self._durations) / len(self._durations)
+
+
+class BatchHeartbeat(threading.Thread):
+    """
+    Фоновый поток, обновляющий отметку активности пакета, пока он выполняется.
+    """
+
+    def __init__(self, batch_id: str, runner_id: str, interval: float = BATCH_HEARTBEAT_SECONDS):
+        super().__init__(daemon=True)
+        self.batch_id = batch_id
+        self.runner_id = runner_id
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            if not touch_batch_run(self.batch_id, self.runner_id):
+                # Пакет отменен или перехвачен: цикл пакета остановится перед следующим счетом
+                return
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+
+def start_batch(data_file: str, template_name: str, invoice_ids: List[str], profile: str = None,
+                reused: Dict[str, str] = None, kind: str = None) -> str:
+    """
+    Создает пакет с контрольными точками.
+
+    Args:
+        data_file (str): Имя файла данных.
+        template_name (str): Имя шаблона.
+        invoice_ids (List[str]): ID счетов пакета.
+        profile (str, optional): Профиль оптимизации PDF.
+        reused (Dict[str, str], optional): Неизмененные счета {ID счета: путь к PDF}, сразу отмечаемые готовыми.
+        kind (str, optional): Вид пакета (см. create_batch_run).
+
+    Returns:
+        str: ID пакета.
+    """
+    batch_id = uuid.uuid4().hex
+    create_batch_run(batch_id, data_file, template_name, invoice_ids, profile, reused, kind)
+    return batch_id
+
+
+def get_resumable_batches(data_file: str, template_name: str) -> List[Dict]:
+    """
+    Получает пакеты, которые можно продолжить: отмененные и прерванные.
+
+    Пакеты, выполняющиеся в другой сессии (свежая отметка активности), не включаются.
+
+    Args:
+        data_file (str): Имя файла данных.
+        template_name (str): Имя шаблона.
+
+    Returns:
+        List[Dict]: Пакеты (см. get_batch_run), новые первыми.
+    """
+    return get_unfinished_batch_runs(data_file, template_name, time.time() - BATCH_STALE_SECONDS)
+
+
+def cancel_batch(batch_id: str) -> None:
+    """
+    Запрашивает отмену пакета; генерация остановится перед следующим счетом.
+
+    Args:
+        batch_id (str): ID пакета.
+    """
+    set_batch_run_status(batch_id, 'cancelled')
+
+
+def run_batch(batch_id: str, data, template,
+              on_progress: Callable[[int, int, str, Optional[float]], None] = None, owner: str = 'default') -> Dict:
+    """
+    Генерирует оставшиеся (pending) счета пакета, записывая контрольную точку после каждого.
+
+    Подходит и для первого запуска, и для продолжения прерванного или отмененного пакета.
+    Если пакет выполняется в другой сессии, счета не генерируются.
+
+    Args:
+        batch_id (str): ID пакета.
+        data: Данные файла пакета (DataFrame, список словарей или CompactOrders).
+        template: Шаблон пакета.
+        on_progress (Callable, optional): Вызывается после каждого счета с аргументами
+            (готово, всего, ID счета, ETA в секундах или None).
+        owner (str): Пользователь или сессия для очереди планировщика рендеринга.
+
+    Returns:
+        Dict: Пакет после обработки (см. get_batch_run); статус 'done' или 'cancelled',
+            либо 'running', если пакет выполняется (или был перехвачен) в другой сессии.
+    """
+    runner_id = uuid.uuid4().hex
+    if not claim_batch_run(batch_id, runner_id, time.time() - BATCH_STALE_SECONDS):
+        print(f"Batch {batch_id} is already running in another session")
+        return get_batch_run(batch_id)
+    run = get_batch_run(batch_id)
+    pending = get_batch_items(batch_id, 'pending')
+    total = sum(run['counts'].values())
+    finished = total - len(pending)
+    meter = ThroughputMeter()
+    heartbeat = BatchHeartbeat(batch_id, runner_id)
+    heartbeat.start()
+    try:
+        invoices = iter_invoice_data(data, [item['invoice_id'] for item in pending])
+        for item, (invoice_id, invoice_data) in zip(pending, invoices):
+            # Отметка активности заодно проверяет отмену и перехват пакета другим процессом
+            if not touch_batch_run(batch_id, runner_id):
+                return get_batch_run(batch_id)
+            started = time.perf_counter()
+            if not invoice_data:
+                add_generation_record(invoice_id, '', run['data_file'], run['template_name'], '', 'error', 'Invoice not found')
+                update_batch_item(batch_id, item['position'], 'failed', error_msg='Invoice not found')
+            else:
+                document = store_document(invoice_id, lambda path: scheduled_render(template, invoice_data, path, run['profile'], owner))
+                if document:
+                    document_id, output_path = document
+                    content_hash, template_hash = save_snapshot(invoice_data, template)
+                    add_generation_record(invoice_id, invoice_data.get('customer_name', ''), run['data_file'], run['template_name'],
+                                          output_path, 'success', content_hash=content_hash, document_id=document_id,
+                                          template_hash=template_hash, profile=run['profile'] or DEFAULT_PDF_PROFILE)
+                    update_batch_item(batch_id, item['position'], 'done', output_path)
+                else:
+                    add_generation_record(invoice_id, invoice_data.get('customer_name', ''), run['data_file'], run['template_name'],
+                                          '', 'error', 'Generation failed')
+                    update_batch_item(batch_id, item['position'], 'failed', error_msg='Generation failed')
+            meter.record(time.perf_counter() - started)
+            finished += 1
+            if on_progress:
+                on_progress(finished, total, invoice_id, meter.eta(total - finished))
+        set_batch_run_status(batch_id, 'done')
+    finally:
+        # Поток останавливается и при прерывании прогона (например, перезапуском скрипта Streamlit)
+        heartbeat.stop()
+    return get_batch_run(batch_id)
+
+
+def get_batch_outputs(batch_id: str) -> List[str]:
+    """
+    Возвращает пути к готовым PDF пакета в порядке генерации.
+
+    Args:
+        batch_id (str): ID пакета.
+
+    Returns:
+        List[str]: Пути к PDF.
+    """
+    return [item['output_file'] for item in get_batch_items(batch_id, 'done') if item['output_file']]
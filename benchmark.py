@@ -0,0 +1,180 @@
+"""
+Скрипт замеров производительности генерации PDF.
+
+Рендерит примеры счетов из /data с каждым профилем оптимизации и выводит
+компромисс между размером файлов и временем генерации. С флагом --imports
+проверяет бюджет холодного старта: время импорта модулей приложения в чистом
+процессе и то, что тяжелые PDF библиотеки при этом не загружаются. С флагом
+--overlay сравнивает режим наложения с полной версткой того же шаблона.
+
+Использование:
+    python benchmark.py [--template invoice_template.html] [--data invoices_sample1.csv]
+    python benchmark.py --imports
+    python benchmark.py --overlay --template receipt_template.html
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from data_parser import parse_csv, parse_json, get_invoice_ids, get_invoice_data
+from pdf_generator import (load_template, render_pdf, render_html, generate_pdf, generate_overlay_pdf,
+                           is_overlay_template, summarize_outputs, PDF_PROFILES)
+
+
+# Модули, импортируемые app.py при старте
+APP_STARTUP_MODULES = ('streamlit', 'pandas', 'data_parser', 'pdf_generator', 'database', 'output_store',
+                       'preview', 'data_catalog', 'validation', 'compact', 'search_index', 'render_scheduler',
+                       'batch_runner', 'snapshots')
+
+# Модули, которые должны загружаться лениво: при компиляции шаблона, генерации PDF или предпросмотре
+LAZY_MODULES = ('weasyprint', 'pypdf', 'fpdf', 'pypdfium2', 'jinja2')
+
+# Бюджет времени импорта модулей приложения в холодном процессе, в секундах
+IMPORT_BUDGET_SECONDS = 2.0
+
+
+def measure_startup_imports(modules=APP_STARTUP_MODULES) -> dict:
+    """
+    Замеряет время импорта модулей в отдельном (холодном) процессе интерпретатора.
+
+    Args:
+        modules: Имена модулей в порядке импорта.
+
+    Returns:
+        dict: seconds — время импорта, eager — тяжелые модули из LAZY_MODULES,
+            загруженные при импорте, ok — уложился ли старт в бюджет без тяжелых модулей.
+    """
+    script = (
+        "import json, sys, time\n"
+        "started = time.perf_counter()\n"
+        f"for name in {list(modules)!r}:\n"
+        "    __import__(name)\n"
+        "seconds = time.perf_counter() - started\n"
+        f"eager = [name for name in {list(LAZY_MODULES)!r} if name in sys.modules]\n"
+        "print(json.dumps({'seconds': seconds, 'eager': eager}))\n"
+    )
+    result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    report['ok'] = report['seconds'] <= IMPORT_BUDGET_SECONDS and not report['eager']
+    return report
+
+
+def load_invoices(data_file: str) -> list:
+    """Разбирает файл из /data и возвращает данные всех его счетов."""
+    filepath = os.path.join('data', data_file)
+    data = parse_csv(filepath) if data_file.endswith('.csv') else parse_json(filepath)
+    return [get_invoice_data(data, invoice_id) for invoice_id in get_invoice_ids(data)]
+
+
+def benchmark_profiles(template_name: str, data_file: str, backend: str = None) -> list:
+    """
+    Замеряет размер и время генерации для каждого профиля оптимизации.
+
+    Args:
+        template_name (str): Имя шаблона.
+        data_file (str): Имя файла данных в /data.
+        backend (str, optional): Имя движка рендеринга; по умолчанию автоматический выбор.
+
+    Returns:
+        list: Список отчетов summarize_outputs с добавленным ключом 'profile'.
+    """
+    template = load_template(template_name)
+    invoices = load_invoices(data_file)
+
+    results = []
+    for profile in PDF_PROFILES:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pdf_files = []
+            started = time.perf_counter()
+            for invoice_data in invoices:
+                output_path = os.path.join(tmp_dir, f"{invoice_data['invoice_id']}.pdf")
+                if render_pdf(template, invoice_data, output_path, backend=backend, profile=profile):
+                    pdf_files.append(output_path)
+            report = summarize_outputs(pdf_files, time.perf_counter() - started)
+        report['profile'] = profile
+        results.append(report)
+    return results
+
+
+def benchmark_overlay(template_name: str, data_file: str) -> list:
+    """
+    Сравнивает режим наложения с полной версткой шаблона наложения на одних и тех же счетах.
+
+    Подложка рендерится при первом документе режима наложения, поэтому ее стоимость
+    входит в замер.
+
+    Args:
+        template_name (str): Имя шаблона с блоками background и fields.
+        data_file (str): Имя файла данных в /data.
+
+    Returns:
+        list: Отчеты summarize_outputs с добавленным ключом 'mode' ('full' и 'overlay').
+
+    Raises:
+        ValueError: Если шаблон не поддерживает режим наложения.
+    """
+    template = load_template(template_name)
+    if not is_overlay_template(template):
+        raise ValueError(f"Template {template_name} has no background and fields blocks")
+    invoices = load_invoices(data_file)
+    modes = {
+        'full': lambda invoice_data, path: generate_pdf(render_html(template, invoice_data), path),
+        'overlay': lambda invoice_data, path: generate_overlay_pdf(template, invoice_data, path),
+    }
+    results = []
+    for mode, render in modes.items():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pdf_files = []
+            started = time.perf_counter()
+            for invoice_data in invoices:
+                output_path = os.path.join(tmp_dir, f"{invoice_data['invoice_id']}.pdf")
+                if render(invoice_data, output_path):
+                    pdf_files.append(output_path)
+            report = summarize_outputs(pdf_files, time.perf_counter() - started)
+        report['mode'] = mode
+        results.append(report)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замеры производительности генерации PDF")
+    parser.add_argument('--template', default='invoice_template.html', help="Имя шаблона")
+    parser.add_argument('--data', default='invoices_sample1.csv', help="Имя файла данных в /data")
+    parser.add_argument('--backend', default=None, help="Движок рендеринга (native, weasyprint)")
+    parser.add_argument('--imports', action='store_true', help="Проверить бюджет времени импорта при старте")
+    parser.add_argument('--overlay', action='store_true', help="Сравнить режим наложения с полной версткой")
+    args = parser.parse_args()
+
+    if args.imports:
+        report = measure_startup_imports()
+        print(f"Импорт модулей приложения: {report['seconds']:.2f} с (бюджет {IMPORT_BUDGET_SECONDS:.1f} с)")
+        if report['eager']:
+            print(f"Загружены при старте: {', '.join(report['eager'])}")
+        sys.exit(0 if report['ok'] else 1)
+
+    if args.overlay:
+        print(f"Шаблон: {args.template}, данные: {args.data}")
+        print(f"{'Режим':<10} {'Документов':>10} {'Время, с':>9} {'Док/с':>7}")
+        results = benchmark_overlay(args.template, args.data)
+        for report in results:
+            print(f"{report['mode']:<10} {report['count']:>10} {report['seconds']:>9.2f} {report['docs_per_second']:>7.1f}")
+        full, overlay = results
+        if full['docs_per_second']:
+            print(f"Ускорение: {overlay['docs_per_second'] / full['docs_per_second']:.1f}x")
+        return
+
+    print(f"Шаблон: {args.template}, данные: {args.data}")
+    print(f"{'Профиль':<10} {'Документов':>10} {'Всего, КБ':>10} {'Среднее, КБ':>12} {'Время, с':>9} {'Док/с':>7}")
+    for report in benchmark_profiles(args.template, args.data, args.backend):
+        print(f"{report['profile']:<10} {report['count']:>10} {report['total_bytes'] / 1024:>10.1f} "
+              f"{report['avg_bytes'] / 1024:>12.1f} {report['seconds']:>9.2f} {report['docs_per_second']:>7.1f}")
+
+
+if __name__ == '__main__':
+    main()
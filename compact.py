@@ -0,0 +1,246 @@
+"""
+Модуль компактного представления данных счетов в памяти.
+
+Для больших пакетов DataFrame переводится в категориальные и уменьшенные
+целочисленные типы, а JSON заказы хранятся по колонкам: строки интернируются,
+числа товаров лежат в массивах array, а не в миллионах отдельных словарей.
+Вещественные колонки (цены, суммы) остаются float64: float32 искажает денежные
+значения (99.99 превращается в 99.98999786376953).
+Хранилище неизменяемо, поэтому его безопасно разделять между воркерами
+(copy-on-write после fork).
+"""
+
+from typing import Dict, Iterator, List, Optional
+from array import array
+from collections.abc import Sequence
+import sys
+
+import pandas as pd
+
+
+# Колонки с долей уникальных значений ниже порога хранятся как category
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+
+# Поля шапки заказа, хранящиеся по колонкам
+HEADER_FIELDS = ('invoice_id', 'customer_name', 'date', 'company_name', 'address', 'phone', 'email')
+
+# Поля товара, хранящиеся в массивах
+ITEM_FIELDS = ('product_name', 'quantity', 'price', 'total')
+
+
+def compact_dataframe(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Уменьшает объем DataFrame в памяти.
+
+    Строковые колонки с повторяющимися значениями (компании, товары) переводятся
+    в category, целочисленные колонки — в минимальные подходящие типы.
+    Вещественные колонки не изменяются.
+
+    Args:
+        df (pd.DataFrame): Исходный DataFrame.
+
+    Returns:
+        pd.DataFrame: Новый DataFrame с компактными типами колонок.
+    """
+    result = {}
+    for col in df.columns:
+        values = df[col]
+        if pd.api.types.is_integer_dtype(values):
+            values = pd.to_numeric(values, downcast='integer')
+        elif pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values):
+            if len(values) and values.nunique(dropna=True) / len(values) < CATEGORY_MAX_UNIQUE_RATIO:
+                values = values.astype('category')
+        result[col] = values
+    return pd.DataFrame(result, index=df.index)
+
+
+def _intern(value):
+    """Интернирует строки, чтобы одинаковые значения хранились в одном экземпляре."""
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _number_array(values: List):
+    """
+    Упаковывает числа в массив целых, если все значения целые, или вещественных, если все вещественные.
+
+    Смешанные значения хранятся кортежем, чтобы целые не превращались в вещественные (1 в 1.0).
+    """
+    for value in values:
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f"Not a number: {value!r}")
+    if all(isinstance(value, int) for value in values):
+        return array('q', values)
+    if all(isinstance(value, float) for value in values):
+        return array('d', values)
+    return tuple(values)
+
+
+class CompactOrders(Sequence):
+    """
+    Неизменяемое колоночное хранилище JSON заказов.
+
+    Поддерживает интерфейс последовательности: индексация и срезы возвращают
+    новые словари заказов (в том же виде, что и исходные записи с посчитанными
+    total и grand_total), не затрагивая хранилище.
+    """
+
+    __slots__ = ('_header', '_extra', '_item_offsets', '_item_names', '_item_numbers', '_item_extra', '_positions')
+
+    def __init__(self, records: List[Dict]):
+        """
+        Упаковывает список заказов.
+
+        Args:
+            records (List[Dict]): Список словарей заказов (результат parse_json).
+
+        Raises:
+            ValueError: Если записи не являются словарями или товары содержат нечисловые значения.
+        """
+        header = {field: [] for field in HEADER_FIELDS}
+        extra = []
+        offsets = [0]
+        names = []
+        numbers = {field: [] for field in ITEM_FIELDS[1:]}
+        item_extra = {}
+        for record in records:
+            if not isinstance(record, dict):
+                raise ValueError("Data items must be dictionaries")
+            for field in HEADER_FIELDS:
+                header[field].append(_intern(record.get(field)))
+            items = record.get('items', [])
+            for item in items:
+                names.append(_intern(item.get('product_name', '')))
+                quantity = item.get('quantity', 0)
+                price = item.get('price', 0)
+                numbers['quantity'].append(quantity)
+                numbers['price'].append(price)
+                numbers['total'].append(item['total'] if 'total' in item else quantity * price)
+                # Прочие ключи товара хранятся только у товаров, где они есть
+                other = {key: value for key, value in item.items() if key not in ITEM_FIELDS}
+                if other:
+                    item_extra[len(names) - 1] = other
+            offsets.append(len(names))
+            # Прочие ключи заказа хранятся только у записей, где они есть
+            other = {key: value for key, value in record.items() if key not in HEADER_FIELDS and key != 'items'}
+            extra.append(other or None)
+
+        self._header = {field: tuple(values) for field, values in header.items()}
+        self._extra = tuple(extra)
+        self._item_offsets = array('q', offsets)
+        self._item_names = tuple(names)
+        self._item_numbers = {field: _number_array(values) for field, values in numbers.items()}
+        self._item_extra = item_extra
+        self._positions = {}
+        for position, invoice_id in enumerate(self._header['invoice_id']):
+            if invoice_id is not None:
+                self._positions.setdefault(str(invoice_id), position)
+
+    def __len__(self) -> int:
+        return len(self._extra)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._record(position) for position in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("CompactOrders index out of range")
+        return self._record(index)
+
+    def __iter__(self) -> Iterator[Dict]:
+        for position in range(len(self)):
+            yield self._record(position)
+
+    def __setattr__(self, name, value):
+        if hasattr(self, '_positions'):
+            raise AttributeError("CompactOrders is immutable")
+        object.__setattr__(self, name, value)
+
+    def _record(self, position: int) -> Dict:
+        record = {field: values[position] for field, values in self._header.items() if values[position] is not None}
+        start, end = self._item_offsets[position], self._item_offsets[position + 1]
+        record['items'] = [
+            {
+                'product_name': self._item_names[i],
+                'quantity': self._item_numbers['quantity'][i],
+                'price': self._item_numbers['price'][i],
+                'total': self._item_numbers['total'][i],
+                **self._item_extra.get(i, {}),
+            }
+            for i in range(start, end)
+        ]
+        if self._extra[position]:
+            record.update(self._extra[position])
+        if 'grand_total' not in record:
+            record['grand_total'] = sum(item['total'] for item in record['items'])
+        return record
+
+    def invoice_ids(self) -> List[str]:
+        """
+        Возвращает ID счетов в порядке записей.
+
+        Returns:
+            List[str]: Список строковых ID счетов.
+        """
+        return [str(invoice_id) for invoice_id in self._header['invoice_id'] if invoice_id is not None]
+
+    def header_column(self, field: str) -> tuple:
+        """
+        Возвращает значения поля шапки по всем заказам без сборки словарей.
+
+        Args:
+            field (str): Поле из HEADER_FIELDS.
+
+        Returns:
+            tuple: Значения поля в порядке записей (None, если поле отсутствует в записи).
+        """
+        return self._header[field]
+
+    def get_invoice(self, invoice_id: str) -> Dict:
+        """
+        Возвращает заказ по ID счета за O(1).
+
+        Args:
+            invoice_id (str): ID счета.
+
+        Returns:
+            Dict: Новый словарь заказа или пустой словарь, если счет не найден.
+        """
+        position = self._positions.get(invoice_id)
+        return self._record(position) if position is not None else {}
+
+
+def compact_dataset(data):
+    """
+    Переводит разобранные данные в компактное представление.
+
+    Args:
+        data: DataFrame или список словарей.
+
+    Returns:
+        Компактный DataFrame, CompactOrders или исходные данные, если их нельзя упаковать
+        (например, товары содержат нечисловые значения — такие данные отклоняет валидация).
+    """
+    if isinstance(data, pd.DataFrame):
+        return compact_dataframe(data)
+    if isinstance(data, list):
+        try:
+            return CompactOrders(data)
+        except (ValueError, TypeError, AttributeError):
+            return data
+    return data
+
+
+def to_python_number(value) -> Optional[object]:
+    """
+    Преобразует числовой скаляр numpy в число Python.
+
+    Уменьшенные типы (int8, int16) иначе переполняются при умножении количества на цену.
+
+    Args:
+        value: Значение из DataFrame.
+
+    Returns:
+        Значение Python того же смысла.
+    """
+    return value.item() if hasattr(value, 'item') and hasattr(value, 'dtype') else value
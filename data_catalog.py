@@ -0,0 +1,196 @@
+"""
+Модуль каталога файлов данных.
+
+Принимает загружаемые файлы потоково с вычислением хеша содержимого,
+дедуплицирует одинаковые файлы и регистрирует новые в каталоге.
+Для каждой версии файла один раз вычисляет и хранит формат, схему,
+число строк, диапазон ID счетов и результат валидации.
+"""
+
+from typing import BinaryIO, Dict, List, Tuple
+import hashlib
+import json
+import os
+import uuid
+
+import pandas as pd
+
+from data_parser import DATA_EXTENSIONS, parse_csv_with_format, parse_json, parse_data_file, get_invoice_ids, validate_data_structure
+from database import register_data_file, find_data_file_by_hash, get_catalog_entries, save_catalog_entry, delete_catalog_entries
+from output_store import safe_filename
+
+
+DATA_DIR = 'data'
+
+# Размер блока при потоковой записи загрузки
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def _unique_filename(filename: str, content_hash: str) -> str:
+    """Возвращает имя файла, не перезаписывающее существующий файл в /data."""
+    if not os.path.exists(os.path.join(DATA_DIR, filename)):
+        return filename
+    stem, ext = os.path.splitext(filename)
+    return f"{stem}_{content_hash[:8]}{ext}"
+
+
+def ingest_upload(fileobj: BinaryIO, filename: str) -> Tuple[str, bool]:
+    """
+    Потоково сохраняет загруженный файл в /data, дедуплицируя по хешу содержимого.
+
+    Файл читается блоками по UPLOAD_CHUNK_SIZE во временный файл с параллельным
+    вычислением SHA-256, поэтому в памяти не создается копия всего содержимого.
+    Если такой же файл уже есть в каталоге, временный файл удаляется.
+    Файл с тем же именем, но другим содержимым не перезаписывается.
+
+    Args:
+        fileobj (BinaryIO): Файловый объект загрузки.
+        filename (str): Исходное имя файла от клиента.
+
+    Returns:
+        Tuple[str, bool]: Кортеж (имя файла в /data, был ли файл дубликатом).
+    """
+    os.makedirs(DATA_DIR, exist_ok=True)
+    tmp_path = os.path.join(DATA_DIR, f".upload-{uuid.uuid4().hex}.part")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, 'wb') as f:
+            while True:
+                chunk = fileobj.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+        content_hash = digest.hexdigest()
+
+        existing = find_data_file_by_hash(content_hash)
+        if existing and os.path.exists(os.path.join(DATA_DIR, existing['filename'])):
+            return existing['filename'], True
+
+        target = _unique_filename(safe_filename(os.path.basename(filename)), content_hash)
+        os.replace(tmp_path, os.path.join(DATA_DIR, target))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    register_data_file(target, content_hash, size)
+    return target, False
+
+
+def hash_file(filepath: str) -> str:
+    """
+    Вычисляет SHA-256 хеш содержимого файла, читая его блоками.
+
+    Args:
+        filepath (str): Путь к файлу.
+
+    Returns:
+        str: Hex-строка хеша.
+    """
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def analyze_data_file(filename: str) -> Dict:
+    """
+    Парсит и валидирует файл данных, формируя запись каталога.
+
+    Args:
+        filename (str): Имя файла в директории /data.
+
+    Returns:
+        Dict: Запись каталога (формат, кодировка, разделитель, схема, число строк,
+            диапазон ID счетов, статус валидации).
+    """
+    filepath = os.path.join(DATA_DIR, filename)
+    stat = os.stat(filepath)
+    entry = {
+        'filename': filename,
+        'content_hash': hash_file(filepath),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'format': os.path.splitext(filename)[1].lstrip('.'),
+        'encoding': None,
+        'delimiter': None,
+        'columns': None,
+        'row_count': None,
+        'id_min': None,
+        'id_max': None,
+        'valid': 0,
+        'error': None,
+    }
+    try:
+        if entry['format'] == 'csv':
+            data, entry['encoding'], entry['delimiter'] = parse_csv_with_format(filepath)
+        elif entry['format'] == 'json':
+            data = parse_json(filepath)
+            entry['encoding'] = 'utf-8'
+        else:
+            data = parse_data_file(filepath)
+        if isinstance(data, pd.DataFrame):
+            columns = [str(col) for col in data.columns]
+        else:
+            columns = sorted({key for record in data if isinstance(record, dict) for key in record})
+        entry['columns'] = json.dumps(columns, ensure_ascii=False)
+        entry['row_count'] = len(data)
+        invoice_ids = get_invoice_ids(data)
+        if invoice_ids:
+            entry['id_min'], entry['id_max'] = min(invoice_ids), max(invoice_ids)
+        valid, msg = validate_data_structure(data)
+        entry['valid'] = int(valid)
+        entry['error'] = msg or None
+    except Exception as e:
+        entry['error'] = str(e)
+    return entry
+
+
+def sync_catalog() -> Dict[str, Dict]:
+    """
+    Синхронизирует каталог с директорией /data.
+
+    Новые и измененные файлы (по размеру и времени изменения) анализируются,
+    записи удаленных файлов удаляются; остальные берутся из каталога без парсинга.
+
+    Returns:
+        Dict[str, Dict]: Словарь {имя файла: запись каталога}.
+    """
+    entries = get_catalog_entries()
+    if not os.path.exists(DATA_DIR):
+        return {}
+    present = {}
+    with os.scandir(DATA_DIR) as it:
+        for dir_entry in it:
+            if dir_entry.is_file() and dir_entry.name.endswith(DATA_EXTENSIONS):
+                present[dir_entry.name] = dir_entry.stat()
+
+    for filename, stat in present.items():
+        entry = entries.get(filename)
+        if entry and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+            continue
+        entries[filename] = analyze_data_file(filename)
+        save_catalog_entry(entries[filename])
+
+    removed = [filename for filename in entries if filename not in present]
+    if removed:
+        delete_catalog_entries(removed)
+        for filename in removed:
+            del entries[filename]
+    return entries
+
+
+def list_catalog_files(valid_only: bool = False) -> List[Dict]:
+    """
+    Возвращает записи каталога, отсортированные по имени файла.
+
+    Args:
+        valid_only (bool): Возвращать только файлы, прошедшие валидацию.
+
+    Returns:
+        List[Dict]: Список записей каталога.
+    """
+    entries = sync_catalog()
+    return [entries[name] for name in sorted(entries) if entries[name]['valid'] or not valid_only]
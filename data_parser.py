@@ -4,15 +4,30 @@
 Предоставляет функции для чтения, валидации и обработки данных счетов.
 """
 
-from typing import List, Dict, Tuple
+from typing import Iterator, List, Dict, Tuple
 import pandas as pd
 import json
 import os
+import re
+import mmap
+import hashlib
+import threading
+from collections import OrderedDict
+
+from validation import validate_data, format_error
+from compact import CompactOrders, to_python_number
+
+
+# Поддерживаемые расширения файлов данных
+DATA_EXTENSIONS = ('.csv', '.json', '.xlsx', '.parquet')
+
+# Поля шапки счета, которые читаются из табличных файлов (помимо колонок item_*)
+INVOICE_FIELDS = ['invoice_id', 'customer_name', 'date', 'company_name', 'address', 'phone', 'email']
 
 
 def list_data_files() -> List[str]:
     """
-    Возвращает список доступных файлов данных (.csv и .json) из директории /data.
+    Возвращает список доступных файлов данных (DATA_EXTENSIONS) из директории /data.
 
     Returns:
         List[str]: Список имен файлов, отсортированных по алфавиту.
@@ -20,38 +35,48 @@ def list_data_files() -> List[str]:
     data_dir = 'data'
     if not os.path.exists(data_dir):
         return []
-    files = [f for f in os.listdir(data_dir) if f.endswith(('.csv', '.json'))]
+    files = [f for f in os.listdir(data_dir) if f.endswith(DATA_EXTENSIONS)]
     return sorted(files)
 
 
-def parse_csv(filepath: str) -> pd.DataFrame:
+def parse_csv_with_format(filepath: str) -> Tuple[pd.DataFrame, str, str]:
     """
-    Парсит CSV файл с автоматическим определением кодировки и разделителя.
+    Парсит CSV файл и возвращает обнаруженные кодировку и разделитель.
 
     Args:
         filepath (str): Путь к CSV файлу.
 
     Returns:
-        pd.DataFrame: DataFrame с данными из файла.
+        Tuple[pd.DataFrame, str, str]: Кортеж (DataFrame, кодировка, разделитель).
 
     Raises:
         ValueError: Если файл не удалось распарсить.
     """
     encodings = ['utf-8', 'cp1251']
     separators = [',', ';', '\t']
-    df = None
     for enc in encodings:
         for sep in separators:
             try:
-                df = pd.read_csv(filepath, encoding=enc, sep=sep)
-                break
+                return pd.read_csv(filepath, encoding=enc, sep=sep), enc, sep
             except Exception:
                 continue
-        if df is not None:
-            break
-    if df is None:
-        raise ValueError("Cannot parse CSV file")
-    return df
+    raise ValueError("Cannot parse CSV file")
+
+
+def parse_csv(filepath: str) -> pd.DataFrame:
+    """
+    Парсит CSV файл с автоматическим определением кодировки и разделителя.
+
+    Args:
+        filepath (str): Путь к CSV файлу.
+
+    Returns:
+        pd.DataFrame: DataFrame с данными из файла.
+
+    Raises:
+        ValueError: Если файл не удалось распарсить.
+    """
+    return parse_csv_with_format(filepath)[0]
 
 
 def parse_json(filepath: str) -> List[Dict]:
@@ -77,12 +102,289 @@ def parse_json(filepath: str) -> List[Dict]:
         raise ValueError("Invalid JSON structure")
 
 
+def select_invoice_columns(columns: List[str]) -> List[str]:
+    """
+    Выбирает колонки, нужные для формирования счетов: поля шапки и колонки товаров.
+
+    Args:
+        columns (List[str]): Все колонки файла.
+
+    Returns:
+        List[str]: Колонки в исходном порядке.
+    """
+    return [col for col in columns if col in INVOICE_FIELDS or str(col).startswith('item_')]
+
+
+def parse_xlsx(filepath: str, columns: List[str] = None) -> pd.DataFrame:
+    """
+    Парсит XLSX файл в потоковом режиме только для чтения.
+
+    Читается первый лист; первая строка содержит заголовки колонок. Значения
+    непрочитанных колонок не материализуются.
+
+    Args:
+        filepath (str): Путь к XLSX файлу.
+        columns (List[str], optional): Колонки для чтения; по умолчанию select_invoice_columns.
+
+    Returns:
+        pd.DataFrame: DataFrame с данными из файла.
+
+    Raises:
+        ValueError: Если в файле нет строки заголовков.
+    """
+    import openpyxl  # Импорт здесь: зависимость нужна только для XLSX файлов
+
+    workbook = openpyxl.load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            raise ValueError("Cannot parse XLSX file: no header row")
+        header = [str(col) if col is not None else '' for col in header]
+        selected = columns if columns is not None else select_invoice_columns(header)
+        positions = [header.index(col) for col in selected if col in header]
+        values = {header[pos]: [] for pos in positions}
+        for row in rows:
+            if row is None or all(cell is None for cell in row):
+                continue
+            for pos in positions:
+                values[header[pos]].append(row[pos] if pos < len(row) else None)
+    finally:
+        workbook.close()
+    return pd.DataFrame(values)
+
+
+def parse_parquet(filepath: str, columns: List[str] = None) -> pd.DataFrame:
+    """
+    Парсит Parquet файл, читая только нужные колонки.
+
+    Args:
+        filepath (str): Путь к Parquet файлу.
+        columns (List[str], optional): Колонки для чтения; по умолчанию select_invoice_columns.
+
+    Returns:
+        pd.DataFrame: DataFrame с данными из файла.
+    """
+    import pyarrow.parquet as pq  # Импорт здесь: зависимость нужна только для Parquet файлов
+
+    if columns is None:
+        columns = select_invoice_columns(pq.read_schema(filepath).names)
+    return pq.read_table(filepath, columns=columns).to_pandas()
+
+
+def parse_data_file(filepath: str):
+    """
+    Парсит файл данных, выбирая парсер по расширению.
+
+    Args:
+        filepath (str): Путь к файлу данных.
+
+    Returns:
+        DataFrame или список словарей с данными.
+
+    Raises:
+        ValueError: Если формат файла не поддерживается.
+    """
+    if filepath.endswith('.csv'):
+        return parse_csv(filepath)
+    elif filepath.endswith('.json'):
+        return parse_json(filepath)
+    elif filepath.endswith('.xlsx'):
+        return parse_xlsx(filepath)
+    elif filepath.endswith('.parquet'):
+        return parse_parquet(filepath)
+    raise ValueError(f"Unsupported data file format: {filepath}")
+
+
+# Суффикс файла-индекса смещений рядом с JSON файлом заказов
+JSON_INDEX_SUFFIX = '.idx'
+
+# Версия формата файла-индекса; индексы другой версии перестраиваются
+JSON_INDEX_VERSION = 3
+
+# Число индексов JSON файлов, хранящихся в памяти процесса
+JSON_INDEX_CACHE_SIZE = 8
+
+# Загруженные индексы: {путь: ((размер, mtime), индекс)}
+_json_indexes: Dict[str, tuple] = OrderedDict()
+_json_indexes_lock = threading.Lock()
+
+# Структурные символы JSON, которые отслеживает сканер индекса
+_JSON_TOKEN_RE = re.compile(rb'["\\{}\[\]:]')
+
+
+def build_json_index(filepath: str) -> Dict[str, Tuple[int, int]]:
+    """
+    Строит индекс байтовых смещений записей JSON файла заказов за один проход.
+
+    Поддерживаются те же структуры, что и в parse_json: массив записей верхнего
+    уровня или объект с массивом 'orders'. Файл читается через mmap, в памяти
+    одновременно декодируется только одна запись (для извлечения invoice_id).
+
+    Args:
+        filepath (str): Путь к JSON файлу.
+
+    Returns:
+        Dict[str, Tuple[int, int]]: Словарь {invoice_id: (начало, конец)} в байтах; при повторах
+            ID хранится первая запись, как и в get_invoice_data.
+
+    Raises:
+        ValueError: Если структура JSON не поддерживается.
+    """
+    index = {}
+    with open(filepath, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError("Invalid JSON structure")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            depth = 0
+            in_string = False
+            skip = -1
+            string_start = 0
+            last_key = None
+            pending_key = None
+            records_depth = None
+            record_start = None
+            for match in _JSON_TOKEN_RE.finditer(mm):
+                pos = match.start()
+                if pos <= skip:
+                    continue
+                char = match.group()
+                if in_string:
+                    if char == b'\\':
+                        skip = pos + 1
+                    elif char == b'"':
+                        in_string = False
+                        if depth == 1 and records_depth is None:
+                            pending_key = mm[string_start + 1:pos]
+                    continue
+                if char == b'"':
+                    in_string = True
+                    string_start = pos
+                elif char == b':':
+                    last_key = pending_key
+                elif char in (b'{', b'['):
+                    if records_depth is None:
+                        if depth == 0 and char == b'[':
+                            records_depth = 1
+                        elif depth == 1 and char == b'[' and last_key == b'orders':
+                            records_depth = 2
+                    elif depth == records_depth and char == b'{':
+                        record_start = pos
+                    depth += 1
+                else:
+                    depth -= 1
+                    if records_depth is not None and depth == records_depth - 1:
+                        # Массив записей закрыт: объекты в последующих массивах (например, "refunds")
+                        # не входят в данные parse_json
+                        break
+                    if records_depth is not None and depth == records_depth and char == b'}' and record_start is not None:
+                        record = json.loads(mm[record_start:pos + 1])
+                        if 'invoice_id' in record:
+                            index.setdefault(str(record['invoice_id']), (record_start, pos + 1))
+                        record_start = None
+            if records_depth is None:
+                raise ValueError("Invalid JSON structure")
+    return index
+
+
+def load_json_index(filepath: str) -> Dict[str, Tuple[int, int]]:
+    """
+    Загружает индекс смещений JSON файла, перестраивая его при изменении файла.
+
+    Индекс хранится в памяти процесса и в кеше рядом с файлом, поэтому повторные
+    обращения к неизмененному файлу не читают файл-индекс заново.
+
+    Args:
+        filepath (str): Путь к JSON файлу.
+
+    Returns:
+        Dict[str, Tuple[int, int]]: Словарь {invoice_id: (начало, конец)} в байтах.
+    """
+    stat = os.stat(filepath)
+    version = (stat.st_size, stat.st_mtime)
+    with _json_indexes_lock:
+        cached = _json_indexes.get(filepath)
+        if cached is not None and cached[0] == version:
+            _json_indexes.move_to_end(filepath)
+            return cached[1]
+    index = _read_json_index(filepath, stat)
+    with _json_indexes_lock:
+        _json_indexes[filepath] = (version, index)
+        _json_indexes.move_to_end(filepath)
+        while len(_json_indexes) > JSON_INDEX_CACHE_SIZE:
+            _json_indexes.popitem(last=False)
+    return index
+
+
+def _read_json_index(filepath: str, stat: os.stat_result) -> Dict[str, Tuple[int, int]]:
+    """Читает индекс смещений из файла-индекса или строит его заново и сохраняет."""
+    index_path = filepath + JSON_INDEX_SUFFIX
+    if os.path.exists(index_path):
+        try:
+            with open(index_path, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            if (cached.get('version') == JSON_INDEX_VERSION and cached['size'] == stat.st_size
+                    and cached['mtime'] == stat.st_mtime):
+                return {key: tuple(value) for key, value in cached['offsets'].items()}
+        except (ValueError, KeyError, OSError):
+            pass
+    index = build_json_index(filepath)
+    # Уникальное временное имя: индекс могут строить одновременно несколько процессов
+    tmp_path = f"{index_path}.{os.getpid()}.part"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': JSON_INDEX_VERSION, 'size': stat.st_size, 'mtime': stat.st_mtime,
+                       'offsets': index}, f, ensure_ascii=False)
+        os.replace(tmp_path, index_path)
+    except OSError as e:
+        print(f"Error saving JSON index: {e}")
+    return index
+
+
+def get_json_record(filepath: str, invoice_id: str) -> Dict:
+    """
+    Читает одну запись заказа из JSON файла по индексу смещений, не загружая весь файл.
+
+    Args:
+        filepath (str): Путь к JSON файлу.
+        invoice_id (str): ID счета.
+
+    Returns:
+        Dict: Данные счета в том же виде, что и get_invoice_data, или пустой словарь.
+    """
+    offsets = load_json_index(filepath).get(invoice_id)
+    if offsets is None:
+        return {}
+    with open(filepath, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            record = json.loads(mm[offsets[0]:offsets[1]])
+    return get_invoice_data([record], invoice_id)
+
+
+def get_invoice_data_from_file(filepath: str, invoice_id: str, data=None) -> Dict:
+    """
+    Получает данные одного счета из файла; для JSON читает только запись счета по индексу смещений.
+
+    Args:
+        filepath (str): Путь к файлу данных.
+        invoice_id (str): ID счета.
+        data (optional): Уже разобранные данные файла для форматов без индекса (CSV, XLSX, Parquet);
+            если не переданы, файл разбирается целиком.
+
+    Returns:
+        Dict: Данные счета или пустой словарь, если счет не найден.
+    """
+    if filepath.endswith('.json'):
+        return get_json_record(filepath, invoice_id)
+    return get_invoice_data(parse_data_file(filepath) if data is None else data, invoice_id)
+
+
 def get_invoice_ids(data) -> List[str]:
     """
     Извлекает список ID счетов из данных.
 
     Args:
-        data: DataFrame или список словарей с данными.
+        data: DataFrame, CompactOrders или список словарей с данными.
 
     Returns:
         List[str]: Список строковых ID счетов.
@@ -91,6 +393,8 @@ def get_invoice_ids(data) -> List[str]:
         if 'invoice_id' not in data.columns:
             return []
         return data['invoice_id'].astype(str).tolist()
+    elif isinstance(data, CompactOrders):
+        return data.invoice_ids()
     elif isinstance(data, list):
         ids = []
         for item in data:
@@ -100,12 +404,76 @@ def get_invoice_ids(data) -> List[str]:
     return []
 
 
+def _is_missing(value) -> bool:
+    """Проверяет, что значение ячейки пустое (None или NaN)."""
+    return value is None or (isinstance(value, float) and value != value)
+
+
+def _row_invoice_data(row: pd.Series) -> Dict:
+    """Собирает данные счета из строки DataFrame (колонки шапки и item_*)."""
+    invoice_data = {
+        'invoice_id': str(row['invoice_id']),
+        'customer_name': str(row.get('customer_name', '')),
+        'date': str(row.get('date', '')),
+        'company_name': str(row.get('company_name', '')),
+        'address': str(row.get('address', '')),
+        'phone': str(row.get('phone', '')),
+        'email': str(row.get('email', '')),
+        'items': []
+    }
+    # Парсим товары из колонок вида item_1_name, item_1_qty, item_1_price
+    item_cols = [col for col in row.index if col.startswith('item_')]
+    items_dict = {}
+    for col in item_cols:
+        parts = col.split('_')
+        if len(parts) >= 3:
+            idx = parts[1]
+            field = '_'.join(parts[2:])
+            if idx not in items_dict:
+                items_dict[idx] = {}
+            value = to_python_number(row[col])
+            # Пустые ячейки (None из XLSX, NaN из CSV) считаются отсутствующими значениями
+            if not _is_missing(value):
+                items_dict[idx][field] = value
+    for item in items_dict.values():
+        if not item:
+            # Товар без единого заполненного поля (лишние колонки item_N) пропускается, как и в валидации
+            continue
+        quantity = item.get('qty', 0)
+        price = item.get('price', 0)
+        total = quantity * price if 'total' not in item else item.get('total', 0)
+        invoice_data['items'].append({
+            'product_name': item.get('name', ''),
+            'quantity': quantity,
+            'price': price,
+            'total': total
+        })
+    grand_total = sum(item['total'] for item in invoice_data['items'])
+    invoice_data['grand_total'] = grand_total
+    return invoice_data
+
+
+def _record_invoice_data(item: Dict) -> Dict:
+    """Копирует запись заказа, дополняя товары полем total и заказ полем grand_total."""
+    record = dict(item)
+    record['items'] = [dict(it) for it in item.get('items', [])]
+    # Убеждаемся, что у товаров есть поле total
+    for it in record['items']:
+        if 'total' not in it:
+            it['total'] = it.get('quantity', 0) * it.get('price', 0)
+    if 'grand_total' not in record:
+        record['grand_total'] = sum(it.get('total', 0) for it in record['items'])
+    return record
+
+
 def get_invoice_data(data, invoice_id: str) -> Dict:
     """
     Получает полные данные конкретного счета по его ID.
 
+    Исходные данные не изменяются: возвращается новый словарь.
+
     Args:
-        data: DataFrame или список словарей с данными.
+        data: DataFrame, CompactOrders или список словарей с данными.
         invoice_id (str): ID счета для поиска.
 
     Returns:
@@ -115,88 +483,84 @@ def get_invoice_data(data, invoice_id: str) -> Dict:
         row = data[data['invoice_id'].astype(str) == invoice_id]
         if row.empty:
             return {}
-        row = row.iloc[0]
-        invoice_data = {
-            'invoice_id': str(row['invoice_id']),
-            'customer_name': str(row.get('customer_name', '')),
-            'date': str(row.get('date', '')),
-            'company_name': str(row.get('company_name', '')),
-            'address': str(row.get('address', '')),
-            'phone': str(row.get('phone', '')),
-            'email': str(row.get('email', '')),
-            'items': []
-        }
-        # Парсим товары из колонок вида item_1_name, item_1_qty, item_1_price
-        item_cols = [col for col in row.index if col.startswith('item_')]
-        items_dict = {}
-        for col in item_cols:
-            parts = col.split('_')
-            if len(parts) >= 3:
-                idx = parts[1]
-                field = '_'.join(parts[2:])
-                if idx not in items_dict:
-                    items_dict[idx] = {}
-                items_dict[idx][field] = row[col]
-        for item in items_dict.values():
-            quantity = item.get('qty', 0)
-            price = item.get('price', 0)
-            total = quantity * price if 'total' not in item else item.get('total', 0)
-            invoice_data['items'].append({
-                'product_name': item.get('name', ''),
-                'quantity': quantity,
-                'price': price,
-                'total': total
-            })
-        grand_total = sum(item['total'] for item in invoice_data['items'])
-        invoice_data['grand_total'] = grand_total
-        return invoice_data
+        return _row_invoice_data(row.iloc[0])
+    elif isinstance(data, CompactOrders):
+        return data.get_invoice(invoice_id)
     elif isinstance(data, list):
         for item in data:
             if str(item.get('invoice_id', '')) == invoice_id:
-                # Убеждаемся, что у товаров есть поле total
-                for it in item.get('items', []):
-                    if 'total' not in it:
-                        it['total'] = it.get('quantity', 0) * it.get('price', 0)
-                if 'grand_total' not in item:
-                    item['grand_total'] = sum(it.get('total', 0) for it in item.get('items', []))
-                return item
+                return _record_invoice_data(item)
         return {}
     return {}
 
 
-def validate_data_structure(data) -> Tuple[bool, str]:
+def iter_invoice_data(data, invoice_ids: List[str]) -> Iterator[Tuple[str, Dict]]:
     """
-    Валидирует структуру данных на наличие обязательных полей.
+    Получает данные нескольких счетов за один проход по данным.
+
+    В отличие от вызова get_invoice_data для каждого ID (поиск по всему DataFrame
+    или списку на каждый счет), соответствие ID позиции строится один раз, а данные
+    счетов собираются по мере перебора.
 
     Args:
-        data: DataFrame или список словарей для валидации.
+        data: DataFrame, CompactOrders или список словарей с данными.
+        invoice_ids (List[str]): ID счетов.
 
-    Returns:
-        Tuple[bool, str]: Кортеж (валидно ли, сообщение об ошибке).
+    Yields:
+        Tuple[str, Dict]: ID счета и его данные (пустой словарь, если счет не найден)
+            в порядке invoice_ids; при повторах ID берется первая запись, как в get_invoice_data.
     """
     if isinstance(data, pd.DataFrame):
-        required_cols = ['invoice_id', 'customer_name', 'date']
-        missing = [col for col in required_cols if col not in data.columns]
-        if missing:
-            return False, f"Missing columns: {', '.join(missing)}"
-        if data.empty:
-            return False, "DataFrame is empty"
-        return True, ""
+        positions = {}
+        if 'invoice_id' in data.columns:
+            for position, invoice_id in enumerate(data['invoice_id'].astype(str)):
+                positions.setdefault(invoice_id, position)
+        for invoice_id in invoice_ids:
+            position = positions.get(invoice_id)
+            yield invoice_id, _row_invoice_data(data.iloc[position]) if position is not None else {}
     elif isinstance(data, list):
-        if not data:
-            return False, "Data list is empty"
+        records = {}
         for item in data:
-            if not isinstance(item, dict):
-                return False, "Data items must be dictionaries"
-            required_keys = ['invoice_id', 'customer_name', 'date', 'items']
-            missing = [key for key in required_keys if key not in item]
-            if missing:
-                return False, f"Missing keys in item: {', '.join(missing)}"
-            items = item.get('items', [])
-            if not isinstance(items, list):
-                return False, "Items must be a list"
-            for it in items:
-                if not isinstance(it, dict) or 'product_name' not in it or 'quantity' not in it or 'price' not in it:
-                    return False, "Invalid item structure"
+            if isinstance(item, dict):
+                records.setdefault(str(item.get('invoice_id', '')), item)
+        for invoice_id in invoice_ids:
+            item = records.get(invoice_id)
+            yield invoice_id, _record_invoice_data(item) if item is not None else {}
+    else:
+        for invoice_id in invoice_ids:
+            yield invoice_id, get_invoice_data(data, invoice_id)
+
+
+def compute_invoice_hash(invoice_data: Dict) -> str:
+    """
+    Вычисляет хеш содержимого счета для обнаружения изменений между версиями файла данных.
+
+    Args:
+        invoice_data (Dict): Данные счета (результат get_invoice_data).
+
+    Returns:
+        str: SHA-256 хеш нормализованного JSON представления счета.
+    """
+    payload = json.dumps(invoice_data, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def validate_data_structure(data) -> Tuple[bool, str]:
+    """
+    Валидирует структуру и значения данных по схеме счетов.
+
+    Полный отчет об ошибках с номерами строк возвращает validation.validate_data.
+
+    Args:
+        data: DataFrame или список словарей для валидации.
+
+    Returns:
+        Tuple[bool, str]: Кортеж (валидно ли, сообщение о первой ошибке).
+    """
+    errors = validate_data(data)
+    if not errors:
         return True, ""
-    return False, "Invalid data type"
+    message = format_error(errors[0])
+    if len(errors) > 1:
+        message += f" (and {len(errors) - 1} more errors)"
+    return False, message
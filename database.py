@@ -6,19 +6,69 @@
 
 import sqlite3
 import os
+import json
+import time
 from typing import List, Dict
 from datetime import datetime, timedelta
 
 
 DB_FILE = 'history.db'
 
+# Очередь распределенного рендеринга хранится отдельно от истории (см. render_farm)
+QUEUE_DB_FILE = 'render_queue.db'
+
+# Время ожидания блокировки базы (несколько процессов рендеринга пишут одновременно), в секундах
+DB_TIMEOUT = 30
+
+
+# Колонки, добавленные после создания таблиц: {таблица: {колонка: тип}}
+MIGRATED_COLUMNS = {
+    'generation_history': {
+        'content_hash': 'TEXT',
+        'document_id': 'TEXT',
+        'template_hash': 'TEXT',
+        'profile': 'TEXT',
+    },
+    'data_catalog': {
+        'mtime': 'REAL',
+        'format': 'TEXT',
+        'encoding': 'TEXT',
+        'delimiter': 'TEXT',
+        'columns': 'TEXT',
+        'row_count': 'INTEGER',
+        'id_min': 'TEXT',
+        'id_max': 'TEXT',
+        'valid': 'INTEGER',
+        'error': 'TEXT',
+    },
+    'batch_runs': {
+        'kind': 'TEXT',
+        'runner': 'TEXT',
+        'heartbeat': 'REAL',
+    },
+}
+
+
+def _migrate_columns(cursor: sqlite3.Cursor, table: str) -> None:
+    """Добавляет в таблицу недостающие колонки из MIGRATED_COLUMNS."""
+    cursor.execute(f"PRAGMA table_info({table})")
+    existing = {row[1] for row in cursor.fetchall()}
+    for column, column_type in MIGRATED_COLUMNS[table].items():
+        if column not in existing:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
 
 def init_database() -> None:
     """
     Инициализирует базу данных, создавая таблицу generation_history если она не существует.
     """
-    conn = sqlite3.connect(DB_FILE)
+    conn = sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT)
     cursor = conn.cursor()
+    # Журнал отката вместо WAL: WAL требует общей памяти процессов одной машины, а историю
+    # пишут воркеры фермы с разных машин (см. render_farm)
+    cursor.execute("PRAGMA journal_mode")
+    if cursor.fetchone()[0] == 'wal':
+        cursor.execute("PRAGMA journal_mode=DELETE")
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS generation_history (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -32,11 +82,78 @@ def init_database() -> None:
             error_message TEXT
         )
     ''')
+    _migrate_columns(cursor, 'generation_history')
+    # Манифест хранилища документов (см. output_store)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS output_manifest (
+            document_id TEXT PRIMARY KEY,
+            invoice_id TEXT NOT NULL,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_manifest_invoice ON output_manifest (invoice_id)")
+    # Каталог файлов данных (см. data_catalog)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS data_catalog (
+            filename TEXT PRIMARY KEY,
+            content_hash TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            registered DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    _migrate_columns(cursor, 'data_catalog')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_catalog_hash ON data_catalog (content_hash)")
+    # Контрольные точки пакетных генераций (см. batch_runner)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS batch_runs (
+            batch_id TEXT PRIMARY KEY,
+            created DATETIME DEFAULT CURRENT_TIMESTAMP,
+            data_file TEXT NOT NULL,
+            template_name TEXT NOT NULL,
+            profile TEXT,
+            status TEXT NOT NULL DEFAULT 'running'
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS batch_items (
+            batch_id TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            invoice_id TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            output_file TEXT,
+            error_message TEXT,
+            PRIMARY KEY (batch_id, position)
+        )
+    ''')
+    _migrate_columns(cursor, 'batch_runs')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_batch_runs_source ON batch_runs (data_file, template_name, status)")
+    # Сжатые снимки данных счетов и версии шаблонов для пересоздания PDF (см. snapshots)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS render_snapshots (
+            content_hash TEXT PRIMARY KEY,
+            context BLOB NOT NULL,
+            created DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS template_versions (
+            template_hash TEXT PRIMARY KEY,
+            template_name TEXT NOT NULL,
+            source BLOB NOT NULL,
+            created DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_history_source
+        ON generation_history (data_file, template_name, invoice_id)
+    ''')
     conn.commit()
     conn.close()
 
 
-def add_generation_record(invoice_id: str, customer_name: str, data_file: str, template_name: str, output_file: str, status: str, error_msg: str = None) -> int:
+def add_generation_record(invoice_id: str, customer_name: str, data_file: str, template_name: str, output_file: str, status: str, error_msg: str = None, content_hash: str = None, document_id: str = None, template_hash: str = None, profile: str = None) -> int:
     """
     Добавляет запись о генерации PDF в базу данных.
 
@@ -48,16 +165,20 @@ def add_generation_record(invoice_id: str, customer_name: str, data_file: str, t
         output_file (str): Путь к выходному файлу.
         status (str): Статус ('success' или 'error').
         error_msg (str, optional): Сообщение об ошибке.
+        content_hash (str, optional): Хеш содержимого счета (см. compute_invoice_hash).
+        document_id (str, optional): ID документа в хранилище (см. output_store).
+        template_hash (str, optional): Версия шаблона (см. snapshots).
+        profile (str, optional): Профиль оптимизации PDF, с которым сгенерирован документ.
 
     Returns:
         int: ID добавленной записи.
     """
-    conn = sqlite3.connect(DB_FILE)
+    conn = sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT)
     cursor = conn.cursor()
     cursor.execute('''
-        INSERT INTO generation_history (invoice_id, customer_name, data_file, template_name, output_file, status, error_message)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (invoice_id, customer_name, data_file, template_name, output_file, status, error_msg))
+        INSERT INTO generation_history (invoice_id, customer_name, data_file, template_name, output_file, status, error_message, content_hash, document_id, template_hash, profile)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (invoice_id, customer_name, data_file, template_name, output_file, status, error_msg, content_hash, document_id, template_hash, profile))
     record_id = cursor.lastrowid
     conn.commit()
     conn.close()
@@ -75,7 +196,7 @@ def get_history(limit: int = 100, filters: Dict = None) -> List[Dict]:
     Returns:
         List[Dict]: Список записей истории.
     """
-    conn = sqlite3.connect(DB_FILE)
+    conn = sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT)
     cursor = conn.cursor()
     query = "SELECT * FROM generation_history WHERE 1=1"
     params = []
@@ -102,6 +223,157 @@ def get_history(limit: int = 100, filters: Dict = None) -> List[Dict]:
     return results
 
 
+def get_latest_content_hashes(data_file: str, template_name: str) -> Dict[str, Dict]:
+    """
+    Получает хеши содержимого последних успешных генераций для файла данных и шаблона.
+
+    Args:
+        data_file (str): Имя файла данных.
+        template_name (str): Имя шаблона.
+
+    Returns:
+        Dict[str, Dict]: Словарь {invoice_id: {'content_hash', 'output_file', 'template_hash', 'profile'}}.
+    """
+    conn = sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT invoice_id, content_hash, output_file, template_hash, profile FROM generation_history
+        WHERE id IN (
+            SELECT MAX(id) FROM generation_history
+            WHERE data_file = ? AND template_name = ? AND status = 'success' AND content_hash IS NOT NULL
+            GROUP BY invoice_id
+        )
+    ''', (data_file, template_name))
+    rows = cursor.fetchall()
+    conn.close()
+    return {row[0]: {'content_hash': row[1], 'output_file': row[2], 'template_hash': row[3], 'profile': row[4]} for row in rows}
+
+
+def add_manifest_entry(document_id: str, invoice_id: str, path: str, size: int) -> None:
+    """
+    Регистрирует документ в манифесте хранилища.
+
+    Args:
+        document_id (str): Уникальный ID документа.
+        invoice_id (str): ID счета.
+        path (str): Путь к файлу документа.
+        size (int): Размер файла в байтах.
+    """
+    conn = sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT OR REPLACE INTO output_manifest (document_id, invoice_id, path, size) VALUES (?, ?, ?, ?)",
+        (document_id, invoice_id, path, size)
+    )
+    conn.commit()
+    conn.close()
+
+
+def get_manifest_entry(document_id: str) -> Dict:
+    """
+    Получает запись манифеста по ID документа.
+
+    Args:
+        document_id (str): ID документа.
+
+    Returns:
+        Dict: Запись манифеста или пустой словарь, если документ не найден.
+    """
+    conn = sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM output_manifest WHERE document_id = ?", (document_id,))
+    row = cursor.fetchone()
+    columns = [desc[0] for desc in cursor.description]
+    conn.close()
+    return dict(zip(columns, row)) if row else {}
+
+
+def register_data_file(filename: str, content_hash: str, size: int) -> None:
+    """
+    Регистрирует файл данных в каталоге.
+
+    Args:
+        filename (str): Имя файла в директории /data.
+        content_hash (str): SHA-256 хеш содержимого.
+        size (int): Размер файла в байтах.
+    """
+    conn = sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT OR REPLACE INTO data_catalog (filename, content_hash, size) VALUES (?, ?, ?)",
+        (filename, content_hash, size)
+    )
+    conn.commit()
+    conn.close()
+
+
+def find_data_file_by_hash(content_hash: str) -> Dict:
+    """
+    Ищет в каталоге файл данных с указанным хешем содержимого.
+
+    Args:
+        content_hash (str): SHA-256 хеш содержимого.
+
+    Returns:
+        Dict: Запись каталога или пустой словарь, если файл не найден.
+    """
+    conn = sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM data_catalog WHERE content_hash = ? ORDER BY registered LIMIT 1", (content_hash,))
+    row = cursor.fetchone()
+    columns = [desc[0] for desc in cursor.description]
+    conn.close()
+    return dict(zip(columns, row)) if row else {}
+
+
+def get_catalog_entries() -> Dict[str, Dict]:
+    """
+    Получает все записи каталога файлов данных.
+
+    Returns:
+        Dict[str, Dict]: Словарь {имя файла: запись каталога}.
+    """
+    conn = sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM data_catalog")
+    rows = cursor.fetchall()
+    columns = [desc[0] for desc in cursor.description]
+    conn.close()
+    return {row[0]: dict(zip(columns, row)) for row in rows}
+
+
+def save_catalog_entry(entry: Dict) -> None:
+    """
+    Сохраняет запись каталога файлов данных, заменяя существующую.
+
+    Args:
+        entry (Dict): Запись каталога; ключи соответствуют колонкам таблицы data_catalog.
+    """
+    columns = list(entry)
+    conn = sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+    cursor.execute(
+        f"INSERT OR REPLACE INTO data_catalog ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+        [entry[column] for column in columns]
+    )
+    conn.commit()
+    conn.close()
+
+
+def delete_catalog_entries(filenames: List[str]) -> None:
+    """
+    Удаляет записи каталога для отсутствующих файлов.
+
+    Args:
+        filenames (List[str]): Имена файлов.
+    """
+    conn = sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+    cursor.executemany("DELETE FROM data_catalog WHERE filename = ?", [(name,) for name in filenames])
+    conn.commit()
+    conn.close()
+
+
 def get_statistics() -> Dict:
     """
     Получает статистику генераций.
@@ -109,7 +381,7 @@ def get_statistics() -> Dict:
     Returns:
         Dict: Словарь со статистикой (total, today, week).
     """
-    conn = sqlite3.connect(DB_FILE)
+    conn = sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT)
     cursor = conn.cursor()
     # Общее количество
     cursor.execute("SELECT COUNT(*) FROM generation_history")
@@ -139,7 +411,7 @@ def delete_record(record_id: int) -> bool:
     Returns:
         bool: True если удаление успешно, False в противном случае.
     """
-    conn = sqlite3.connect(DB_FILE)
+    conn = sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT)
     cursor = conn.cursor()
     cursor.execute("DELETE FROM generation_history WHERE id = ?", (record_id,))
     deleted = cursor.rowcount > 0
@@ -155,9 +427,521 @@ def clear_history() -> bool:
     Returns:
         bool: True если очистка успешна.
     """
-    conn = sqlite3.connect(DB_FILE)
+    conn = sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT)
     cursor = conn.cursor()
     cursor.execute("DELETE FROM generation_history")
+    cursor.execute("DELETE FROM render_snapshots")
     conn.commit()
     conn.close()
     return True
+
+
+def init_render_queue() -> None:
+    """
+    Инициализирует базу очереди распределенного рендеринга.
+
+    База использует журнал отката (не WAL), поэтому ее можно разместить на общем
+    сетевом диске и захватывать шарды воркерами с разных машин.
+    """
+    conn = sqlite3.connect(QUEUE_DB_FILE, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA journal_mode=DELETE")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS render_jobs (
+            job_id TEXT PRIMARY KEY,
+            created DATETIME DEFAULT CURRENT_TIMESTAMP,
+            data_file TEXT NOT NULL,
+            template_name TEXT NOT NULL,
+            profile TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS render_shards (
+            shard_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id TEXT NOT NULL,
+            invoice_ids TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            worker_id TEXT,
+            lease_expires REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error_message TEXT
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_shards_status ON render_shards (status, lease_expires)")
+    # Счета шарда, результат которых уже записан в историю: повторная попытка шарда их пропускает
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS render_shard_items (
+            shard_id INTEGER NOT NULL,
+            invoice_id TEXT NOT NULL,
+            PRIMARY KEY (shard_id, invoice_id)
+        )
+    ''')
+    conn.commit()
+    conn.close()
+
+
+def create_render_job(job_id: str, data_file: str, template_name: str, shards: List[List[str]], profile: str = None) -> None:
+    """
+    Создает задание распределенного рендеринга и ставит его шарды в очередь.
+
+    Args:
+        job_id (str): Уникальный ID задания.
+        data_file (str): Имя файла данных.
+        template_name (str): Имя шаблона.
+        shards (List[List[str]]): Списки ID счетов, по одному на шард.
+        profile (str, optional): Профиль оптимизации PDF.
+    """
+    conn = sqlite3.connect(QUEUE_DB_FILE, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT INTO render_jobs (job_id, data_file, template_name, profile) VALUES (?, ?, ?, ?)",
+        (job_id, data_file, template_name, profile)
+    )
+    cursor.executemany(
+        "INSERT INTO render_shards (job_id, invoice_ids) VALUES (?, ?)",
+        [(job_id, json.dumps(shard, ensure_ascii=False)) for shard in shards]
+    )
+    conn.commit()
+    conn.close()
+
+
+def claim_render_shard(worker_id: str, lease_seconds: float, max_attempts: int) -> Dict:
+    """
+    Атомарно захватывает свободный шард или шард с истекшей арендой (умерший воркер).
+
+    Шарды с истекшей арендой, исчерпавшие max_attempts попыток, помечаются как failed.
+
+    Args:
+        worker_id (str): ID воркера.
+        lease_seconds (float): Длительность аренды в секундах.
+        max_attempts (int): Максимальное число попыток обработки шарда.
+
+    Returns:
+        Dict: Шард с данными задания или пустой словарь, если очередь пуста.
+    """
+    now = time.time()
+    conn = sqlite3.connect(QUEUE_DB_FILE, timeout=DB_TIMEOUT, isolation_level=None)
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    cursor.execute('''
+        UPDATE render_shards SET status = 'failed', error_message = 'Lease expired too many times'
+        WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?
+    ''', (now, max_attempts))
+    cursor.execute('''
+        SELECT s.shard_id, s.job_id, s.invoice_ids, s.attempts, j.data_file, j.template_name, j.profile
+        FROM render_shards s JOIN render_jobs j ON j.job_id = s.job_id
+        WHERE s.status = 'pending' OR (s.status = 'leased' AND s.lease_expires < ?)
+        ORDER BY s.shard_id LIMIT 1
+    ''', (now,))
+    row = cursor.fetchone()
+    shard = {}
+    if row:
+        columns = [desc[0] for desc in cursor.description]
+        shard = dict(zip(columns, row))
+        shard['invoice_ids'] = json.loads(shard['invoice_ids'])
+        shard['attempts'] += 1
+        cursor.execute(
+            "UPDATE render_shards SET status = 'leased', worker_id = ?, lease_expires = ?, attempts = ? WHERE shard_id = ?",
+            (worker_id, now + lease_seconds, shard['attempts'], shard['shard_id'])
+        )
+    cursor.execute("COMMIT")
+    conn.close()
+    return shard
+
+
+def renew_shard_lease(shard_id: int, worker_id: str, lease_seconds: float) -> bool:
+    """
+    Продлевает аренду шарда (heartbeat воркера).
+
+    Args:
+        shard_id (int): ID шарда.
+        worker_id (str): ID воркера.
+        lease_seconds (float): Новая длительность аренды от текущего момента.
+
+    Returns:
+        bool: False если шард больше не принадлежит воркеру.
+    """
+    conn = sqlite3.connect(QUEUE_DB_FILE, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+    cursor.execute(
+        "UPDATE render_shards SET lease_expires = ? WHERE shard_id = ? AND worker_id = ? AND status = 'leased'",
+        (time.time() + lease_seconds, shard_id, worker_id)
+    )
+    renewed = cursor.rowcount > 0
+    conn.commit()
+    conn.close()
+    return renewed
+
+
+def finish_render_shard(shard_id: int, worker_id: str, status: str, error_msg: str = None) -> None:
+    """
+    Завершает обработку шарда воркером.
+
+    Args:
+        shard_id (int): ID шарда.
+        worker_id (str): ID воркера.
+        status (str): Новый статус ('done', 'failed' или 'pending' для повторной попытки).
+        error_msg (str, optional): Сообщение об ошибке.
+    """
+    conn = sqlite3.connect(QUEUE_DB_FILE, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+    cursor.execute(
+        "UPDATE render_shards SET status = ?, error_message = ?, lease_expires = NULL WHERE shard_id = ? AND worker_id = ?",
+        (status, error_msg, shard_id, worker_id)
+    )
+    conn.commit()
+    conn.close()
+
+
+def get_render_job_status(job_id: str) -> Dict:
+    """
+    Получает количество шардов задания по статусам.
+
+    Args:
+        job_id (str): ID задания.
+
+    Returns:
+        Dict: Словарь {статус: количество шардов}.
+    """
+    conn = sqlite3.connect(QUEUE_DB_FILE, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+    cursor.execute("SELECT status, COUNT(*) FROM render_shards WHERE job_id = ? GROUP BY status", (job_id,))
+    status = dict(cursor.fetchall())
+    conn.close()
+    return status
+
+
+def count_active_shards() -> int:
+    """
+    Получает число шардов всех заданий, которые еще ожидают обработки или арендованы воркерами.
+
+    Returns:
+        int: Количество шардов со статусом 'pending' или 'leased'.
+    """
+    conn = sqlite3.connect(QUEUE_DB_FILE, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM render_shards WHERE status IN ('pending', 'leased')")
+    count = cursor.fetchone()[0]
+    conn.close()
+    return count
+
+
+def mark_shard_invoice_done(shard_id: int, invoice_id: str) -> None:
+    """
+    Отмечает, что результат счета шарда записан в историю.
+
+    Args:
+        shard_id (int): ID шарда.
+        invoice_id (str): ID счета.
+    """
+    conn = sqlite3.connect(QUEUE_DB_FILE, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+    cursor.execute("INSERT OR IGNORE INTO render_shard_items (shard_id, invoice_id) VALUES (?, ?)", (shard_id, invoice_id))
+    conn.commit()
+    conn.close()
+
+
+def get_shard_done_invoices(shard_id: int) -> set:
+    """
+    Получает счета шарда, обработанные предыдущими попытками.
+
+    Args:
+        shard_id (int): ID шарда.
+
+    Returns:
+        set: ID счетов.
+    """
+    conn = sqlite3.connect(QUEUE_DB_FILE, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+    cursor.execute("SELECT invoice_id FROM render_shard_items WHERE shard_id = ?", (shard_id,))
+    done = {row[0] for row in cursor.fetchall()}
+    conn.close()
+    return done
+
+
+def create_batch_run(batch_id: str, data_file: str, template_name: str, invoice_ids: List[str],
+                     profile: str = None, done: Dict[str, str] = None, kind: str = None) -> None:
+    """
+    Создает пакетную генерацию с контрольными точками по каждому счету.
+
+    Args:
+        batch_id (str): Уникальный ID пакета.
+        data_file (str): Имя файла данных.
+        template_name (str): Имя шаблона.
+        invoice_ids (List[str]): ID счетов пакета в порядке генерации.
+        profile (str, optional): Профиль оптимизации PDF.
+        done (Dict[str, str], optional): Уже готовые счета {ID счета: путь к PDF} (например, неизмененные).
+        kind (str, optional): Вид пакета; 'regenerate' для пересоздания из снимков (см. snapshots).
+    """
+    done = done or {}
+    conn = sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+    # Отметка времени сразу при создании: пакет не считается прерванным до первого запуска
+    cursor.execute(
+        "INSERT INTO batch_runs (batch_id, data_file, template_name, profile, kind, heartbeat) VALUES (?, ?, ?, ?, ?, ?)",
+        (batch_id, data_file, template_name, profile, kind, time.time())
+    )
+    cursor.executemany(
+        "INSERT INTO batch_items (batch_id, position, invoice_id, status, output_file) VALUES (?, ?, ?, ?, ?)",
+        [(batch_id, position, invoice_id, 'done' if invoice_id in done else 'pending', done.get(invoice_id))
+         for position, invoice_id in enumerate(invoice_ids)]
+    )
+    conn.commit()
+    conn.close()
+
+
+def get_batch_run(batch_id: str) -> Dict:
+    """
+    Получает пакетную генерацию с количеством счетов по статусам.
+
+    Args:
+        batch_id (str): ID пакета.
+
+    Returns:
+        Dict: Пакет с ключом 'counts' ({статус: количество}) или пустой словарь, если пакет не найден.
+    """
+    conn = sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM batch_runs WHERE batch_id = ?", (batch_id,))
+    row = cursor.fetchone()
+    run = {}
+    if row:
+        columns = [desc[0] for desc in cursor.description]
+        run = dict(zip(columns, row))
+        cursor.execute("SELECT status, COUNT(*) FROM batch_items WHERE batch_id = ? GROUP BY status", (batch_id,))
+        run['counts'] = dict(cursor.fetchall())
+    conn.close()
+    return run
+
+
+def get_unfinished_batch_runs(data_file: str, template_name: str, stale_before: float) -> List[Dict]:
+    """
+    Получает незавершенные (прерванные или отмененные) пакеты для файла данных и шаблона.
+
+    Пакет со статусом 'running' считается прерванным, только если его отметка
+    активности старше stale_before: иначе он еще выполняется в другой сессии.
+    Пакеты пересоздания из снимков не включаются: их данные не связаны с текущим файлом.
+
+    Args:
+        data_file (str): Имя файла данных.
+        template_name (str): Имя шаблона.
+        stale_before (float): Время (time.time()), до которого отметка активности считается устаревшей.
+
+    Returns:
+        List[Dict]: Пакеты (см. get_batch_run), новые первыми.
+    """
+    conn = sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT batch_id FROM batch_runs
+        WHERE data_file = ? AND template_name = ? AND kind IS NULL
+          AND (status = 'cancelled' OR (status = 'running' AND (heartbeat IS NULL OR heartbeat < ?)))
+        ORDER BY created DESC, rowid DESC
+    ''', (data_file, template_name, stale_before))
+    batch_ids = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    return [get_batch_run(batch_id) for batch_id in batch_ids]
+
+
+def get_batch_items(batch_id: str, status: str = None) -> List[Dict]:
+    """
+    Получает счета пакета в порядке генерации.
+
+    Args:
+        batch_id (str): ID пакета.
+        status (str, optional): Фильтр по статусу ('pending', 'done' или 'failed').
+
+    Returns:
+        List[Dict]: Счета пакета.
+    """
+    conn = sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+    query = "SELECT position, invoice_id, status, output_file, error_message FROM batch_items WHERE batch_id = ?"
+    params = [batch_id]
+    if status:
+        query += " AND status = ?"
+        params.append(status)
+    cursor.execute(query + " ORDER BY position", params)
+    columns = [desc[0] for desc in cursor.description]
+    items = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    conn.close()
+    return items
+
+
+def update_batch_item(batch_id: str, position: int, status: str, output_file: str = None, error_msg: str = None) -> None:
+    """
+    Записывает контрольную точку: результат генерации одного счета пакета.
+
+    Args:
+        batch_id (str): ID пакета.
+        position (int): Позиция счета в пакете.
+        status (str): Статус ('done' или 'failed').
+        output_file (str, optional): Путь к PDF.
+        error_msg (str, optional): Сообщение об ошибке.
+    """
+    conn = sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+    cursor.execute(
+        "UPDATE batch_items SET status = ?, output_file = ?, error_message = ? WHERE batch_id = ? AND position = ?",
+        (status, output_file, error_msg, batch_id, position)
+    )
+    conn.commit()
+    conn.close()
+
+
+def claim_batch_run(batch_id: str, runner_id: str, stale_before: float) -> bool:
+    """
+    Захватывает пакет для выполнения, если он не выполняется в другой сессии.
+
+    Захват возможен для нового, отмененного или прерванного пакета (отметка
+    активности старше stale_before); пакет переводится в статус 'running'.
+
+    Args:
+        batch_id (str): ID пакета.
+        runner_id (str): Уникальный ID выполняющего процесса.
+        stale_before (float): Время (time.time()), до которого отметка активности считается устаревшей.
+
+    Returns:
+        bool: True, если пакет захвачен.
+    """
+    conn = sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+    cursor.execute('''
+        UPDATE batch_runs SET status = 'running', runner = ?, heartbeat = ?
+        WHERE batch_id = ? AND (status = 'cancelled'
+              OR (status = 'running' AND (runner IS NULL OR heartbeat IS NULL OR heartbeat < ?)))
+    ''', (runner_id, time.time(), batch_id, stale_before))
+    claimed = cursor.rowcount > 0
+    conn.commit()
+    conn.close()
+    return claimed
+
+
+def touch_batch_run(batch_id: str, runner_id: str) -> bool:
+    """
+    Обновляет отметку активности пакета.
+
+    Args:
+        batch_id (str): ID пакета.
+        runner_id (str): ID процесса, захватившего пакет (см. claim_batch_run).
+
+    Returns:
+        bool: False, если пакет отменен или захвачен другим процессом.
+    """
+    conn = sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+    cursor.execute(
+        "UPDATE batch_runs SET heartbeat = ? WHERE batch_id = ? AND runner = ? AND status = 'running'",
+        (time.time(), batch_id, runner_id)
+    )
+    active = cursor.rowcount > 0
+    conn.commit()
+    conn.close()
+    return active
+
+
+def set_batch_run_status(batch_id: str, status: str) -> None:
+    """
+    Изменяет статус пакета ('running', 'cancelled', 'done' или 'discarded').
+
+    Args:
+        batch_id (str): ID пакета.
+        status (str): Новый статус.
+    """
+    conn = sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+    cursor.execute("UPDATE batch_runs SET status = ? WHERE batch_id = ?", (status, batch_id))
+    conn.commit()
+    conn.close()
+
+
+def save_render_snapshot(content_hash: str, context: bytes) -> None:
+    """
+    Сохраняет сжатый снимок данных счета; одинаковые снимки хранятся один раз.
+
+    Args:
+        content_hash (str): Хеш содержимого счета (см. compute_invoice_hash).
+        context (bytes): Сжатые данные счета.
+    """
+    conn = sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+    cursor.execute("INSERT OR IGNORE INTO render_snapshots (content_hash, context) VALUES (?, ?)", (content_hash, context))
+    conn.commit()
+    conn.close()
+
+
+def get_render_snapshot(content_hash: str) -> bytes:
+    """
+    Получает сжатый снимок данных счета.
+
+    Args:
+        content_hash (str): Хеш содержимого счета.
+
+    Returns:
+        bytes: Сжатые данные или None, если снимок не найден.
+    """
+    conn = sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+    cursor.execute("SELECT context FROM render_snapshots WHERE content_hash = ?", (content_hash,))
+    row = cursor.fetchone()
+    conn.close()
+    return row[0] if row else None
+
+
+def save_template_version(template_hash: str, template_name: str, source: bytes) -> None:
+    """
+    Сохраняет сжатый исходный код версии шаблона; одинаковые версии хранятся один раз.
+
+    Args:
+        template_hash (str): Версия шаблона (source_hash из load_template).
+        template_name (str): Имя шаблона.
+        source (bytes): Сжатый исходный код шаблона.
+    """
+    conn = sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT OR IGNORE INTO template_versions (template_hash, template_name, source) VALUES (?, ?, ?)",
+        (template_hash, template_name, source)
+    )
+    conn.commit()
+    conn.close()
+
+
+def get_template_version(template_hash: str) -> Dict:
+    """
+    Получает версию шаблона.
+
+    Args:
+        template_hash (str): Версия шаблона.
+
+    Returns:
+        Dict: {'template_name', 'source'} со сжатым исходным кодом или пустой словарь.
+    """
+    conn = sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+    cursor.execute("SELECT template_name, source FROM template_versions WHERE template_hash = ?", (template_hash,))
+    row = cursor.fetchone()
+    conn.close()
+    return {'template_name': row[0], 'source': row[1]} if row else {}
+
+
+def get_history_records(record_ids: List[int]) -> List[Dict]:
+    """
+    Получает записи истории по ID.
+
+    Args:
+        record_ids (List[int]): ID записей.
+
+    Returns:
+        List[Dict]: Найденные записи, новые первыми.
+    """
+    if not record_ids:
+        return []
+    conn = sqlite3.connect(DB_FILE, timeout=DB_TIMEOUT)
+    cursor = conn.cursor()
+    placeholders = ', '.join('?' for _ in record_ids)
+    cursor.execute(f"SELECT * FROM generation_history WHERE id IN ({placeholders}) ORDER BY id DESC", [int(i) for i in record_ids])
+    columns = [desc[0] for desc in cursor.description]
+    records = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    conn.close()
+    return records
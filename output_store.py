@@ -0,0 +1,113 @@
+"""
+Модуль хранилища сгенерированных документов.
+
+Выдает документам уникальные ID, раскладывает файлы по поддиректориям дата/хеш,
+записывает их атомарно и ведет индекс-манифест в базе данных.
+"""
+
+from typing import Callable, Optional, Tuple
+from datetime import datetime
+import os
+import re
+import uuid
+
+from database import add_manifest_entry, get_manifest_entry
+
+
+OUTPUT_DIR = 'output'
+
+
+def new_document_id() -> str:
+    """
+    Генерирует уникальный ID документа.
+
+    Returns:
+        str: 32-символьный hex идентификатор.
+    """
+    return uuid.uuid4().hex
+
+
+def safe_filename(name: str) -> str:
+    """
+    Приводит строку к безопасному имени файла.
+
+    Args:
+        name (str): Исходная строка (например, ID счета).
+
+    Returns:
+        str: Имя без разделителей путей и служебных символов.
+    """
+    return re.sub(r'[^\w.-]', '_', name) or 'document'
+
+
+def allocate_output_path(name: str, document_id: str, extension: str = '.pdf', when: datetime = None) -> str:
+    """
+    Вычисляет путь документа в шардированном хранилище и создает его директорию.
+
+    Путь имеет вид output/ГГГГ/ММ/ДД/<первые 2 символа ID>/<имя>_<ID><расширение>,
+    так что в одной директории остается ограниченное число файлов.
+
+    Args:
+        name (str): Человекочитаемая часть имени (например, ID счета).
+        document_id (str): Уникальный ID документа.
+        extension (str): Расширение файла.
+        when (datetime, optional): Дата для шардирования; по умолчанию текущая.
+
+    Returns:
+        str: Путь к файлу документа.
+    """
+    when = when or datetime.now()
+    directory = os.path.join(OUTPUT_DIR, when.strftime('%Y'), when.strftime('%m'), when.strftime('%d'), document_id[:2])
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"{safe_filename(name)}_{document_id}{extension}")
+
+
+def store_document(invoice_id: str, render: Callable[[str], bool], extension: str = '.pdf') -> Optional[Tuple[str, str]]:
+    """
+    Атомарно сохраняет документ в хранилище и регистрирует его в манифесте.
+
+    Рендеринг выполняется во временный файл рядом с итоговым, который затем
+    переименовывается; недописанный файл никогда не появляется под итоговым именем.
+
+    Args:
+        invoice_id (str): ID счета.
+        render (Callable[[str], bool]): Функция, записывающая документ по переданному пути.
+        extension (str): Расширение файла.
+
+    Returns:
+        Optional[Tuple[str, str]]: Кортеж (ID документа, путь к файлу) или None при ошибке.
+    """
+    document_id = new_document_id()
+    output_path = allocate_output_path(invoice_id, document_id, extension)
+    tmp_path = output_path + '.part'
+    try:
+        if not render(tmp_path):
+            return None
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    add_manifest_entry(document_id, invoice_id, output_path, os.path.getsize(output_path))
+    return document_id, output_path
+
+
+def resolve_document(record: dict) -> Optional[str]:
+    """
+    Находит файл документа для записи истории через манифест, без сканирования директорий.
+
+    Args:
+        record (dict): Запись истории генераций.
+
+    Returns:
+        Optional[str]: Путь к существующему файлу или None.
+    """
+    path = None
+    document_id = record.get('document_id')
+    # Записи, созданные до появления хранилища, не имеют ID документа (None/NaN)
+    if isinstance(document_id, str) and document_id:
+        entry = get_manifest_entry(document_id)
+        path = entry['path'] if entry else None
+    path = path or record.get('output_file')
+    if path and os.path.exists(path):
+        return path
+    return None
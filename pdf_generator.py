@@ -4,14 +4,21 @@
 Поддерживает пакетную генерацию, архивацию и открытие PDF файлов.
 """
 
-from typing import List, Dict
-import jinja2
-import weasyprint
+from typing import List, Dict, Tuple, TYPE_CHECKING
+import io
 import os
+import hashlib
+import tempfile
+import time
 import platform
 import subprocess
 import zipfile
-from datetime import datetime
+from collections import OrderedDict
+
+from output_store import store_document
+
+if TYPE_CHECKING:
+    import jinja2  # Только для аннотаций: Jinja2 загружается при первой компиляции шаблона
 
 
 def list_templates() -> List[str]:
@@ -28,7 +35,7 @@ def list_templates() -> List[str]:
     return sorted(files)
 
 
-def load_template(template_name: str) -> jinja2.Template:
+def load_template(template_name: str) -> 'jinja2.Template':
     """
     Загружает HTML шаблон из файла.
 
@@ -46,13 +53,36 @@ def load_template(template_name: str) -> jinja2.Template:
         raise FileNotFoundError(f"Template {template_name} not found")
     with open(template_path, 'r', encoding='utf-8') as f:
         content = f.read()
-    return jinja2.Template(content)
+    return template_from_source(template_name, content)
+
+
+def template_from_source(template_name: str, content: str) -> 'jinja2.Template':
+    """
+    Компилирует шаблон из исходного кода (например, сохраненной версии шаблона).
+
+    Args:
+        template_name (str): Имя шаблона.
+        content (str): Исходный код HTML шаблона.
+
+    Returns:
+        jinja2.Template: Шаблон с атрибутами name, source и source_hash.
+    """
+    import jinja2  # Импорт здесь: Jinja2 не нужен для первой отрисовки приложения
+    template = jinja2.Template(content)
+    template.name = template_name
+    template.source = content
+    # Версия шаблона: используется как ключ кешей, зависящих от его содержимого
+    template.source_hash = hashlib.sha256(content.encode('utf-8')).hexdigest()[:16]
+    return template
 
 
-def render_html(template: jinja2.Template, data: Dict) -> str:
+def render_html(template: 'jinja2.Template', data: Dict) -> str:
     """
     Рендерит HTML из шаблона с данными.
 
+    Шаблонам с постраничной разбивкой (см. get_chunk_rows) дополнительно передаются
+    все страницы-чанки товаров, как одна часть документа.
+
     Args:
         template (jinja2.Template): Шаблон Jinja2.
         data (Dict): Данные для подстановки в шаблон.
@@ -60,29 +90,696 @@ def render_html(template: jinja2.Template, data: Dict) -> str:
     Returns:
         str: Рендеренный HTML код.
     """
+    rows = get_chunk_rows(template)
+    if rows:
+        return render_chunk_part(template, data, chunk_items(data.get('items', []), rows), True, True)
     return template.render(**data)
 
 
-def generate_pdf(html: str, output_path: str) -> bool:
+# Шаблон включает постраничную разбивку товаров объявлением {% set chunk_rows = N %}:
+# таблица товаров делится на страницы по N строк, каждая со своей шапкой и промежуточными итогами
+CHUNK_ROWS_VARIABLE = 'chunk_rows'
+
+# Число товаров, начиная с которого документ верстается по частям
+LARGE_DOCUMENT_ITEMS = 500
+
+# Число страниц-чанков, верстаемых WeasyPrint за один вызов в режиме больших документов
+CHUNKS_PER_RENDER = 10
+
+
+def get_chunk_rows(template: 'jinja2.Template') -> int:
+    """
+    Возвращает число строк товаров на странице для шаблона с постраничной разбивкой.
+
+    Args:
+        template (jinja2.Template): Шаблон Jinja2.
+
+    Returns:
+        int: Число строк или 0, если шаблон не объявляет chunk_rows.
+    """
+    try:
+        rows = getattr(template.module, CHUNK_ROWS_VARIABLE, 0)
+    except Exception:
+        return 0
+    return rows if isinstance(rows, int) and rows > 0 else 0
+
+
+def chunk_items(items: List[Dict], rows: int) -> List[Dict]:
+    """
+    Делит товары на страницы-чанки с нарастающими итогами.
+
+    Args:
+        items (List[Dict]): Товары счета (с полем total).
+        rows (int): Число строк на странице.
+
+    Returns:
+        List[Dict]: Чанки {'start' — номер первой строки минус один, 'items', 'carried' — итог
+            предыдущих страниц, 'subtotal' — итог с учетом этой страницы, 'first', 'last'}.
+            Для счета без товаров возвращается один пустой чанк.
+    """
+    chunks = []
+    running = 0
+    for start in range(0, max(len(items), 1), rows):
+        page = items[start:start + rows]
+        carried = running
+        running += sum(item.get('total', 0) for item in page)
+        chunks.append({'start': start, 'items': page, 'carried': carried, 'subtotal': running,
+                       'first': start == 0, 'last': start + rows >= len(items)})
+    return chunks
+
+
+def render_chunk_part(template: 'jinja2.Template', data: Dict, chunks: List[Dict], first_part: bool, last_part: bool) -> str:
+    """
+    Рендерит HTML части документа из последовательных страниц-чанков.
+
+    Шаблон выводит шапку документа при first_part и общий итог при last_part.
+
+    Args:
+        template (jinja2.Template): Шаблон с chunk_rows.
+        data (Dict): Данные счета.
+        chunks (List[Dict]): Страницы-чанки части (см. chunk_items).
+        first_part (bool): Первая часть документа.
+        last_part (bool): Последняя часть документа.
+
+    Returns:
+        str: Рендеренный HTML код части.
+    """
+    return template.render(**data, chunks=chunks, first_part=first_part, last_part=last_part)
+
+
+def generate_chunked_pdf(template: 'jinja2.Template', data: Dict, output_path: str, profile: str = None) -> bool:
+    """
+    Генерирует PDF большого документа, верстая страницы-чанки частями по CHUNKS_PER_RENDER.
+
+    Каждая часть верстается отдельным вызовом WeasyPrint, поэтому время верстки растет
+    линейно с числом строк; страницы частей объединяются в один документ.
+
+    Args:
+        template (jinja2.Template): Шаблон с chunk_rows.
+        data (Dict): Данные счета.
+        output_path (str): Путь для сохранения PDF файла.
+        profile (str, optional): Имя профиля оптимизации.
+
+    Returns:
+        bool: True если генерация успешна, False в противном случае.
+    """
+    try:
+        import weasyprint  # Импорт здесь: загрузка Pango/cairo нужна только при генерации
+        chunks = chunk_items(data.get('items', []), get_chunk_rows(template))
+        documents = []
+        for start in range(0, len(chunks), CHUNKS_PER_RENDER):
+            part = chunks[start:start + CHUNKS_PER_RENDER]
+            html = render_chunk_part(template, data, part, start == 0, start + CHUNKS_PER_RENDER >= len(chunks))
+            documents.append(weasyprint.HTML(string=html).render())
+        pages = [page for document in documents for page in document.pages]
+        documents[0].copy(pages).write_pdf(output_path, **_weasyprint_options(profile))
+        return True
+    except Exception as e:
+        print(f"Error generating chunked PDF: {e}")
+        return False
+
+
+# Профили оптимизации выходного PDF.
+# Параметры WeasyPrint: optimize_images, jpeg_quality, dpi (даунскейл изображений);
+# постобработка: strip_metadata, compress_streams. Шрифты во всех профилях встраиваются
+# подмножеством глифов (поведение WeasyPrint и fpdf2 по умолчанию).
+PDF_PROFILES = {
+    'print': {
+        'optimize_images': False, 'jpeg_quality': None, 'dpi': None,
+        'strip_metadata': False, 'compress_streams': False,
+    },
+    'archive': {
+        'optimize_images': True, 'jpeg_quality': 90, 'dpi': 300,
+        'strip_metadata': False, 'compress_streams': True,
+    },
+    'email': {
+        'optimize_images': True, 'jpeg_quality': 60, 'dpi': 150,
+        'strip_metadata': True, 'compress_streams': True,
+    },
+}
+
+DEFAULT_PDF_PROFILE = 'print'
+
+
+def get_pdf_profile(profile: str = None) -> Dict:
+    """
+    Возвращает настройки профиля оптимизации PDF.
+
+    Args:
+        profile (str, optional): Имя профиля; по умолчанию DEFAULT_PDF_PROFILE.
+
+    Returns:
+        Dict: Настройки профиля.
+
+    Raises:
+        ValueError: Если профиль не существует.
+    """
+    name = profile or DEFAULT_PDF_PROFILE
+    if name not in PDF_PROFILES:
+        raise ValueError(f"Unknown PDF profile: {name}")
+    return PDF_PROFILES[name]
+
+
+def _weasyprint_options(profile: str = None) -> Dict:
+    """Преобразует профиль в именованные аргументы write_pdf WeasyPrint."""
+    settings = get_pdf_profile(profile)
+    options = {'optimize_images': settings['optimize_images']}
+    if settings['jpeg_quality']:
+        options['jpeg_quality'] = settings['jpeg_quality']
+    if settings['dpi']:
+        options['dpi'] = settings['dpi']
+    return options
+
+
+def optimize_pdf(path: str, profile: str = None) -> None:
+    """
+    Применяет к готовому PDF постобработку профиля: удаление метаданных и сжатие потоков.
+
+    Args:
+        path (str): Путь к PDF файлу (перезаписывается на месте).
+        profile (str, optional): Имя профиля оптимизации.
+    """
+    settings = get_pdf_profile(profile)
+    if not settings['strip_metadata'] and not settings['compress_streams']:
+        return
+    import pypdf  # Импорт здесь: тяжелые PDF библиотеки загружаются только при генерации
+    writer = pypdf.PdfWriter(clone_from=path)
+    if settings['compress_streams']:
+        for page in writer.pages:
+            page.compress_content_streams()
+    if settings['strip_metadata']:
+        writer.metadata = None
+        if '/Metadata' in writer.root_object:
+            del writer.root_object['/Metadata']
+    with open(path, 'wb') as f:
+        writer.write(f)
+
+
+def generate_pdf(html: str, output_path: str, profile: str = None) -> bool:
     """
     Генерирует PDF из HTML строки и сохраняет в файл.
 
     Args:
         html (str): HTML код для конвертации.
         output_path (str): Путь для сохранения PDF файла.
+        profile (str, optional): Имя профиля оптимизации (см. PDF_PROFILES).
 
     Returns:
         bool: True если генерация успешна, False в противном случае.
     """
     try:
-        weasyprint.HTML(string=html).write_pdf(output_path)
+        import weasyprint  # Импорт здесь: загрузка Pango/cairo нужна только при генерации
+        weasyprint.HTML(string=html).write_pdf(output_path, **_weasyprint_options(profile))
         return True
     except Exception as e:
         print(f"Error generating PDF: {e}")
         return False
 
 
-def generate_batch_pdf(invoice_ids: List[str], data, template: jinja2.Template) -> List[str]:
+# Слои шаблонов с фиксированной разметкой (см. is_overlay_template)
+OVERLAY_LAYERS = ('background', 'fields')
+
+# Прозрачный фон для слоя полей, чтобы он не перекрывал статическую подложку
+OVERLAY_FIELDS_STYLE = '<style>html, body { background: transparent !important; }</style>'
+
+# Шаблоны слоев: наследуют шаблон наложения и заменяют блок другого слоя пустым
+OVERLAY_LAYER_SOURCES = {
+    'background': '{% extends overlay_template %}{% block fields %}{% endblock %}',
+    'fields': '{% extends overlay_template %}{% block background %}{% endblock %}',
+}
+
+# Число подложек (версия шаблона и профиль), хранящихся в кеше процесса
+OVERLAY_CACHE_SIZE = 32
+
+# Кеш отрендеренных подложек (LRU): {(хеш шаблона, профиль): байты PDF}
+_overlay_backgrounds: Dict[Tuple[str, str], bytes] = OrderedDict()
+
+# Скомпилированные шаблоны слоев: {слой: шаблон}
+_overlay_layers: Dict[str, 'jinja2.Template'] = {}
+
+
+def is_overlay_template(template: 'jinja2.Template') -> bool:
+    """
+    Проверяет, поддерживает ли шаблон быстрый режим наложения.
+
+    Шаблон с фиксированной разметкой (чеки, сертификаты) объявляет блоки
+    {% block background %} со статической частью страницы и {% block fields %}
+    с абсолютно позиционированными переменными полями.
+
+    Args:
+        template (jinja2.Template): Шаблон Jinja2.
+
+    Returns:
+        bool: True если шаблон содержит оба блока.
+    """
+    return all(layer in template.blocks for layer in OVERLAY_LAYERS)
+
+
+def render_html_layer(template: 'jinja2.Template', data: Dict, layer: str) -> str:
+    """
+    Рендерит HTML только одного слоя шаблона наложения, опуская другой блок.
+
+    Args:
+        template (jinja2.Template): Шаблон с блоками background и fields.
+        data (Dict): Данные для подстановки в шаблон.
+        layer (str): Слой для рендеринга ('background' или 'fields').
+
+    Returns:
+        str: Рендеренный HTML код слоя.
+
+    Raises:
+        ValueError: Если слой не поддерживается.
+    """
+    if layer not in OVERLAY_LAYERS:
+        raise ValueError(f"Unknown overlay layer: {layer}")
+    if layer not in _overlay_layers:
+        import jinja2  # Импорт здесь: Jinja2 не нужен для первой отрисовки приложения
+        _overlay_layers[layer] = jinja2.Template(OVERLAY_LAYER_SOURCES[layer])
+    html = _overlay_layers[layer].render(data, overlay_template=template)
+    if layer == 'fields':
+        html = html.replace('</head>', OVERLAY_FIELDS_STYLE + '</head>', 1)
+    return html
+
+
+def get_overlay_background(template: 'jinja2.Template', profile: str = None) -> bytes:
+    """
+    Возвращает PDF статической подложки шаблона, рендеря ее один раз на версию шаблона.
+
+    Args:
+        template (jinja2.Template): Шаблон с блоками background и fields.
+        profile (str, optional): Имя профиля оптимизации.
+
+    Returns:
+        bytes: Одностраничный PDF подложки.
+    """
+    key = (getattr(template, 'source_hash', None) or str(id(template)), profile or DEFAULT_PDF_PROFILE)
+    if key in _overlay_backgrounds:
+        _overlay_backgrounds.move_to_end(key)
+        return _overlay_backgrounds[key]
+    import weasyprint  # Импорт здесь: загрузка Pango/cairo нужна только при генерации
+    html = render_html_layer(template, {}, 'background')
+    background = weasyprint.HTML(string=html).write_pdf(**_weasyprint_options(profile))
+    _overlay_backgrounds[key] = background
+    while len(_overlay_backgrounds) > OVERLAY_CACHE_SIZE:
+        _overlay_backgrounds.popitem(last=False)
+    return background
+
+
+def generate_overlay_pdf(template: 'jinja2.Template', data: Dict, output_path: str, profile: str = None) -> bool:
+    """
+    Генерирует PDF в режиме наложения: на закешированную подложку накладываются только переменные поля.
+
+    Args:
+        template (jinja2.Template): Шаблон с блоками background и fields.
+        data (Dict): Данные для подстановки в шаблон.
+        output_path (str): Путь для сохранения PDF файла.
+        profile (str, optional): Имя профиля оптимизации.
+
+    Returns:
+        bool: True если генерация успешна, False в противном случае.
+    """
+    try:
+        import pypdf  # Импорт здесь: тяжелые PDF библиотеки загружаются только при генерации
+        import weasyprint
+        background = pypdf.PdfReader(io.BytesIO(get_overlay_background(template, profile)))
+        fields_html = render_html_layer(template, data, 'fields')
+        fields_pdf = weasyprint.HTML(string=fields_html).write_pdf(**_weasyprint_options(profile))
+        fields = pypdf.PdfReader(io.BytesIO(fields_pdf))
+        writer = pypdf.PdfWriter()
+        page = writer.add_page(background.pages[0])
+        page.merge_page(fields.pages[0])
+        with open(output_path, 'wb') as f:
+            writer.write(f)
+        return True
+    except Exception as e:
+        print(f"Error generating overlay PDF: {e}")
+        return False
+
+
+# Кандидаты шрифта с кириллицей для нативного движка: (обычный, жирный)
+NATIVE_FONT_PATHS = [
+    ('/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf', '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf'),
+    ('/usr/share/fonts/TTF/DejaVuSans.ttf', '/usr/share/fonts/TTF/DejaVuSans-Bold.ttf'),
+    ('C:/Windows/Fonts/arial.ttf', 'C:/Windows/Fonts/arialbd.ttf'),
+]
+
+# Раскладка, которую шаблон объявляет через {% set pdf_layout = 'simple_invoice' %}
+SIMPLE_INVOICE_LAYOUT = 'simple_invoice'
+
+# Относительная ширина колонок таблицы товаров простого счета
+NATIVE_TABLE_COLUMNS = (7, 45, 14, 17, 17)
+
+# Поля шапки простого счета: (ключ данных, подпись)
+SIMPLE_INVOICE_FIELDS = [
+    ('customer_name', 'Покупатель'),
+    ('company_name', 'Компания'),
+    ('address', 'Адрес'),
+    ('phone', 'Телефон'),
+    ('email', 'Email'),
+]
+
+
+class PDFBackend:
+    """
+    Базовый интерфейс движка рендеринга PDF.
+
+    Движок сообщает, способен ли он отрендерить шаблон, и рендерит данные счета в файл.
+    """
+
+    name = 'base'
+
+    def can_render(self, template: 'jinja2.Template') -> bool:
+        """
+        Проверяет, поддерживает ли движок данный шаблон.
+
+        Args:
+            template (jinja2.Template): Шаблон Jinja2.
+
+        Returns:
+            bool: True если движок может отрендерить шаблон.
+        """
+        raise NotImplementedError
+
+    def render(self, template: 'jinja2.Template', data: Dict, output_path: str, profile: str = None) -> bool:
+        """
+        Рендерит данные счета в PDF файл.
+
+        Args:
+            template (jinja2.Template): Шаблон Jinja2.
+            data (Dict): Данные для подстановки в шаблон.
+            output_path (str): Путь для сохранения PDF файла.
+            profile (str, optional): Имя профиля оптимизации (см. PDF_PROFILES).
+
+        Returns:
+            bool: True если генерация успешна, False в противном случае.
+        """
+        raise NotImplementedError
+
+
+class WeasyPrintBackend(PDFBackend):
+    """Полноценный HTML/CSS движок на базе WeasyPrint, поддерживает любые шаблоны."""
+
+    name = 'weasyprint'
+
+    def can_render(self, template: 'jinja2.Template') -> bool:
+        # Шаблон, объявляющий только раскладку pdf_layout без HTML, дал бы пустой PDF
+        try:
+            return not (getattr(template.module, 'pdf_layout', None) and not str(template.module).strip())
+        except Exception:
+            return True
+
+    def render(self, template: 'jinja2.Template', data: Dict, output_path: str, profile: str = None) -> bool:
+        if is_overlay_template(template):
+            return generate_overlay_pdf(template, data, output_path, profile)
+        if get_chunk_rows(template) and len(data.get('items', [])) >= LARGE_DOCUMENT_ITEMS:
+            return generate_chunked_pdf(template, data, output_path, profile)
+        return generate_pdf(render_html(template, data), output_path, profile)
+
+
+class NativeBackend(PDFBackend):
+    """
+    Легковесный движок, пишущий PDF напрямую через fpdf2 без HTML верстки.
+
+    Поддерживает только раскладку простого счета: шапка, таблица товаров и итог.
+    Шаблон включает ее объявлением {% set pdf_layout = 'simple_invoice' %}. HTML такого
+    шаблона этот движок не использует; он повторяет ту же раскладку для WeasyPrint,
+    который рендерит шаблон без шрифтов для native и при сравнении движков
+    (см. templates/invoice_native.html).
+    """
+
+    name = 'native'
+
+    def __init__(self):
+        self.fonts = next(((regular, bold) for regular, bold in NATIVE_FONT_PATHS
+                           if os.path.exists(regular) and os.path.exists(bold)), None)
+        # Профили, о неприменимых настройках которых движок уже предупредил
+        self._warned_profiles = set()
+
+    def _check_profile(self, profile: str = None) -> None:
+        """Предупреждает (один раз на профиль), что настройки изображений профиля не применяются."""
+        settings = get_pdf_profile(profile)
+        name = profile or DEFAULT_PDF_PROFILE
+        if name in self._warned_profiles:
+            return
+        self._warned_profiles.add(name)
+        if settings['optimize_images'] or settings['jpeg_quality'] or settings['dpi']:
+            print(f"Warning: native backend ignores image settings of PDF profile '{name}' "
+                  f"(the built-in layout has no images); metadata and stream settings are still applied")
+
+    def can_render(self, template: 'jinja2.Template') -> bool:
+        if self.fonts is None:
+            return False
+        try:
+            return getattr(template.module, 'pdf_layout', None) == SIMPLE_INVOICE_LAYOUT
+        except Exception:
+            return False
+
+    def render(self, template: 'jinja2.Template', data: Dict, output_path: str, profile: str = None) -> bool:
+        try:
+            self._check_profile(profile)
+            # Шрифты fpdf2 всегда встраиваются подмножеством, потоки сжимаются по умолчанию
+            import fpdf  # Импорт здесь: тяжелые PDF библиотеки загружаются только при генерации
+            pdf = fpdf.FPDF(format='A4')
+            pdf.set_margins(15, 15, 15)
+            pdf.add_font('Main', '', self.fonts[0])
+            pdf.add_font('Main', 'B', self.fonts[1])
+            pdf.add_page()
+            width = pdf.epw
+
+            # Заголовок
+            pdf.set_font('Main', 'B', 20)
+            pdf.cell(width, 10, f"СЧЁТ № {data.get('invoice_id', '')}", align='C', new_x='LMARGIN', new_y='NEXT')
+            pdf.set_font('Main', '', 11)
+            pdf.cell(width, 7, f"от {data.get('date', '')}", align='C', new_x='LMARGIN', new_y='NEXT')
+            pdf.set_draw_color(76, 175, 80)
+            pdf.set_line_width(0.8)
+            pdf.line(pdf.l_margin, pdf.get_y() + 2, pdf.l_margin + width, pdf.get_y() + 2)
+            pdf.ln(8)
+
+            # Поля покупателя
+            for key, label in SIMPLE_INVOICE_FIELDS:
+                value = data.get(key)
+                if not value:
+                    continue
+                pdf.set_font('Main', 'B', 11)
+                pdf.cell(pdf.get_string_width(f"{label}: ") + 1, 7, f"{label}: ")
+                pdf.set_font('Main', '', 11)
+                pdf.multi_cell(0, 7, str(value), new_x='LMARGIN', new_y='NEXT')
+            pdf.ln(4)
+
+            # Таблица товаров: длинные наименования переносятся, шапка повторяется на каждой странице
+            pdf.set_draw_color(221, 221, 221)
+            pdf.set_line_width(0.2)
+            pdf.set_text_color(51, 51, 51)
+            pdf.set_font('Main', '', 10)
+            headings_style = fpdf.FontFace(emphasis='BOLD', color=(255, 255, 255), fill_color=(76, 175, 80))
+            with pdf.table(col_widths=NATIVE_TABLE_COLUMNS, width=width, text_align='LEFT', line_height=6,
+                           padding=1.5, headings_style=headings_style) as table:
+                table.row(['№', 'Наименование товара', 'Количество', 'Цена', 'Сумма'])
+                for index, item in enumerate(data.get('items', []), start=1):
+                    table.row([str(index), str(item.get('product_name', '')), str(item.get('quantity', '')),
+                               f"{item.get('price', '')} ₽", f"{item.get('total', '')} ₽"])
+
+            # Итог
+            pdf.ln(6)
+            pdf.set_font('Main', 'B', 14)
+            pdf.cell(width, 10, f"ИТОГО: {data.get('grand_total', '')} ₽", align='R')
+            pdf.output(output_path)
+            return True
+        except Exception as e:
+            print(f"Error generating PDF with native backend: {e}")
+            return False
+
+
+# Движки в порядке предпочтения: от самого быстрого к самому универсальному
+BACKENDS: List[PDFBackend] = [NativeBackend(), WeasyPrintBackend()]
+
+
+def get_backend(name: str) -> PDFBackend:
+    """
+    Возвращает движок рендеринга по имени.
+
+    Args:
+        name (str): Имя движка ('native' или 'weasyprint').
+
+    Returns:
+        PDFBackend: Экземпляр движка.
+
+    Raises:
+        ValueError: Если движок с таким именем не зарегистрирован.
+    """
+    for backend in BACKENDS:
+        if backend.name == name:
+            return backend
+    raise ValueError(f"Unknown PDF backend: {name}")
+
+
+def select_backend(template: 'jinja2.Template') -> PDFBackend:
+    """
+    Выбирает самый быстрый движок, способный отрендерить шаблон.
+
+    Args:
+        template (jinja2.Template): Шаблон Jinja2.
+
+    Returns:
+        PDFBackend: Выбранный движок.
+
+    Raises:
+        ValueError: Если ни один движок не может отрендерить шаблон.
+    """
+    for backend in BACKENDS:
+        if backend.can_render(template):
+            return backend
+    raise ValueError(f"No PDF backend can render template {getattr(template, 'name', '')}")
+
+
+def render_pdf(template: 'jinja2.Template', data: Dict, output_path: str, backend: str = None, profile: str = None) -> bool:
+    """
+    Рендерит данные счета в PDF, выбирая движок и режим генерации по типу шаблона.
+
+    Args:
+        template (jinja2.Template): Шаблон Jinja2.
+        data (Dict): Данные для подстановки в шаблон.
+        output_path (str): Путь для сохранения PDF файла.
+        backend (str, optional): Имя движка; по умолчанию выбирается автоматически.
+        profile (str, optional): Имя профиля оптимизации (см. PDF_PROFILES).
+
+    Returns:
+        bool: True если генерация успешна, False в противном случае.
+    """
+    try:
+        engine = get_backend(backend) if backend else select_backend(template)
+    except ValueError as e:
+        print(f"Error generating PDF: {e}")
+        return False
+    if not engine.render(template, data, output_path, profile):
+        return False
+    try:
+        optimize_pdf(output_path, profile)
+    except Exception as e:
+        print(f"Error optimizing PDF: {e}")
+    return True
+
+
+def _pdf_text(path: str) -> str:
+    """Извлекает текст PDF без пробельных символов для сравнения содержимого."""
+    import pypdf  # Импорт здесь: тяжелые PDF библиотеки загружаются только при генерации
+    reader = pypdf.PdfReader(path)
+    text = ''.join(page.extract_text() or '' for page in reader.pages)
+    return ''.join(text.split())
+
+
+# Доля площади меньшего из двух символов, при которой их пересечение считается наложением текста
+OVERLAP_RATIO = 0.3
+
+
+def _pdf_layout(path: str) -> Dict:
+    """
+    Проверяет раскладку PDF по координатам символов.
+
+    Returns:
+        Dict: pages — число страниц, overflow — число символов за пределами страницы
+            или наложенных на другой текст (например, не перенесенная строка ячейки).
+    """
+    import pypdfium2  # Импорт здесь: тяжелые PDF библиотеки загружаются только при генерации
+    pdf = pypdfium2.PdfDocument(path)
+    overflow = 0
+    try:
+        for page in pdf:
+            page_width, page_height = page.get_size()
+            textpage = page.get_textpage()
+            boxes = []
+            for index in range(textpage.count_chars()):
+                left, bottom, right, top = textpage.get_charbox(index)
+                if right - left <= 0 or top - bottom <= 0:
+                    continue
+                if left < 0 or bottom < 0 or right > page_width or top > page_height:
+                    overflow += 1
+                boxes.append((left, right, bottom, top, index))
+            # Соседние символы одной строки могут касаться друг друга (кернинг), поэтому
+            # сравниваются только символы, не идущие подряд в потоке текста
+            boxes.sort()
+            for i, (left, right, bottom, top, index) in enumerate(boxes):
+                for other_left, other_right, other_bottom, other_top, other_index in boxes[i + 1:]:
+                    if other_left >= right:
+                        break
+                    if abs(other_index - index) <= 1:
+                        continue
+                    width = min(right, other_right) - other_left
+                    height = min(top, other_top) - max(bottom, other_bottom)
+                    smaller = min((right - left) * (top - bottom), (other_right - other_left) * (other_top - other_bottom))
+                    if width > 0 and height > 0 and width * height > OVERLAP_RATIO * smaller:
+                        overflow += 1
+            textpage.close()
+            page.close()
+        return {'pages': len(pdf), 'overflow': overflow}
+    finally:
+        pdf.close()
+
+
+def _missing_in_order(text: str, values: List[str]) -> List[str]:
+    """Возвращает значения, не найденные в тексте в заданном порядке (после предыдущего найденного)."""
+    missing = []
+    position = 0
+    for value in values:
+        found = text.find(value, position)
+        if found < 0:
+            missing.append(value)
+        else:
+            position = found + len(value)
+    return missing
+
+
+def compare_backends(template: 'jinja2.Template', data: Dict, output_dir: str = None) -> Dict:
+    """
+    Рендерит счет всеми подходящими движками и сверяет содержимое и раскладку результатов.
+
+    Паритет означает, что в PDF каждого движка присутствуют все значения шапки,
+    товаров и итога, строки товаров идут в исходном порядке, текст не выходит
+    за пределы страницы и не накладывается на другой текст.
+
+    Args:
+        template (jinja2.Template): Шаблон Jinja2.
+        data (Dict): Данные счета.
+        output_dir (str, optional): Директория для файлов сравнения; по умолчанию временная.
+
+    Returns:
+        Dict: Отчет {'parity': bool, 'backends': {имя: {'success', 'seconds', 'size', 'pages',
+            'missing', 'out_of_order', 'overflow'}}}.
+    """
+    expected = [str(data.get(key, '')) for key in ('invoice_id', 'date', 'grand_total')]
+    expected += [str(data.get(key)) for key, _ in SIMPLE_INVOICE_FIELDS if data.get(key)]
+    for item in data.get('items', []):
+        expected += [str(item.get(key, '')) for key in ('product_name', 'quantity', 'price', 'total')]
+    expected = [''.join(value.split()) for value in expected if value]
+    names = [''.join(str(item.get('product_name', '')).split()) for item in data.get('items', [])]
+
+    report = {'parity': True, 'backends': {}}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        target_dir = output_dir or tmp_dir
+        for backend in BACKENDS:
+            if not backend.can_render(template):
+                continue
+            output_path = os.path.join(target_dir, f"{data.get('invoice_id', 'invoice')}_{backend.name}.pdf")
+            started = time.perf_counter()
+            success = backend.render(template, data, output_path)
+            seconds = time.perf_counter() - started
+            result = {'success': success, 'seconds': seconds, 'size': 0, 'pages': 0,
+                      'missing': [], 'out_of_order': [], 'overflow': 0}
+            if success:
+                result['size'] = os.path.getsize(output_path)
+                text = _pdf_text(output_path)
+                result['missing'] = [value for value in expected if value not in text]
+                result['out_of_order'] = [name for name in _missing_in_order(text, [name for name in names if name])
+                                          if name not in result['missing']]
+                result.update(_pdf_layout(output_path))
+            report['backends'][backend.name] = result
+            if not success or result['missing'] or result['out_of_order'] or result['overflow']:
+                report['parity'] = False
+    return report
+
+
+def generate_batch_pdf(invoice_ids: List[str], data, template: 'jinja2.Template', profile: str = None) -> List[str]:
     """
     Генерирует PDF для нескольких счетов и возвращает список путей к файлам.
 
@@ -90,26 +787,85 @@ def generate_batch_pdf(invoice_ids: List[str], data, template: jinja2.Template)
         invoice_ids (List[str]): Список ID счетов для генерации.
         data: Данные (DataFrame или список словарей).
         template (jinja2.Template): Шаблон для рендеринга.
+        profile (str, optional): Имя профиля оптимизации (см. PDF_PROFILES).
 
     Returns:
         List[str]: Список путей к сгенерированным PDF файлам.
     """
-    from data_parser import get_invoice_data  # Импорт здесь для избежания циклических зависимостей
+    from data_parser import iter_invoice_data  # Импорт здесь для избежания циклических зависимостей
 
     output_files = []
-    for invoice_id in invoice_ids:
-        invoice_data = get_invoice_data(data, invoice_id)
+    for invoice_id, invoice_data in iter_invoice_data(data, invoice_ids):
         if not invoice_data:
             continue
-        html = render_html(template, invoice_data)
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{invoice_id}_{timestamp}.pdf"
-        output_path = os.path.join('output', filename)
-        if generate_pdf(html, output_path):
-            output_files.append(output_path)
+        document = store_document(invoice_id, lambda path: render_pdf(template, invoice_data, path, profile=profile))
+        if document:
+            output_files.append(document[1])
     return output_files
 
 
+def plan_incremental_batch(invoice_ids: List[str], data, previous: Dict[str, Dict], template_hash: str = None,
+                           profile: str = None) -> Tuple[List[str], Dict[str, str], Dict[str, str]]:
+    """
+    Определяет, какие счета изменились с прошлой генерации и требуют повторного рендеринга.
+
+    Счет переиспользуется, если его хеш содержимого, версия шаблона и профиль PDF
+    совпадают с сохраненными в истории и ранее сгенерированный PDF все еще существует.
+    Записи истории без версии шаблона или профиля (созданные до их учета) не переиспользуются.
+
+    Args:
+        invoice_ids (List[str]): Список ID счетов для генерации.
+        data: Данные (DataFrame или список словарей).
+        previous (Dict[str, Dict]): Результат database.get_latest_content_hashes.
+        template_hash (str, optional): Версия текущего шаблона (source_hash из load_template).
+        profile (str, optional): Имя профиля оптимизации (см. PDF_PROFILES).
+
+    Returns:
+        Tuple[List[str], Dict[str, str], Dict[str, str]]: Кортеж (ID для рендеринга,
+            {ID: путь к переиспользуемому PDF}, {ID: хеш содержимого}).
+    """
+    from data_parser import iter_invoice_data, compute_invoice_hash
+
+    profile = profile or DEFAULT_PDF_PROFILE
+    to_render = []
+    reused = {}
+    hashes = {}
+    for invoice_id, invoice_data in iter_invoice_data(data, invoice_ids):
+        if not invoice_data:
+            continue
+        content_hash = compute_invoice_hash(invoice_data)
+        hashes[invoice_id] = content_hash
+        prev = previous.get(invoice_id)
+        if (prev and template_hash and prev['content_hash'] == content_hash and prev.get('template_hash') == template_hash
+                and prev.get('profile') == profile and prev['output_file'] and os.path.exists(prev['output_file'])):
+            reused[invoice_id] = prev['output_file']
+        else:
+            to_render.append(invoice_id)
+    return to_render, reused, hashes
+
+
+def summarize_outputs(pdf_files: List[str], seconds: float) -> Dict:
+    """
+    Формирует отчет о размере и времени генерации пакета PDF.
+
+    Args:
+        pdf_files (List[str]): Список путей к PDF файлам.
+        seconds (float): Затраченное время в секундах.
+
+    Returns:
+        Dict: Отчет (count, total_bytes, avg_bytes, seconds, docs_per_second).
+    """
+    sizes = [os.path.getsize(path) for path in pdf_files if os.path.exists(path)]
+    total = sum(sizes)
+    return {
+        'count': len(sizes),
+        'total_bytes': total,
+        'avg_bytes': total / len(sizes) if sizes else 0,
+        'seconds': seconds,
+        'docs_per_second': len(sizes) / seconds if seconds > 0 else 0,
+    }
+
+
 def create_zip_archive(pdf_files: List[str], output_path: str) -> str:
     """
     Создает ZIP архив из списка PDF файлов.
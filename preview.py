@@ -0,0 +1,235 @@
+"""
+Модуль быстрого предпросмотра шаблонов для редактора.
+
+Рендерит шаблон с примером счета, растеризует только первую страницу в PNG
+с низким разрешением, откладывает рендеринг до паузы в редактировании,
+отбрасывает устаревшие запросы и кеширует результаты по хешу шаблона.
+"""
+
+from typing import Dict, Optional
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+
+from pdf_generator import render_html, template_from_source, select_backend
+
+
+# Разрешение растеризации предпросмотра (DPI)
+PREVIEW_DPI = 48
+
+# Пауза после последнего изменения перед запуском рендеринга, в секундах
+PREVIEW_DEBOUNCE = 0.3
+
+# Максимальное число закешированных предпросмотров
+PREVIEW_CACHE_SIZE = 64
+
+# Пример счета для предпросмотра шаблонов
+SAMPLE_INVOICE = {
+    'invoice_id': 'INV-2025-001',
+    'customer_name': 'Иванов Петр Сергеевич',
+    'date': '15.01.2025',
+    'company_name': 'ООО "ТехноСервис"',
+    'address': 'г. Москва ул. Ленина д.10',
+    'phone': '+7-495-123-45-67',
+    'email': 'info@techservice.ru',
+    'items': [
+        {'product_name': 'Ноутбук Lenovo ThinkPad', 'quantity': 2, 'price': 85000, 'total': 170000},
+        {'product_name': 'Мышь Logitech MX Master', 'quantity': 2, 'price': 7500, 'total': 15000},
+        {'product_name': 'Клавиатура Keychron K8', 'quantity': 1, 'price': 12000, 'total': 12000},
+    ],
+    'grand_total': 197000,
+}
+
+_preview_cache: "OrderedDict[str, bytes]" = OrderedDict()
+_preview_cache_lock = threading.Lock()
+
+
+def preview_key(template_source: str, data: Dict, dpi: int) -> str:
+    """
+    Вычисляет ключ кеша предпросмотра по содержимому шаблона, данным и разрешению.
+
+    Args:
+        template_source (str): Исходный код HTML шаблона.
+        data (Dict): Данные для подстановки.
+        dpi (int): Разрешение растеризации.
+
+    Returns:
+        str: SHA-256 хеш.
+    """
+    payload = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)
+    digest = hashlib.sha256()
+    digest.update(template_source.encode('utf-8'))
+    digest.update(payload.encode('utf-8'))
+    digest.update(str(dpi).encode('ascii'))
+    return digest.hexdigest()
+
+
+def get_cached_preview(key: str) -> Optional[bytes]:
+    """
+    Возвращает закешированный PNG предпросмотра.
+
+    Args:
+        key (str): Ключ кеша (см. preview_key).
+
+    Returns:
+        Optional[bytes]: PNG или None, если предпросмотр не закеширован.
+    """
+    with _preview_cache_lock:
+        png = _preview_cache.get(key)
+        if png is not None:
+            _preview_cache.move_to_end(key)
+        return png
+
+
+def render_preview_png(template_source: str, data: Dict = None, dpi: int = PREVIEW_DPI) -> bytes:
+    """
+    Рендерит первую страницу шаблона в PNG с низким разрешением.
+
+    Движок выбирается так же, как при генерации (select_backend). Для WeasyPrint
+    верстается весь документ, но в PDF пишется и растеризуется только первая страница.
+
+    Args:
+        template_source (str): Исходный код HTML шаблона.
+        data (Dict, optional): Данные счета; по умолчанию SAMPLE_INVOICE.
+        dpi (int): Разрешение растеризации.
+
+    Returns:
+        bytes: PNG изображение первой страницы.
+    """
+    data = SAMPLE_INVOICE if data is None else data
+    key = preview_key(template_source, data, dpi)
+    png = get_cached_preview(key)
+    if png is not None:
+        return png
+
+    # Импорт здесь: WeasyPrint и PDFium загружаются только при первом предпросмотре
+    import pypdfium2
+
+    template = template_from_source('preview', template_source)
+    backend = select_backend(template)
+    if backend.name == 'weasyprint':
+        import weasyprint
+        document = weasyprint.HTML(string=render_html(template, data)).render()
+        pdf_bytes = document.copy(document.pages[:1]).write_pdf()
+    else:
+        # Предпросмотр рендерится тем же движком, что и итоговый PDF (см. render_pdf)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_path = os.path.join(tmp_dir, 'preview.pdf')
+            if not backend.render(template, data, output_path):
+                raise RuntimeError(f"Preview rendering with {backend.name} backend failed")
+            with open(output_path, 'rb') as f:
+                pdf_bytes = f.read()
+    pdf = pypdfium2.PdfDocument(pdf_bytes)
+    try:
+        image = pdf[0].render(scale=dpi / 72).to_pil()
+    finally:
+        pdf.close()
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', optimize=False)
+    png = buffer.getvalue()
+
+    with _preview_cache_lock:
+        _preview_cache[key] = png
+        while len(_preview_cache) > PREVIEW_CACHE_SIZE:
+            _preview_cache.popitem(last=False)
+    return png
+
+
+class PreviewRenderer:
+    """
+    Фоновый рендерер предпросмотра с отложенным запуском и отменой устаревших запросов.
+
+    Каждый вызов submit увеличивает номер поколения. Запрос ждет PREVIEW_DEBOUNCE
+    секунд и рендерится, только если за это время не появилось более нового;
+    результаты устаревших поколений отбрасываются.
+    """
+
+    def __init__(self, data: Dict = None, dpi: int = PREVIEW_DPI, debounce: float = PREVIEW_DEBOUNCE):
+        self.data = data
+        self.dpi = dpi
+        self.debounce = debounce
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='preview')
+        self._condition = threading.Condition()
+        self._generation = 0
+        self._result = None
+
+    def submit(self, template_source: str) -> int:
+        """
+        Запрашивает предпросмотр новой версии шаблона.
+
+        Args:
+            template_source (str): Исходный код HTML шаблона.
+
+        Returns:
+            int: Номер поколения запроса для wait.
+        """
+        with self._condition:
+            self._generation += 1
+            generation = self._generation
+        cached = get_cached_preview(preview_key(template_source, SAMPLE_INVOICE if self.data is None else self.data, self.dpi))
+        if cached is not None:
+            self._publish(generation, {'png': cached, 'error': None})
+        else:
+            self._executor.submit(self._run, generation, template_source)
+        return generation
+
+    def wait(self, generation: int, timeout: float = 1.0) -> Optional[Dict]:
+        """
+        Ожидает результат предпросмотра указанного поколения.
+
+        Args:
+            generation (int): Номер поколения, возвращенный submit.
+            timeout (float): Максимальное время ожидания в секундах.
+
+        Returns:
+            Optional[Dict]: {'png': bytes или None, 'error': str или None, 'stale': bool}.
+                Если запрос не успел выполниться, возвращается последний готовый результат
+                с 'stale': True (он относится к предыдущей версии шаблона); None, если
+                готовых результатов еще нет.
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self._result is None or self._result[0] < generation:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            if self._result is None:
+                return None
+            return dict(self._result[1], stale=self._result[0] < generation)
+
+    def close(self) -> None:
+        """
+        Останавливает фоновый поток рендеринга; запросы, ожидающие в очереди, отменяются.
+        """
+        with self._condition:
+            # Новое поколение делает устаревшим и текущий запрос
+            self._generation += 1
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _is_stale(self, generation: int) -> bool:
+        with self._condition:
+            return generation != self._generation
+
+    def _publish(self, generation: int, result: Dict) -> None:
+        with self._condition:
+            if self._result is None or generation >= self._result[0]:
+                self._result = (generation, result)
+            self._condition.notify_all()
+
+    def _run(self, generation: int, template_source: str) -> None:
+        time.sleep(self.debounce)
+        if self._is_stale(generation):
+            return
+        try:
+            result = {'png': render_preview_png(template_source, self.data, self.dpi), 'error': None}
+        except Exception as e:
+            result = {'png': None, 'error': str(e)}
+        if not self._is_stale(generation):
+            self._publish(generation, result)
@@ -0,0 +1,282 @@
+"""
+Модуль распределенного пакетного рендеринга.
+
+Координатор разбивает пакет счетов на шарды и ставит их в очередь SQLite
+(отдельная база render_queue.db); воркеры захватывают шарды с арендой, продлевают
+ее heartbeat-ом и пишут результаты в общую историю и хранилище документов. Шарды
+умерших воркеров возвращаются в работу после истечения аренды; счета, результат
+которых уже записан, при повторной попытке пропускаются.
+
+Очередь и история используют журнал отката SQLite (не WAL), поэтому воркеры могут
+работать на нескольких машинах, запущенные из общей директории проекта на сетевом
+диске с рабочими блокировками файлов. Аренда считается по часам машин воркеров,
+поэтому часы должны быть синхронизированы (NTP).
+
+Использование:
+    python render_farm.py submit --data invoices.csv --template invoice_template.html
+    python render_farm.py worker
+    python render_farm.py local --data invoices.csv --template invoice_template.html --workers 4
+"""
+
+from typing import Dict, List, Optional
+import argparse
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import uuid
+
+from data_parser import parse_data_file, get_invoice_ids, iter_invoice_data, get_json_record
+from database import (init_database, init_render_queue, add_generation_record, create_render_job, claim_render_shard,
+                      renew_shard_lease, finish_render_shard, get_render_job_status, count_active_shards,
+                      mark_shard_invoice_done, get_shard_done_invoices)
+from output_store import store_document
+from compact import compact_dataset
+from snapshots import save_snapshot
+from pdf_generator import load_template, render_pdf, DEFAULT_PDF_PROFILE
+
+
+# Число счетов в одном шарде по умолчанию
+DEFAULT_SHARD_SIZE = 50
+
+# Длительность аренды шарда; heartbeat продлевает ее каждую треть срока, в секундах
+LEASE_SECONDS = 60
+
+# Максимальное число попыток обработки шарда
+MAX_ATTEMPTS = 3
+
+# Пауза между опросами пустой очереди, в секундах
+POLL_INTERVAL = 1.0
+
+
+def submit_job(data_file: str, template_name: str, invoice_ids: List[str] = None,
+               shard_size: int = DEFAULT_SHARD_SIZE, profile: str = None) -> str:
+    """
+    Создает задание рендеринга и ставит его шарды в очередь (роль координатора).
+
+    Args:
+        data_file (str): Имя файла данных в /data.
+        template_name (str): Имя шаблона.
+        invoice_ids (List[str], optional): ID счетов; по умолчанию все счета файла.
+        shard_size (int): Число счетов в шарде.
+        profile (str, optional): Профиль оптимизации PDF.
+
+    Returns:
+        str: ID задания.
+    """
+    if invoice_ids is None:
+        invoice_ids = get_invoice_ids(parse_data_file(os.path.join('data', data_file)))
+    shards = [invoice_ids[i:i + shard_size] for i in range(0, len(invoice_ids), shard_size)]
+    job_id = uuid.uuid4().hex
+    create_render_job(job_id, data_file, template_name, shards, profile)
+    return job_id
+
+
+class LeaseHeartbeat(threading.Thread):
+    """
+    Фоновый поток, продлевающий аренду шарда, пока воркер его обрабатывает.
+    """
+
+    def __init__(self, shard_id: int, worker_id: str, lease_seconds: float = LEASE_SECONDS):
+        super().__init__(daemon=True)
+        self.shard_id = shard_id
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.lost = threading.Event()
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.lease_seconds / 3):
+            if not renew_shard_lease(self.shard_id, self.worker_id, self.lease_seconds):
+                self.lost.set()
+                return
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+
+class ShardRenderer:
+    """
+    Рендерит шарды воркера, кешируя шаблоны и разобранные файлы данных между шардами.
+
+    Для JSON файлов записи читаются по индексу смещений, без загрузки всего файла;
+    остальные форматы разбираются один раз на версию файла, а данные шарда
+    собираются за один проход (iter_invoice_data).
+    """
+
+    def __init__(self):
+        self._templates = {}
+        self._data = {}
+
+    def _get_template(self, template_name: str):
+        if template_name not in self._templates:
+            self._templates[template_name] = load_template(template_name)
+        return self._templates[template_name]
+
+    def _iter_invoices(self, data_file: str, invoice_ids: List[str]):
+        filepath = os.path.join('data', data_file)
+        if filepath.endswith('.json'):
+            return ((invoice_id, get_json_record(filepath, invoice_id)) for invoice_id in invoice_ids)
+        key = (data_file, os.path.getmtime(filepath))
+        if key not in self._data:
+            self._data = {key: compact_dataset(parse_data_file(filepath))}
+        return iter_invoice_data(self._data[key], invoice_ids)
+
+    def render_shard(self, shard: Dict, heartbeat: LeaseHeartbeat) -> int:
+        """
+        Рендерит счета шарда и записывает результаты в историю.
+
+        Счета, результат которых записан предыдущей попыткой шарда, пропускаются.
+
+        Args:
+            shard (Dict): Шард из claim_render_shard.
+            heartbeat (LeaseHeartbeat): Heartbeat аренды; при потере аренды обработка прекращается.
+
+        Returns:
+            int: Число успешно сгенерированных PDF.
+        """
+        template = self._get_template(shard['template_name'])
+        rendered = 0
+        done = get_shard_done_invoices(shard['shard_id']) if shard['attempts'] > 1 else set()
+        invoice_ids = [invoice_id for invoice_id in shard['invoice_ids'] if invoice_id not in done]
+        for invoice_id, invoice_data in self._iter_invoices(shard['data_file'], invoice_ids):
+            if heartbeat.lost.is_set():
+                break
+            if not invoice_data:
+                add_generation_record(invoice_id, '', shard['data_file'], shard['template_name'], '', 'error', 'Invoice not found')
+                mark_shard_invoice_done(shard['shard_id'], invoice_id)
+                continue
+            document = store_document(invoice_id, lambda path: render_pdf(template, invoice_data, path, profile=shard['profile']))
+            if document:
+                document_id, output_path = document
+                content_hash, template_hash = save_snapshot(invoice_data, template)
+                add_generation_record(invoice_id, invoice_data.get('customer_name', ''), shard['data_file'], shard['template_name'],
+                                      output_path, 'success', content_hash=content_hash, document_id=document_id,
+                                      template_hash=template_hash, profile=shard['profile'] or DEFAULT_PDF_PROFILE)
+                rendered += 1
+            else:
+                add_generation_record(invoice_id, invoice_data.get('customer_name', ''), shard['data_file'], shard['template_name'],
+                                      '', 'error', 'Generation failed')
+            mark_shard_invoice_done(shard['shard_id'], invoice_id)
+        return rendered
+
+
+def run_worker(worker_id: str = None, exit_when_idle: bool = False) -> None:
+    """
+    Запускает цикл воркера: захват шарда, рендеринг, завершение.
+
+    Args:
+        worker_id (str, optional): ID воркера; по умолчанию имя хоста и PID.
+        exit_when_idle (bool): Завершиться, когда в очереди не останется ни свободных, ни арендованных
+            шардов (аренда умершего воркера может истечь позже, и его шард нужно будет обработать).
+    """
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    init_database()
+    init_render_queue()
+    renderer = ShardRenderer()
+    while True:
+        shard = claim_render_shard(worker_id, LEASE_SECONDS, MAX_ATTEMPTS)
+        if not shard:
+            if exit_when_idle and not count_active_shards():
+                return
+            time.sleep(POLL_INTERVAL)
+            continue
+        heartbeat = LeaseHeartbeat(shard['shard_id'], worker_id)
+        heartbeat.start()
+        try:
+            renderer.render_shard(shard, heartbeat)
+            status, error = ('pending', 'Lease lost') if heartbeat.lost.is_set() else ('done', None)
+        except Exception as e:
+            status = 'failed' if shard['attempts'] >= MAX_ATTEMPTS else 'pending'
+            error = str(e)
+        finally:
+            heartbeat.stop()
+        if not heartbeat.lost.is_set():
+            finish_render_shard(shard['shard_id'], worker_id, status, error)
+
+
+def wait_for_job(job_id: str, poll_interval: float = POLL_INTERVAL,
+                 processes: List[multiprocessing.Process] = None) -> Dict:
+    """
+    Ожидает завершения всех шардов задания.
+
+    Args:
+        job_id (str): ID задания.
+        poll_interval (float): Интервал опроса в секундах.
+        processes (List[multiprocessing.Process], optional): Локальные процессы-воркеры; если все
+            они завершились, ожидание прекращается, даже если остались необработанные шарды.
+
+    Returns:
+        Dict: Итоговое количество шардов по статусам.
+    """
+    while True:
+        status = get_render_job_status(job_id)
+        if not status.get('pending') and not status.get('leased'):
+            return status
+        if processes and not any(process.is_alive() for process in processes):
+            print(f"All workers exited, job {job_id} is unfinished: {status}")
+            return get_render_job_status(job_id)
+        time.sleep(poll_interval)
+
+
+def run_local(data_file: str, template_name: str, workers: int, shard_size: int = DEFAULT_SHARD_SIZE,
+              profile: str = None) -> Dict:
+    """
+    Запускает координатор и несколько локальных процессов-воркеров (для тестирования фермы).
+
+    В рабочем режиме задание ставится командой submit, а воркеры запускаются на машинах фермы.
+
+    Args:
+        data_file (str): Имя файла данных в /data.
+        template_name (str): Имя шаблона.
+        workers (int): Число процессов-воркеров.
+        shard_size (int): Число счетов в шарде.
+        profile (str, optional): Профиль оптимизации PDF.
+
+    Returns:
+        Dict: Итоговое количество шардов по статусам.
+    """
+    init_database()
+    init_render_queue()
+    job_id = submit_job(data_file, template_name, shard_size=shard_size, profile=profile)
+    processes = [multiprocessing.Process(target=run_worker, kwargs={'exit_when_idle': True}) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    status = wait_for_job(job_id, processes=processes)
+    for process in processes:
+        process.join()
+    return status
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Распределенный пакетный рендеринг PDF")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    submit = subparsers.add_parser('submit', help="Поставить задание в очередь")
+    local = subparsers.add_parser('local', help="Запустить задание на локальных процессах")
+    for sub in (submit, local):
+        sub.add_argument('--data', required=True, help="Имя файла данных в /data")
+        sub.add_argument('--template', required=True, help="Имя шаблона")
+        sub.add_argument('--shard-size', type=int, default=DEFAULT_SHARD_SIZE, help="Число счетов в шарде")
+        sub.add_argument('--profile', default=None, help="Профиль оптимизации PDF")
+    local.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Число процессов-воркеров")
+
+    worker = subparsers.add_parser('worker', help="Запустить воркер")
+    worker.add_argument('--id', default=None, help="ID воркера")
+    worker.add_argument('--exit-when-idle', action='store_true', help="Завершиться, когда очередь опустеет")
+
+    args = parser.parse_args(argv)
+    if args.command == 'submit':
+        init_database()
+        init_render_queue()
+        print(submit_job(args.data, args.template, shard_size=args.shard_size, profile=args.profile))
+    elif args.command == 'worker':
+        run_worker(args.id, args.exit_when_idle)
+    else:
+        print(run_local(args.data, args.template, args.workers, args.shard_size, args.profile))
+
+
+if __name__ == '__main__':
+    main()
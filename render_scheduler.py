@@ -0,0 +1,283 @@
+"""
+Модуль общего для процесса планировщика рендеринга PDF.
+
+Все сессии Streamlit живут в одном процессе, поэтому планировщик один на процесс:
+он ограничивает число одновременных рендеров, оценивает стоимость документа
+(память по движку шаблона и числу товаров), допускает работу только при наличии
+свободной памяти и обслуживает очереди пользователей по кругу, чтобы большой
+пакет одного пользователя не блокировал остальных.
+
+Рендеринг выполняется в отдельных процессах-воркерах (по одному на слот);
+воркер перезапускается после MAX_DOCS_PER_WORKER документов или при превышении
+MAX_WORKER_RSS_MB, что сдерживает рост памяти WeasyPrint.
+"""
+
+from typing import Dict, Optional, TYPE_CHECKING
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import threading
+
+if TYPE_CHECKING:
+    import jinja2  # Только для аннотаций: Jinja2 загружается при первой компиляции шаблона
+
+from pdf_generator import template_from_source, render_pdf, select_backend, is_overlay_template
+
+
+# Максимальное число одновременных рендеров в процессе
+MAX_CONCURRENT_RENDERS = max(1, (os.cpu_count() or 2) - 1)
+
+# Оценка памяти рендера, МБ: {режим: (база, на один товар)}
+RENDER_COST_MB = {
+    'weasyprint': (80.0, 0.2),
+    'overlay': (40.0, 0.2),
+    'native': (15.0, 0.01),
+}
+
+# Память, которая должна остаться свободной после допуска рендера, МБ
+MEMORY_RESERVE_MB = 256
+
+# Перезапуск воркера после этого числа документов
+MAX_DOCS_PER_WORKER = 200
+
+# Перезапуск воркера, если его резидентная память превысила порог, МБ
+MAX_WORKER_RSS_MB = 1024
+
+# Интервал повторной проверки памяти для ожидающих рендеров, в секундах
+ADMISSION_POLL_INTERVAL = 0.5
+
+
+def estimate_render_cost(template: 'jinja2.Template', data: Dict) -> float:
+    """
+    Оценивает пиковую память рендера документа.
+
+    Args:
+        template (jinja2.Template): Шаблон Jinja2.
+        data (Dict): Данные счета.
+
+    Returns:
+        float: Оценка памяти в МБ.
+    """
+    mode = 'overlay' if is_overlay_template(template) else select_backend(template).name
+    base, per_item = RENDER_COST_MB.get(mode, RENDER_COST_MB['weasyprint'])
+    return base + per_item * len(data.get('items') or [])
+
+
+def get_available_memory_mb() -> Optional[float]:
+    """
+    Возвращает доступную память системы по /proc/meminfo.
+
+    Returns:
+        Optional[float]: MemAvailable в МБ или None, если значение недоступно (не Linux).
+    """
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _current_rss_mb() -> float:
+    """Возвращает резидентную память текущего процесса в МБ."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError, AttributeError):
+        import resource  # Импорт здесь: модуль есть только на Unix
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# Кеш скомпилированных шаблонов процесса-воркера: {(имя, исходный код): шаблон}
+_worker_templates: Dict[tuple, 'jinja2.Template'] = {}
+
+
+def _render_in_worker(template_name: str, source: str, data: Dict, output_path: str, profile: str = None) -> tuple:
+    """
+    Рендерит PDF в процессе-воркере.
+
+    Шаблон передается исходным кодом, поэтому воркер рендерит ровно ту версию,
+    что и вызывающий (в том числе сохраненную версию при пересоздании).
+
+    Returns:
+        tuple: (успех, резидентная память воркера в МБ после рендера).
+    """
+    key = (template_name, source)
+    if key not in _worker_templates:
+        _worker_templates[key] = template_from_source(template_name, source)
+    ok = render_pdf(_worker_templates[key], data, output_path, profile=profile)
+    return ok, _current_rss_mb()
+
+
+class _WorkerSlot:
+    """
+    Слот планировщика: отдельный процесс-воркер и счетчик обработанных им документов.
+    """
+
+    def __init__(self, context):
+        self._context = context
+        self.executor = None
+        self.documents = 0
+
+    def submit(self, *args):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=1, mp_context=self._context)
+            self.documents = 0
+        return self.executor.submit(_render_in_worker, *args)
+
+    def recycle(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+
+class RenderScheduler:
+    """
+    Планировщик рендеринга с ограничением параллелизма, допуском по памяти
+    и справедливой (круговой) очередью пользователей.
+    """
+
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT_RENDERS, memory_reserve_mb: float = MEMORY_RESERVE_MB,
+                 max_docs_per_worker: int = MAX_DOCS_PER_WORKER, max_worker_rss_mb: float = MAX_WORKER_RSS_MB):
+        self.max_concurrent = max_concurrent
+        self.memory_reserve_mb = memory_reserve_mb
+        self.max_docs_per_worker = max_docs_per_worker
+        self.max_worker_rss_mb = max_worker_rss_mb
+        self._condition = threading.Condition()
+        # Очереди ожидающих рендеров по пользователям; порядок ключей задает очередь обслуживания
+        self._queues: OrderedDict = OrderedDict()
+        self._admitted = set()
+        self._running_cost = 0.0
+        # spawn: дочерние процессы не наследуют потоки и блокировки сервера Streamlit
+        context = multiprocessing.get_context('spawn')
+        self._idle_slots = [_WorkerSlot(context) for _ in range(max_concurrent)]
+
+    def _can_admit(self, cost: float) -> bool:
+        if not self._idle_slots:
+            return False
+        if not self._admitted:
+            # Единственный рендер допускается всегда, иначе крупный документ никогда не начнется
+            return True
+        available = get_available_memory_mb()
+        if available is None:
+            return True
+        # Оценки уже допущенных рендеров вычитаются целиком: их память могла еще не выделиться
+        return available - self._running_cost >= cost + self.memory_reserve_mb
+
+    def _admit_next(self) -> None:
+        """Допускает рендеры по кругу пользователей, пока хватает слотов и памяти."""
+        while self._queues:
+            owner, queue = next(iter(self._queues.items()))
+            ticket = queue[0]
+            if not self._can_admit(ticket['cost']):
+                return
+            queue.popleft()
+            # Пользователь переходит в конец круга, даже если у него остались рендеры
+            self._queues.move_to_end(owner)
+            if not queue:
+                del self._queues[owner]
+            ticket['slot'] = self._idle_slots.pop()
+            self._admitted.add(id(ticket))
+            self._running_cost += ticket['cost']
+            self._condition.notify_all()
+
+    def _acquire(self, owner: str, cost: float) -> Dict:
+        ticket = {'cost': cost, 'slot': None}
+        with self._condition:
+            self._queues.setdefault(owner, deque()).append(ticket)
+            self._admit_next()
+            while ticket['slot'] is None:
+                self._condition.wait(ADMISSION_POLL_INTERVAL)
+                self._admit_next()
+        return ticket
+
+    def _release(self, ticket: Dict, worker_rss_mb: Optional[float]) -> None:
+        slot = ticket['slot']
+        slot.documents += 1
+        if worker_rss_mb is None or slot.documents >= self.max_docs_per_worker or worker_rss_mb >= self.max_worker_rss_mb:
+            slot.recycle()
+        with self._condition:
+            self._admitted.discard(id(ticket))
+            self._running_cost -= ticket['cost']
+            self._idle_slots.append(slot)
+            self._admit_next()
+
+    def render(self, template: 'jinja2.Template', data: Dict, output_path: str, profile: str = None,
+               owner: str = 'default') -> bool:
+        """
+        Рендерит PDF через планировщик, ожидая допуска в очереди пользователя.
+
+        Args:
+            template (jinja2.Template): Шаблон из load_template или template_from_source.
+            data (Dict): Данные счета.
+            output_path (str): Путь для сохранения PDF файла.
+            profile (str, optional): Имя профиля оптимизации (см. PDF_PROFILES).
+            owner (str): Пользователь или сессия, в чью очередь ставится рендер.
+
+        Returns:
+            bool: True если генерация успешна, False в противном случае.
+        """
+        ticket = self._acquire(owner, estimate_render_cost(template, data))
+        worker_rss_mb = None
+        try:
+            ok, worker_rss_mb = ticket['slot'].submit(template.name, template.source, data, output_path, profile).result()
+            return ok
+        except Exception as e:
+            # Воркер мог быть убит (например, OOM); слот будет перезапущен
+            print(f"Error rendering PDF in worker: {e}")
+            return False
+        finally:
+            self._release(ticket, worker_rss_mb)
+
+    def status(self) -> Dict:
+        """
+        Возвращает текущее состояние планировщика.
+
+        Returns:
+            Dict: running, queued, running_cost_mb.
+        """
+        with self._condition:
+            return {
+                'running': len(self._admitted),
+                'queued': sum(len(queue) for queue in self._queues.values()),
+                'running_cost_mb': self._running_cost,
+            }
+
+
+_scheduler: Optional[RenderScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> RenderScheduler:
+    """
+    Возвращает планировщик процесса, создавая его при первом обращении.
+
+    Returns:
+        RenderScheduler: Общий планировщик.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RenderScheduler()
+        return _scheduler
+
+
+def scheduled_render(template: 'jinja2.Template', data: Dict, output_path: str, profile: str = None,
+                     owner: str = 'default') -> bool:
+    """
+    Рендерит PDF через общий планировщик процесса (см. RenderScheduler.render).
+
+    Args:
+        template (jinja2.Template): Шаблон из load_template или template_from_source.
+        data (Dict): Данные счета.
+        output_path (str): Путь для сохранения PDF файла.
+        profile (str, optional): Имя профиля оптимизации.
+        owner (str): Пользователь или сессия.
+
+    Returns:
+        bool: True если генерация успешна, False в противном случае.
+    """
+    return get_scheduler().render(template, data, output_path, profile, owner)
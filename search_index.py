@@ -0,0 +1,231 @@
+"""
+Модуль поискового индекса счетов.
+
+Индекс строится один раз на набор данных по ID счета, имени покупателя и
+компании: триграммный инвертированный индекс для поиска по подстроке и
+отсортированные ключи для поиска по префиксу, диапазонов и шаблонов ID
+(например, INV-2025-1*). Результаты возвращаются постранично, поэтому
+интерфейс не получает десятки тысяч вариантов выбора.
+"""
+
+from typing import Dict, Iterable, List, Tuple
+from array import array
+from bisect import bisect_left, bisect_right
+from fnmatch import fnmatchcase
+
+import pandas as pd
+
+from compact import CompactOrders
+
+
+# Длина n-грамм инвертированного индекса
+NGRAM_SIZE = 3
+
+# Размер страницы результатов поиска по умолчанию
+SEARCH_PAGE_SIZE = 50
+
+# Разделитель диапазона ID в выражении выбора: INV-001..INV-100
+RANGE_SEPARATOR = '..'
+
+# Символы шаблона ID в выражении выбора
+GLOB_CHARS = '*?['
+
+
+def _ngrams(text: str) -> set:
+    """Возвращает множество n-грамм строки."""
+    return {text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)}
+
+
+def _text(value) -> str:
+    """Приводит значение поля к строке; пустые значения и NaN дают пустую строку."""
+    if value is None or (isinstance(value, float) and value != value):
+        return ''
+    return str(value)
+
+
+class InvoiceSearchIndex:
+    """
+    Поисковый индекс по ID счета, имени покупателя и компании.
+    """
+
+    def __init__(self, records: Iterable[Tuple[str, str, str]]):
+        """
+        Строит индекс.
+
+        Args:
+            records (Iterable[Tuple[str, str, str]]): (ID счета, покупатель, компания) в порядке данных;
+                повторные ID пропускаются, как и в get_invoice_data.
+        """
+        self.ids: List[str] = []
+        self._texts: List[str] = []
+        self._postings: Dict[str, array] = {}
+        prefix_keys = []
+        seen = set()
+        for invoice_id, customer_name, company_name in records:
+            if invoice_id in seen:
+                continue
+            seen.add(invoice_id)
+            position = len(self.ids)
+            self.ids.append(invoice_id)
+            fields = [invoice_id.lower(), customer_name.lower(), company_name.lower()]
+            # Поля разделяются символом, которого нет в запросах, чтобы n-граммы не пересекали границы
+            text = '\x00'.join(fields)
+            self._texts.append(text)
+            for gram in _ngrams(text):
+                posting = self._postings.get(gram)
+                if posting is None:
+                    posting = self._postings[gram] = array('i')
+                posting.append(position)
+            prefix_keys.extend((field, position) for field in fields if field)
+        prefix_keys.sort()
+        self._prefix_keys = [key for key, _ in prefix_keys]
+        self._prefix_positions = array('i', (position for _, position in prefix_keys))
+        order = sorted(range(len(self.ids)), key=self.ids.__getitem__)
+        self._sorted_ids = [self.ids[position] for position in order]
+        self._sorted_positions = array('i', order)
+
+    @classmethod
+    def from_data(cls, data) -> 'InvoiceSearchIndex':
+        """
+        Строит индекс по разобранным данным.
+
+        Args:
+            data: DataFrame, CompactOrders или список словарей.
+
+        Returns:
+            InvoiceSearchIndex: Индекс.
+        """
+        if isinstance(data, pd.DataFrame):
+            if 'invoice_id' not in data.columns:
+                return cls([])
+            columns = [data[col] if col in data.columns else [None] * len(data)
+                       for col in ('customer_name', 'company_name')]
+            return cls((str(invoice_id), _text(customer), _text(company))
+                       for invoice_id, customer, company in zip(data['invoice_id'], *columns))
+        if isinstance(data, CompactOrders):
+            return cls((str(invoice_id), _text(customer), _text(company))
+                       for invoice_id, customer, company in zip(data.header_column('invoice_id'),
+                                                                data.header_column('customer_name'),
+                                                                data.header_column('company_name'))
+                       if invoice_id is not None)
+        if isinstance(data, list):
+            return cls((str(record['invoice_id']), _text(record.get('customer_name')), _text(record.get('company_name')))
+                       for record in data if isinstance(record, dict) and 'invoice_id' in record)
+        return cls([])
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _match_positions(self, query: str) -> List[int]:
+        """Возвращает позиции счетов, подходящих под запрос, в порядке данных."""
+        if len(query) < NGRAM_SIZE:
+            # Короткий запрос: совпадение по началу ID, имени покупателя или компании
+            start = bisect_left(self._prefix_keys, query)
+            end = bisect_right(self._prefix_keys, query + '\uffff', lo=start)
+            return sorted(set(self._prefix_positions[start:end]))
+        postings = []
+        for gram in _ngrams(query):
+            posting = self._postings.get(gram)
+            if posting is None:
+                return []
+            postings.append(posting)
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates.intersection_update(posting)
+            if not candidates:
+                return []
+        # Триграммы не гарантируют непрерывность подстроки: проверяем кандидатов
+        return sorted(position for position in candidates if query in self._texts[position])
+
+    def search(self, query: str, limit: int = SEARCH_PAGE_SIZE, offset: int = 0) -> Tuple[List[str], int]:
+        """
+        Ищет счета по подстроке ID, имени покупателя или компании (без учета регистра).
+
+        Точное совпадение ID выводится первым, остальные — в порядке данных.
+
+        Args:
+            query (str): Строка поиска; пустая строка возвращает все счета.
+            limit (int): Размер страницы результатов.
+            offset (int): Смещение страницы.
+
+        Returns:
+            Tuple[List[str], int]: ID счетов страницы и общее число найденных.
+        """
+        query = query.strip().lower()
+        if not query:
+            return self.ids[offset:offset + limit], len(self.ids)
+        positions = self._match_positions(query)
+        exact = next((position for position in positions if self.ids[position].lower() == query), None)
+        if exact is not None:
+            positions.remove(exact)
+            positions.insert(0, exact)
+        return [self.ids[position] for position in positions[offset:offset + limit]], len(positions)
+
+    def select_range(self, first_id: str, last_id: str) -> List[str]:
+        """
+        Выбирает счета с ID в диапазоне (включительно, в лексикографическом порядке).
+
+        Args:
+            first_id (str): Начало диапазона.
+            last_id (str): Конец диапазона.
+
+        Returns:
+            List[str]: ID счетов в порядке данных.
+        """
+        start = bisect_left(self._sorted_ids, first_id)
+        end = bisect_right(self._sorted_ids, last_id)
+        return [self.ids[position] for position in sorted(self._sorted_positions[start:end])]
+
+    def select_pattern(self, pattern: str) -> List[str]:
+        """
+        Выбирает счета по шаблону ID с символами *, ? и [...] (с учетом регистра).
+
+        Args:
+            pattern (str): Шаблон, например INV-2025-1*.
+
+        Returns:
+            List[str]: ID счетов в порядке данных.
+        """
+        # Префикс до первого спецсимвола сужает проверку до диапазона отсортированных ID
+        cut = min((pattern.index(char) for char in GLOB_CHARS if char in pattern), default=len(pattern))
+        prefix = pattern[:cut]
+        start = bisect_left(self._sorted_ids, prefix)
+        end = bisect_right(self._sorted_ids, prefix + '\uffff', lo=start) if prefix else len(self._sorted_ids)
+        positions = [position for invoice_id, position in zip(self._sorted_ids[start:end], self._sorted_positions[start:end])
+                     if fnmatchcase(invoice_id, pattern)]
+        return [self.ids[position] for position in sorted(positions)]
+
+    def select(self, expression: str) -> List[str]:
+        """
+        Выбирает счета по выражению: диапазону (A..B), шаблону (INV-2025-1*) или точному ID.
+
+        Args:
+            expression (str): Выражение выбора.
+
+        Returns:
+            List[str]: ID счетов в порядке данных.
+        """
+        expression = expression.strip()
+        if RANGE_SEPARATOR in expression:
+            first_id, last_id = (part.strip() for part in expression.split(RANGE_SEPARATOR, 1))
+            return self.select_range(first_id, last_id)
+        # Выражение без спецсимволов — шаблон, совпадающий только с самим ID
+        return self.select_pattern(expression) if expression else []
+
+
+def merge_selection(ids: List[str], selected: List[str], added: List[str]) -> List[str]:
+    """
+    Добавляет счета к выбору, сохраняя порядок данных и исключая повторы.
+
+    Args:
+        ids (List[str]): Все ID счетов в порядке данных.
+        selected (List[str]): Текущий выбор.
+        added (List[str]): Добавляемые ID.
+
+    Returns:
+        List[str]: Объединенный выбор.
+    """
+    chosen = set(selected)
+    chosen.update(added)
+    return [invoice_id for invoice_id in ids if invoice_id in chosen]
@@ -0,0 +1,131 @@
+"""
+Модуль снимков контекста рендеринга и пакетного пересоздания PDF из истории.
+
+При каждой генерации данные счета и версия шаблона сохраняются в базе в сжатом
+виде. Одинаковые снимки хранятся один раз: ключ снимка — хеш содержимого
+счета, ключ шаблона — хеш его исходного кода. Пересоздание берет данные и шаблон
+из снимков и не обращается к исходным файлам, которые могли измениться или
+быть удалены.
+"""
+
+from typing import Callable, Dict, List, Optional, Tuple, TYPE_CHECKING
+import json
+import zlib
+
+if TYPE_CHECKING:
+    import jinja2  # Только для аннотаций: Jinja2 загружается при первой компиляции шаблона
+
+from data_parser import compute_invoice_hash
+from database import (save_render_snapshot, get_render_snapshot, save_template_version, get_template_version,
+                      get_history_records)
+from pdf_generator import template_from_source
+
+
+# Уровень сжатия zlib для снимков и шаблонов
+SNAPSHOT_COMPRESSION_LEVEL = 6
+
+# Версии шаблонов, уже сохраненные этим процессом
+_saved_templates = set()
+
+
+def save_snapshot(invoice_data: Dict, template: 'jinja2.Template') -> Tuple[str, Optional[str]]:
+    """
+    Сохраняет снимок данных счета и версию шаблона для последующего пересоздания PDF.
+
+    Args:
+        invoice_data (Dict): Данные счета, переданные в шаблон.
+        template (jinja2.Template): Шаблон из load_template.
+
+    Returns:
+        Tuple[str, Optional[str]]: Хеш содержимого счета и версия шаблона
+            (None, если исходный код шаблона неизвестен).
+    """
+    content_hash = compute_invoice_hash(invoice_data)
+    context = json.dumps(invoice_data, ensure_ascii=False, default=str).encode('utf-8')
+    save_render_snapshot(content_hash, zlib.compress(context, SNAPSHOT_COMPRESSION_LEVEL))
+
+    template_hash = getattr(template, 'source_hash', None)
+    source = getattr(template, 'source', None)
+    if template_hash is None or source is None:
+        return content_hash, None
+    if template_hash not in _saved_templates:
+        save_template_version(template_hash, template.name, zlib.compress(source.encode('utf-8'), SNAPSHOT_COMPRESSION_LEVEL))
+        _saved_templates.add(template_hash)
+    return content_hash, template_hash
+
+
+def load_snapshot(content_hash: str) -> Dict:
+    """
+    Загружает снимок данных счета.
+
+    Args:
+        content_hash (str): Хеш содержимого счета.
+
+    Returns:
+        Dict: Данные счета или пустой словарь, если снимок не найден.
+    """
+    context = get_render_snapshot(content_hash) if content_hash else None
+    return json.loads(zlib.decompress(context).decode('utf-8')) if context else {}
+
+
+def load_template_version(template_hash: str) -> Optional['jinja2.Template']:
+    """
+    Загружает сохраненную версию шаблона.
+
+    Args:
+        template_hash (str): Версия шаблона.
+
+    Returns:
+        Optional[jinja2.Template]: Шаблон или None, если версия не найдена.
+    """
+    version = get_template_version(template_hash) if template_hash else {}
+    if not version:
+        return None
+    return template_from_source(version['template_name'], zlib.decompress(version['source']).decode('utf-8'))
+
+
+def regenerate_records(record_ids: List[int], profile: str = None, owner: str = 'default',
+                       on_progress: Callable[[int, int, str, Optional[float]], None] = None) -> Dict:
+    """
+    Пересоздает PDF выбранных записей истории из снимков через пакетный движок.
+
+    Записи группируются по файлу данных и версии шаблона, каждая группа — отдельный
+    пакет с контрольными точками. Если выбрано несколько записей одного счета
+    в группе, пересоздается самая новая.
+
+    Args:
+        record_ids (List[int]): ID записей истории.
+        profile (str, optional): Профиль оптимизации PDF.
+        owner (str): Пользователь или сессия для очереди планировщика рендеринга.
+        on_progress (Callable, optional): Прогресс каждого пакета (см. run_batch).
+
+    Returns:
+        Dict: batches — ID созданных пакетов, missing — ID записей без снимка данных или шаблона,
+            done и failed — число пересозданных и не пересозданных счетов во всех пакетах.
+    """
+    from batch_runner import start_batch, run_batch  # Импорт здесь для избежания циклических зависимостей
+
+    groups = {}
+    missing = []
+    for record in get_history_records(record_ids):
+        if not record.get('content_hash') or not record.get('template_hash'):
+            missing.append(record['id'])
+            continue
+        group = groups.setdefault((record['data_file'], record['template_hash']), {})
+        # Записи идут от новых к старым: для каждого счета берется самая новая
+        group.setdefault(record['invoice_id'], record)
+
+    batches = []
+    counts = {'done': 0, 'failed': 0}
+    for (data_file, template_hash), records in groups.items():
+        template = load_template_version(template_hash)
+        data = [load_snapshot(record['content_hash']) for record in records.values()]
+        if template is None or not all(data):
+            missing.extend(record['id'] for record in records.values())
+            continue
+        batch_id = start_batch(data_file, template.name, list(records), profile, kind='regenerate')
+        run = run_batch(batch_id, data, template, on_progress=on_progress, owner=owner)
+        for status in counts:
+            counts[status] += run['counts'].get(status, 0)
+        batches.append(batch_id)
+    return {'batches': batches, 'missing': missing, **counts}
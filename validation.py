@@ -0,0 +1,224 @@
+"""
+Модуль валидации данных счетов по схеме.
+
+Схема компилируется один раз; DataFrame проверяется векторными операциями над
+колонками, JSON записи — за один проход. Результат — полный отчет об ошибках
+с номерами строк, а не только первая найденная проблема.
+"""
+
+from typing import Dict, List, Optional
+import re
+
+import numpy as np
+import pandas as pd
+
+from compact import CompactOrders
+
+
+# Схема данных счетов
+INVOICE_SCHEMA = {
+    'required': ['invoice_id', 'customer_name', 'date'],
+    'items_key': 'items',
+    'item_required': ['product_name', 'quantity', 'price'],
+    'item_numeric': ['quantity', 'price'],
+    # Соответствие полей товара суффиксам плоских CSV колонок item_<N>_<суффикс>
+    'item_columns': {'product_name': 'name', 'quantity': 'qty', 'price': 'price'},
+}
+
+ITEM_COLUMN_RE = re.compile(r'^item_(\d+)_(.+)$')
+
+
+def make_error(row: Optional[int], field: Optional[str], message: str) -> Dict:
+    """
+    Формирует запись отчета об ошибках.
+
+    Args:
+        row (Optional[int]): Номер строки/записи (с нуля) или None для ошибок структуры.
+        field (Optional[str]): Имя поля или колонки.
+        message (str): Описание ошибки.
+
+    Returns:
+        Dict: Запись {'row', 'field', 'message'}.
+    """
+    return {'row': row, 'field': field, 'message': message}
+
+
+def _rows(mask: pd.Series) -> List[int]:
+    """Возвращает позиционные номера строк, для которых маска истинна."""
+    return np.flatnonzero(mask.to_numpy(dtype=bool)).tolist()
+
+
+class CompiledSchema:
+    """
+    Скомпилированная схема: списки и множества полей, подготовленные для быстрых проверок.
+    """
+
+    def __init__(self, schema: Dict):
+        self.required = list(schema['required'])
+        self.items_key = schema['items_key']
+        self.item_required = list(schema['item_required'])
+        self.item_numeric = set(schema['item_numeric'])
+        self.item_columns = dict(schema['item_columns'])
+        self.record_required = self.required + [self.items_key]
+        # Обратное соответствие: суффикс CSV колонки -> поле товара
+        self.item_fields_by_suffix = {suffix: field for field, suffix in self.item_columns.items()}
+
+    def validate_dataframe(self, df: pd.DataFrame) -> List[Dict]:
+        """
+        Проверяет DataFrame векторными операциями над колонками.
+
+        Args:
+            df (pd.DataFrame): Данные в плоском формате (колонки item_<N>_<поле>).
+
+        Returns:
+            List[Dict]: Список ошибок.
+        """
+        missing = [col for col in self.required if col not in df.columns]
+        if missing:
+            return [make_error(None, None, f"Missing columns: {', '.join(missing)}")]
+        if df.empty:
+            return [make_error(None, None, "DataFrame is empty")]
+
+        errors = []
+        for col in self.required:
+            values = df[col]
+            empty = values.isna() | (values.astype(str).str.strip() == '')
+            for row in _rows(empty):
+                errors.append(make_error(row, col, "Required value is empty"))
+
+        # Группируем колонки товаров по номеру: {N: {поле: колонка}}
+        groups = {}
+        for col in df.columns:
+            match = ITEM_COLUMN_RE.match(str(col))
+            if match and match.group(2) in self.item_fields_by_suffix:
+                groups.setdefault(match.group(1), {})[self.item_fields_by_suffix[match.group(2)]] = col
+
+        for columns in groups.values():
+            # Товар присутствует в строке, если заполнено хотя бы одно его поле
+            present = pd.concat([df[col].notna() for col in columns.values()], axis=1).any(axis=1)
+            for field in self.item_required:
+                col = columns.get(field)
+                if col is None:
+                    errors.extend(make_error(row, field, "Item field column is missing") for row in _rows(present))
+                    continue
+                values = df[col]
+                missing_value = present & values.isna()
+                for row in _rows(missing_value):
+                    errors.append(make_error(row, col, "Item value is empty"))
+                if field in self.item_numeric:
+                    numeric = pd.to_numeric(values, errors='coerce')
+                    not_number = values.notna() & numeric.isna()
+                    negative = numeric < 0
+                    for row in _rows(not_number):
+                        errors.append(make_error(row, col, f"Not a number: {values.iloc[row]!r}"))
+                    for row in _rows(negative):
+                        errors.append(make_error(row, col, f"Negative value: {values.iloc[row]!r}"))
+        errors.sort(key=lambda error: (error['row'] is not None, error['row'] or 0))
+        return errors
+
+    def validate_records(self, records: List) -> List[Dict]:
+        """
+        Проверяет список JSON записей за один проход.
+
+        Args:
+            records (List): Список словарей счетов.
+
+        Returns:
+            List[Dict]: Список ошибок.
+        """
+        if not records:
+            return [make_error(None, None, "Data list is empty")]
+        errors = []
+        for row, record in enumerate(records):
+            if not isinstance(record, dict):
+                errors.append(make_error(row, None, "Data items must be dictionaries"))
+                continue
+            missing = [key for key in self.record_required if key not in record]
+            if missing:
+                errors.append(make_error(row, None, f"Missing keys in item: {', '.join(missing)}"))
+            items = record.get(self.items_key, [])
+            if not isinstance(items, list):
+                errors.append(make_error(row, self.items_key, "Items must be a list"))
+                continue
+            for index, item in enumerate(items):
+                field_prefix = f"{self.items_key}[{index}]"
+                if not isinstance(item, dict) or any(key not in item for key in self.item_required):
+                    errors.append(make_error(row, field_prefix, "Invalid item structure"))
+                    continue
+                for key in self.item_numeric:
+                    value = item[key]
+                    if isinstance(value, bool) or not isinstance(value, (int, float)):
+                        errors.append(make_error(row, f"{field_prefix}.{key}", f"Not a number: {value!r}"))
+                    elif value < 0:
+                        errors.append(make_error(row, f"{field_prefix}.{key}", f"Negative value: {value!r}"))
+        return errors
+
+    def validate(self, data) -> List[Dict]:
+        """
+        Проверяет данные любого поддерживаемого типа.
+
+        Args:
+            data: DataFrame или список словарей.
+
+        Returns:
+            List[Dict]: Список ошибок; пустой список означает валидные данные.
+        """
+        if isinstance(data, pd.DataFrame):
+            return self.validate_dataframe(data)
+        elif isinstance(data, (list, CompactOrders)):
+            return self.validate_records(data)
+        return [make_error(None, None, "Invalid data type")]
+
+
+# Кеш скомпилированных схем: {id схемы: (схема, скомпилированная схема)}
+_compiled_schemas: Dict[int, tuple] = {}
+
+
+def compile_schema(schema: Dict = None) -> CompiledSchema:
+    """
+    Компилирует схему валидации, кешируя результат.
+
+    Args:
+        schema (Dict, optional): Схема; по умолчанию INVOICE_SCHEMA.
+
+    Returns:
+        CompiledSchema: Скомпилированная схема.
+    """
+    schema = schema or INVOICE_SCHEMA
+    cached = _compiled_schemas.get(id(schema))
+    if cached is None or cached[0] is not schema:
+        cached = (schema, CompiledSchema(schema))
+        _compiled_schemas[id(schema)] = cached
+    return cached[1]
+
+
+def validate_data(data, schema: Dict = None) -> List[Dict]:
+    """
+    Валидирует данные и возвращает полный отчет об ошибках.
+
+    Args:
+        data: DataFrame или список словарей.
+        schema (Dict, optional): Схема; по умолчанию INVOICE_SCHEMA.
+
+    Returns:
+        List[Dict]: Список ошибок {'row', 'field', 'message'}.
+    """
+    return compile_schema(schema).validate(data)
+
+
+def format_error(error: Dict) -> str:
+    """
+    Форматирует запись отчета об ошибке в строку.
+
+    Args:
+        error (Dict): Запись отчета.
+
+    Returns:
+        str: Текст ошибки с номером строки и полем, если они известны.
+    """
+    location = []
+    if error['row'] is not None:
+        location.append(f"row {error['row']}")
+    if error['field']:
+        location.append(error['field'])
+    return f"{', '.join(location)}: {error['message']}" if location else error['message']
@@ -0,0 +1,353 @@
+"""
+Служба наблюдения за директорией /data.
+
+Обнаруживает новые и измененные файлы данных, дожидается окончания записи
+(серия изменений объединяется в одно событие), валидирует только новые и
+измененные записи и рендерит их шаблоном по умолчанию, записывая результаты
+в историю генераций. Из дописанного CSV файла читаются только новые строки;
+для остальных изменений записи сравниваются с прошлой обработкой по хешам
+содержимого (для JSON — по байтовым диапазонам индекса смещений). Состояние
+файлов хранится в памяти службы: после перезапуска первый проход проверяет
+файлы целиком, а неизмененные счета не рендерятся повторно благодаря истории. Очередь файлов ограничена: пока рендеринг не успевает,
+новые события копятся в списке ожидания, а не запускают параллельную работу.
+
+Использование:
+    python watcher.py [--template invoice_template.html] [--profile email]
+"""
+
+from typing import Dict, List, Optional, Tuple
+import argparse
+import hashlib
+import io
+import json
+import mmap
+import os
+import queue
+import threading
+import time
+
+import pandas as pd
+
+from data_parser import DATA_EXTENSIONS, parse_data_file, parse_csv_with_format, iter_invoice_data, load_json_index
+from database import init_database, add_generation_record, get_latest_content_hashes
+from output_store import store_document
+from pdf_generator import load_template, render_pdf, plan_incremental_batch, DEFAULT_PDF_PROFILE
+from validation import validate_data
+from snapshots import save_snapshot
+
+
+DATA_DIR = 'data'
+
+# Шаблон по умолчанию для автоматического рендеринга
+DEFAULT_TEMPLATE = 'invoice_template.html'
+
+# Интервал опроса директории, в секундах
+POLL_INTERVAL = 1.0
+
+# Сколько секунд файл должен оставаться неизменным, прежде чем он будет обработан
+SETTLE_SECONDS = 2.0
+
+# Максимальное число файлов, ожидающих рендеринга
+MAX_QUEUED_FILES = 4
+
+# Число байт перед концом обработанной части CSV файла, по которым проверяется, что файл только дописан
+CSV_TAIL_BYTES = 4096
+
+
+def row_invoice_ids(data) -> List[Optional[str]]:
+    """
+    Возвращает ID счетов по позициям строк/записей (None для записей без ID).
+
+    Args:
+        data: DataFrame или список словарей.
+
+    Returns:
+        List[Optional[str]]: ID счета для каждой позиции.
+    """
+    if isinstance(data, list):
+        return [str(record['invoice_id']) if isinstance(record, dict) and 'invoice_id' in record else None
+                for record in data]
+    if 'invoice_id' not in data.columns:
+        return [None] * len(data)
+    return data['invoice_id'].astype(str).tolist()
+
+
+def changed_rows(df: pd.DataFrame, previous: Dict[str, int]) -> Tuple[pd.DataFrame, Dict[str, int]]:
+    """
+    Отбирает строки DataFrame, новые или измененные с прошлой обработки.
+
+    Args:
+        df (pd.DataFrame): Данные файла (с колонкой invoice_id).
+        previous (Dict[str, int]): Хеши строк прошлой обработки {ID счета: хеш}.
+
+    Returns:
+        Tuple[pd.DataFrame, Dict[str, int]]: Новые и измененные строки и хеши всех строк;
+            при повторах ID учитывается первая строка, как и в get_invoice_data.
+    """
+    current = {}
+    positions = []
+    hashes = pd.util.hash_pandas_object(df, index=False)
+    for position, (invoice_id, value) in enumerate(zip(df['invoice_id'].astype(str), hashes)):
+        if invoice_id in current:
+            continue
+        current[invoice_id] = int(value)
+        if previous.get(invoice_id) != current[invoice_id]:
+            positions.append(position)
+    return df.iloc[positions], current
+
+
+def changed_json_records(filepath: str, previous: Dict[str, str]) -> Tuple[List[Dict], Dict[str, str]]:
+    """
+    Разбирает только новые и измененные записи JSON файла заказов.
+
+    Записи сравниваются по хешу своих байтов из индекса смещений, поэтому
+    неизмененные записи не декодируются.
+
+    Args:
+        filepath (str): Путь к JSON файлу.
+        previous (Dict[str, str]): Хеши записей прошлой обработки {ID счета: хеш}.
+
+    Returns:
+        Tuple[List[Dict], Dict[str, str]]: Новые и измененные записи и хеши всех записей.
+    """
+    index = load_json_index(filepath)
+    current = {}
+    records = []
+    with open(filepath, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for invoice_id, (start, end) in index.items():
+                current[invoice_id] = hashlib.sha1(mm[start:end]).hexdigest()
+                if previous.get(invoice_id) != current[invoice_id]:
+                    records.append(json.loads(mm[start:end]))
+    return records, current
+
+
+def _csv_tail(filepath: str, offset: int) -> Optional[str]:
+    """Возвращает хеш последних байт до offset или None, если на offset не заканчивается строка."""
+    start = max(0, offset - CSV_TAIL_BYTES)
+    with open(filepath, 'rb') as f:
+        f.seek(start)
+        tail = f.read(offset - start)
+    if tail and not tail.endswith(b'\n'):
+        return None
+    return hashlib.sha1(tail).hexdigest()
+
+
+def read_csv_appended(filepath: str, state: Dict, size: int) -> Optional[pd.DataFrame]:
+    """
+    Читает строки, дописанные в конец CSV файла после прошлой обработки.
+
+    Args:
+        filepath (str): Путь к CSV файлу.
+        state (Dict): Состояние прошлой обработки (offset, tail, columns, encoding, delimiter).
+        size (int): Текущий размер файла.
+
+    Returns:
+        Optional[pd.DataFrame]: Дописанные строки или None, если файл изменен не только дописыванием.
+    """
+    offset = state.get('offset')
+    if offset is None or state.get('tail') is None or size < offset or _csv_tail(filepath, offset) != state['tail']:
+        return None
+    with open(filepath, 'rb') as f:
+        f.seek(offset)
+        chunk = f.read(size - offset)
+    if not chunk.strip():
+        return pd.DataFrame(columns=state['columns'])
+    return pd.read_csv(io.BytesIO(chunk), header=None, names=state['columns'],
+                       encoding=state['encoding'], sep=state['delimiter'])
+
+
+class DataFolderWatcher:
+    """
+    Наблюдатель за директорией данных с объединением событий и ограниченной очередью.
+    """
+
+    def __init__(self, template_name: str = DEFAULT_TEMPLATE, profile: str = None,
+                 poll_interval: float = POLL_INTERVAL, settle_seconds: float = SETTLE_SECONDS,
+                 max_queued: int = MAX_QUEUED_FILES):
+        self.template_name = template_name
+        self.profile = profile
+        self.poll_interval = poll_interval
+        self.settle_seconds = settle_seconds
+        self._queue = queue.Queue(maxsize=max_queued)
+        # Последняя обработанная версия файла: {имя: (размер, mtime)}
+        self._processed: Dict[str, tuple] = {}
+        # Состояние обработанного содержимого: {имя: {'hashes': хеши записей, ...}} (см. read_changes)
+        self._file_state: Dict[str, Dict] = {}
+        # Изменившиеся файлы, ожидающие стабилизации: {имя: ((размер, mtime), время последнего изменения)}
+        self._pending: Dict[str, tuple] = {}
+        self._queued = set()
+        self._stop_event = threading.Event()
+
+    def scan(self) -> None:
+        """
+        Сканирует директорию, обновляет список ожидания и ставит стабильные файлы в очередь.
+        """
+        now = time.monotonic()
+        if not os.path.exists(DATA_DIR):
+            return
+        with os.scandir(DATA_DIR) as it:
+            for entry in it:
+                if not entry.is_file() or not entry.name.endswith(DATA_EXTENSIONS):
+                    continue
+                stat = entry.stat()
+                version = (stat.st_size, stat.st_mtime)
+                if self._processed.get(entry.name) == version:
+                    self._pending.pop(entry.name, None)
+                    continue
+                pending = self._pending.get(entry.name)
+                if pending is None or pending[0] != version:
+                    # Новое изменение: перезапускаем отсчет стабилизации
+                    self._pending[entry.name] = (version, now)
+
+        for filename, (version, changed_at) in list(self._pending.items()):
+            if now - changed_at < self.settle_seconds or filename in self._queued:
+                continue
+            try:
+                self._queue.put_nowait((filename, version))
+            except queue.Full:
+                # Обратное давление: файл остается в списке ожидания до следующего сканирования
+                break
+            self._queued.add(filename)
+            del self._pending[filename]
+
+    def read_changes(self, filename: str) -> Tuple[object, Dict]:
+        """
+        Читает новые и измененные с прошлой обработки записи файла.
+
+        Args:
+            filename (str): Имя файла в /data.
+
+        Returns:
+            Tuple[object, Dict]: Записи (DataFrame или список словарей) и новое состояние файла.
+        """
+        filepath = os.path.join(DATA_DIR, filename)
+        state = self._file_state.get(filename, {})
+        previous = state.get('hashes', {})
+        if filename.endswith('.json'):
+            records, hashes = changed_json_records(filepath, previous)
+            return records, {'hashes': hashes}
+
+        extra = {}
+        if filename.endswith('.csv'):
+            size = os.path.getsize(filepath)
+            appended = read_csv_appended(filepath, state, size)
+            if appended is not None and 'invoice_id' in appended.columns:
+                # Повторы уже обработанных ID не рендерятся: действует первая запись файла
+                appended = appended[~appended['invoice_id'].astype(str).isin(previous)]
+                data, hashes = changed_rows(appended, {})
+                return data, dict(state, offset=size, tail=_csv_tail(filepath, size), hashes={**previous, **hashes})
+            data, encoding, delimiter = parse_csv_with_format(filepath)
+            extra = {'offset': size, 'tail': _csv_tail(filepath, size), 'columns': list(data.columns),
+                     'encoding': encoding, 'delimiter': delimiter}
+        else:
+            data = parse_data_file(filepath)
+        if 'invoice_id' not in data.columns:
+            # Структурную ошибку сообщит валидация
+            return data, {}
+        data, hashes = changed_rows(data, previous)
+        return data, dict(extra, hashes=hashes)
+
+    def process_file(self, filename: str) -> Dict:
+        """
+        Валидирует новые и измененные записи файла и рендерит их счета.
+
+        Строки с ошибками валидации пропускаются; при структурных ошибках файл не обрабатывается.
+        Счета, которые не удалось сгенерировать, проверяются снова при следующем изменении файла.
+
+        Args:
+            filename (str): Имя файла в /data.
+
+        Returns:
+            Dict: Итоги обработки (rendered, reused, invalid, failed).
+        """
+        data, state = self.read_changes(filename)
+        if not len(data):
+            self._file_state[filename] = state
+            return {'rendered': 0, 'reused': 0, 'invalid': 0, 'failed': 0}
+        errors = validate_data(data)
+        if any(error['row'] is None for error in errors):
+            raise ValueError(errors[0]['message'])
+        ids_by_row = row_invoice_ids(data)
+        invalid = {ids_by_row[error['row']] for error in errors}
+        invoice_ids = [invoice_id for invoice_id in dict.fromkeys(ids_by_row)
+                       if invoice_id is not None and invoice_id not in invalid]
+
+        template = load_template(self.template_name)
+        previous = get_latest_content_hashes(filename, self.template_name)
+        to_render, reused, _ = plan_incremental_batch(invoice_ids, data, previous, template.source_hash, self.profile)
+        summary = {'rendered': 0, 'reused': len(reused), 'invalid': len(invalid), 'failed': 0}
+        for invoice_id, invoice_data in iter_invoice_data(data, to_render):
+            document = store_document(invoice_id, lambda path: render_pdf(template, invoice_data, path, profile=self.profile))
+            if document:
+                document_id, output_path = document
+                content_hash, template_hash = save_snapshot(invoice_data, template)
+                add_generation_record(invoice_id, invoice_data.get('customer_name', ''), filename, self.template_name,
+                                      output_path, 'success', content_hash=content_hash, document_id=document_id,
+                                      template_hash=template_hash, profile=self.profile or DEFAULT_PDF_PROFILE)
+                summary['rendered'] += 1
+            else:
+                add_generation_record(invoice_id, invoice_data.get('customer_name', ''), filename, self.template_name,
+                                      '', 'error', 'Generation failed')
+                summary['failed'] += 1
+                state.get('hashes', {}).pop(invoice_id, None)
+        if summary['failed']:
+            # Следующее изменение перечитывает файл целиком, чтобы повторить неудавшиеся счета
+            state.pop('offset', None)
+        self._file_state[filename] = state
+        return summary
+
+    def _render_loop(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                filename, version = self._queue.get(timeout=self.poll_interval)
+            except queue.Empty:
+                continue
+            started = time.monotonic()
+            try:
+                summary = self.process_file(filename)
+                print(f"{filename}: {summary} за {time.monotonic() - started:.1f} с")
+            except Exception as e:
+                print(f"Error processing {filename}: {e}")
+            finally:
+                # Версия считается обработанной и при ошибке: повторная попытка — после следующего изменения файла
+                self._processed[filename] = version
+                self._queued.discard(filename)
+                self._queue.task_done()
+
+    def run(self) -> None:
+        """
+        Запускает наблюдение до вызова stop (или прерывания с клавиатуры).
+        """
+        init_database()
+        worker = threading.Thread(target=self._render_loop, daemon=True)
+        worker.start()
+        try:
+            while not self._stop_event.is_set():
+                self.scan()
+                self._stop_event.wait(self.poll_interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._stop_event.set()
+            worker.join()
+
+    def stop(self) -> None:
+        """
+        Останавливает наблюдение.
+        """
+        self._stop_event.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Автоматический рендеринг новых файлов из /data")
+    parser.add_argument('--template', default=DEFAULT_TEMPLATE, help="Шаблон для рендеринга")
+    parser.add_argument('--profile', default=None, help="Профиль оптимизации PDF")
+    parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL, help="Интервал опроса, с")
+    parser.add_argument('--settle', type=float, default=SETTLE_SECONDS, help="Время стабилизации файла, с")
+    args = parser.parse_args()
+    DataFolderWatcher(args.template, args.profile, args.poll_interval, args.settle).run()
+
+
+if __name__ == '__main__':
+    main()